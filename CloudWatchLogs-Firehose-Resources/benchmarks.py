@@ -0,0 +1,53 @@
+import os, importlib, timeit, json, base64
+
+# Set environment variables before importing the function to benchmark
+benchmarkEnvironment = {"SPLUNK_SOURCE": "841154226728", "SPLUNK_SOURCETYPE": "aws:cloudtrail", "SPLUNK_HOST": "841154226728", "SPLUNK_INDEX": "aws"}
+for variable in benchmarkEnvironment.keys():
+	os.environ.setdefault(variable, benchmarkEnvironment[variable])
+
+lambda_module = importlib.import_module('lambda')
+
+recordCount = 2000
+logEvents = [{"id": str(index), "timestamp": 1673385833973 + index, "message": '{"eventVersion":"1.08","userIdentity":{"type":"AWSService","invokedBy":"cloudtrail.amazonaws.com"},"eventTime":"2023-01-10T21:23:53Z","eventSource":"s3.amazonaws.com","eventName":"GetBucketAcl","awsRegion":"us-west-2","requestID":"' + str(index) + '"}'} for index in range(100)]
+
+
+# Build a record's events by growing a string, the way the handler did before the envelope encoder
+def concatenateRecord(logEvents):
+
+	formattedEvents = ""
+	for logEvent in logEvents:
+		formattedEvents += '{ "time": ' +  str(logEvent['timestamp']) + ', "host": "' + lambda_module.SPLUNK_HOST + '", "source": "' + lambda_module.SPLUNK_SOURCE + '", "sourcetype": "' + lambda_module.SPLUNK_SOURCETYPE + '", "index": "' + lambda_module.SPLUNK_INDEX + '", "event": ' + json.dumps(logEvent['message']) + '}'
+
+	return base64.b64encode(formattedEvents.encode('utf-8')).decode()
+
+
+# Build a record's events into a buffer with the envelope encoder, the way the handler does now
+def encodeRecord(logEvents):
+
+	formattedEvents = bytearray()
+	for logEvent in logEvents:
+		formattedEvents += lambda_module.encodeEvent(lambda_module.eventEnvelope, logEvent['timestamp'], logEvent['message'])
+
+	return base64.b64encode(formattedEvents).decode()
+
+
+# Time building records both ways, and verify they're identical
+def benchmarkEventEnvelope():
+
+	if encodeRecord(logEvents) != concatenateRecord(logEvents):
+		raise Exception("Envelope encoder output doesn't match concatenation")
+
+	concatenateTime = timeit.timeit(lambda: concatenateRecord(logEvents), number=recordCount)
+	encodeTime = timeit.timeit(lambda: encodeRecord(logEvents), number=recordCount)
+	printResult("CloudWatch Logs HEC envelope", concatenateTime, encodeTime)
+
+
+# Print events per second and the speedup
+def printResult(name, oldTime, newTime):
+
+	eventCount = recordCount * len(logEvents)
+	print(name + ": " + str(round(eventCount / oldTime)) + " events/sec before, " + str(round(eventCount / newTime)) + " events/sec after, " + str(round(oldTime / newTime, 2)) + "x faster")
+
+
+if __name__ == "__main__":
+	benchmarkEventEnvelope()
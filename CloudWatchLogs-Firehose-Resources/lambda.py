@@ -1,39 +1,132 @@
-import os, gzip, json, base64
+import os, gzip, json, base64, time
 
 SPLUNK_SOURCE = os.environ['SPLUNK_SOURCE']
 SPLUNK_SOURCETYPE = os.environ['SPLUNK_SOURCETYPE']
 SPLUNK_HOST = os.environ['SPLUNK_HOST']
 SPLUNK_INDEX = os.environ['SPLUNK_INDEX']
 
+LAMBDA_LOG_LEVEL = os.environ.get('LAMBDA_LOG_LEVEL', "INFO")
+LAMBDA_LOG_LINE_BUDGET = os.environ.get('LAMBDA_LOG_LINE_BUDGET', "0")
+
+encodeJSON = json.JSONEncoder().encode
+logLevels = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+logExampleCount = 3
+logExampleLength = 256
+logSummaryInterval = 60
+logState = {"lines": 0, "suppressed": 0, "repeated": {}, "lastSummary": time.time()}
+
+# Print a log line if its level is enabled, counting it against the invocation's line budget
+def log(message, level="INFO"):
+
+	if logLevels.get(level, logLevels["INFO"]) < logLevels.get(LAMBDA_LOG_LEVEL, logLevels["INFO"]):
+		return
+
+	if int(LAMBDA_LOG_LINE_BUDGET) > 0 and logState["lines"] >= int(LAMBDA_LOG_LINE_BUDGET):
+		logState["suppressed"] += 1
+		return
+	logState["lines"] += 1
+
+	print(message)
+
+
+# Count a message that can repeat for every record, keeping a few examples, instead of printing it each time. The counts are printed as a summary every logSummaryInterval seconds and at the end of the invocation.
+def logRepeated(message, example="", level="WARNING"):
+
+	if logLevels.get(level, logLevels["INFO"]) < logLevels.get(LAMBDA_LOG_LEVEL, logLevels["INFO"]):
+		return
+
+	if message not in logState["repeated"]:
+		logState["repeated"][message] = {"count": 0, "examples": []}
+
+	repeated = logState["repeated"][message]
+	repeated["count"] += 1
+	if len(example) > 0 and len(repeated["examples"]) < logExampleCount:
+		repeated["examples"].append(example[:logExampleLength])
+
+	if time.time() - logState["lastSummary"] >= logSummaryInterval:
+		flushLogSummaries()
+
+
+# Print a summary line for each repeated message counted since the last summary. Summaries aren't held to the line budget, since there's at most one per message each interval.
+def flushLogSummaries():
+
+	for message, repeated in logState["repeated"].items():
+		summary = message + " (" + str(repeated["count"]) + " times)"
+		if len(repeated["examples"]) > 0:
+			summary += ". Examples: " + " | ".join(repeated["examples"])
+		print(summary)
+
+	logState["repeated"] = {}
+	logState["lastSummary"] = time.time()
+
+
+# Start counting log lines against the line budget for a new invocation
+def startInvocationLog():
+
+	logState["lines"] = 0
+	logState["suppressed"] = 0
+
+
+# Print the repeated messages left at the end of an invocation, and how many lines went over the line budget
+def finishInvocationLog():
+
+	flushLogSummaries()
+
+	if logState["suppressed"] > 0:
+		print("Suppressed " + str(logState["suppressed"]) + " log lines over the budget of " + LAMBDA_LOG_LINE_BUDGET + " lines for this invocation")
+
+
+# Build the Splunk HEC event format once as bytes, so only the time and event need to be encoded for each event
+def createEventEnvelope(host, source, sourcetype, index, eventSeparator, closing):
+
+	envelope = ', "host": "' + host + '", "source": "' + source + '", "sourcetype": "' + sourcetype + '", "index": "' + index + '", "event":' + eventSeparator
+	return b'{ "time": %b' + envelope.encode("utf-8").replace(b"%", b"%%") + b'%b' + closing.encode("utf-8").replace(b"%", b"%%")
+
+
+# Encode an event in the Splunk HEC event format
+def encodeEvent(envelope, timestamp, event):
+
+	return envelope % (str(timestamp).encode("utf-8"), encodeJSON(event).encode("utf-8"))
+
+
+# Build the HEC envelope once for all of the events
+eventEnvelope = createEventEnvelope(SPLUNK_HOST, SPLUNK_SOURCE, SPLUNK_SOURCETYPE, SPLUNK_INDEX, " ", "}")
+
 # Default Lambda handler
 def handler(event, context):
 
 	returnRecords = []
 
+	# Start counting log lines for this invocation
+	startInvocationLog()
+
 	# Decode events, and split into separate items in a list
 	for record in event['records']:
 
 		# Decode and uncompress raw log event
 		decodedData = json.loads(gzip.decompress(base64.b64decode(record['data'])))
 
-		formattedEvents = ""
+		formattedEvents = bytearray()
 		returnEvent = {}
 
 		# Loop through each log event, construct event, add to return array
 		for logEvent in decodedData['logEvents']:
 
 			# Format Splunk event
-			formattedEvents += '{ "time": ' +  str(logEvent['timestamp']) + ', "host": "' + SPLUNK_HOST + '", "source": "' + SPLUNK_SOURCE + '", "sourcetype": "' + SPLUNK_SOURCETYPE + '", "index": "' + SPLUNK_INDEX + '", "event": ' + json.dumps(logEvent['message']) + '}'
+			formattedEvents += encodeEvent(eventEnvelope, logEvent['timestamp'], logEvent['message'])
 		
 		# Construct return event
 		returnEvent['recordId'] = dict(record)['recordId']
 		returnEvent['result'] = "Ok"
-		returnEvent['data'] = base64.b64encode(formattedEvents.encode('utf-8')).decode()
+		returnEvent['data'] = base64.b64encode(formattedEvents).decode()
 
-		# Print for debugging
-		print("Processed record " + record['recordId'])
+		# Count the record for debugging, printing a summary instead of a line for every record
+		logRepeated("Processed record", record['recordId'], "INFO")
 
 		# Add return events to array to return all the records to Firehose
 		returnRecords.append(returnEvent)
 
+	# Print the records processed
+	finishInvocationLog()
+
 	return {'records': returnRecords}
@@ -1,4 +1,4 @@
-import unittest, os, importlib
+import unittest, os, importlib, io, contextlib
 
 
 class CloudWatchLogs_Firehose_Resources_Tests(unittest.TestCase):
@@ -14,6 +14,11 @@ class CloudWatchLogs_Firehose_Resources_Tests(unittest.TestCase):
 		# import lambda module to test
 		self.lambda_module = importlib.import_module('lambda')
 
+		# Reset vars in function that may have been overwritten during tests
+		self.lambda_module.LAMBDA_LOG_LEVEL = "INFO"
+		self.lambda_module.LAMBDA_LOG_LINE_BUDGET = "0"
+		self.lambda_module.logState = {"lines": 0, "suppressed": 0, "repeated": {}, "lastSummary": self.lambda_module.time.time()}
+
 
 	def test_one(self):
 
@@ -68,5 +73,25 @@ class CloudWatchLogs_Firehose_Resources_Tests(unittest.TestCase):
 
 		self.assertEqual(self.lambda_module.handler(testInput, "none"), expectedOutput)
 
+	def test_processedRecordLogging(self):
+
+		testInput = {'invocationId': 'becd65b6-252a-4e66-bbb1-1001c091abc3', 'deliveryStreamArn': 'arn:aws:firehose:us-west-2:841154226728:deliverystream/841154226728-us-west-2-lambdacloudtrail-firehose', 'region': 'us-west-2', 'records': [{'recordId': '49636824083378936888143884586489700312348099680449593346000000', 'approximateArrivalTimestamp': 1673385843089, 'data': 'H4sIAAAAAAAAANVU207bQBD9FcvqI8Z7mb3lzSGBVgoNxYZUXBQ5ziYyOHHwhQQQ/95xoOCqRRSpL/WL5ZmzZ86cmfWDu7BlGc9tdLeybsftBVEwPuyHYXDQd3fcfL20BYY1UCqAMamYxnCWzw+KvF5hxo/XpZ/Fi8k09tsory69tS0rj3lJltfTqojTzHsCerN6mVRpvnyiCqvCxgvkYoRxn1CfEv/80yCI+mF0CWY2kYzKCTcKuJwY4LGlM8K0igk1CinKelImRbpqGPfTrLJF6XbO3adae03xqCm+NxpE+V6RTjIvWWdh65BXsdG30+Fm3rvd7LuXW1H9W7usGp4HN52iNq44VUpQSrA/tu2SGkIpI6ANYAjFKTBSQ2OCAcq10JwA6qtS9LiKF2gXlYpvE9gN3/npPdKHUXAcOcf2pkbol2nH0WZKZiCZp6bEesIkxDNWcy/WQsSghcLHOcVWUX/HeXbrYuk+7vwmWBgtlZSKEiKE4iAEEMkU0ZJJQYiiSnBiKBO6IX1DMFAgbcFHRZ7gh506szSzTsk7/vvz94NROMjn5S9I/3VE/sshv7ULbfD4FTx+AY8bMM6CRAzncTbev2FH93qzGiRwfRWOhrtXZb7cnd//2R5lCEiOL0WZ4VJTAMZBaYIzMqABrcMhM2kIR+fesgfl/Rf2iLPx59Udue5+73aH3RMRhKP37MHWeVOBM6WNVtiykpxKSiVjeAHAaGo40xr9om/bo9r29L/2Prrs/0Ad+0t1x/2j4cdv40XVq4u42t5HJviuIs6ivKi6aZbhGrRzsE0c2kVe3Dlhem87Dv5WwDnsYjTeOM+ZE1wfLM238ab9y8cfXFONoq8FAAA='}, {'recordId': '49636824083378936888143884602226287706271729640464711682000000', 'approximateArrivalTimestamp': 1673385872981, 'data': 'H4sIAAAAAAAAANVUwW7bSAz9FUHYYxRxhpzhjG9u4mYXSNokdpNFm8CQrLGhQrayklwnLfrvSzvd1tvWqbvoZaGTSA7n8fG9+RDPQ9tmszB6uAtxLz7uj/rjs8Fw2D8ZxAdxvVqERsKOlDKktWXtJFzVs5OmXt5JJs1WbVpl87zI0u2qZNkmq9B2iU4mVb0suiYrq+SxMJkuF5OurBePrYZdE7K59NKgMQWVKkjf/HbaHw2Go1vy09xqZXP0TGhzT5gFNQXtOAPlWVq0y7ydNOXduuPzsupC08a9N/HjXUfry0fry4+uT0f1UVPmVTJZVcOtQ0mnry+uXt7Pjt/dP49vN6AG78KiW/f5EJeFYENGxWwUW288ACnjtITIMSnttbVOkWYiZzUKUIcKyCmvBV9XCsddNhe6lGVEZ5xF5/ngH+6l/XDUvxxFl+GvpZT+UfSiwAiBmJKscCExGHziJtM8yR1Jf022MCG6klEFfy/6xNbNIv548DVgRuGVBZYA8igI0SpnDFlmx1YGMg6B2XvHxjizAzCB8duAz5t6Ij+hiKZlFaIWe+mP95/2r4en9az9V2X6ZUXp50Pplha2i8dfisefi8frYlAKRlpp83o8PTcXD1eDV6uHRl3U+cXh27ZeHM7e76JHG7AIBsCLoJx35D0DoAHjPCBYa72knbEAu/ZJYGGbnsGL45/d5i9Ah3uiuxycv/x5ud10x8sm6zaCUxYPjY/m7U33rKwqkcF2jjaJszCvm4doWL4PEgRN0dkziWb30afMK5FPL3K4iX9vfIfiM7BedKuJ2ZIiYJGBTOtEDtYIMfJZIjTaKLtjfMteP2m2jHWGptBJNilk+gkWSc4+T6wPho0kxdl7mc0JDucEkUe24jpA5WRn4IFJgLDMYpmAyKORM7v2ZYX1/4vZXnSzP+vF+Vt18vui41P7lNmEHnkXUbhx2oHSMq00kt0Srh9WQiSj5FU3Bjeb300PPWG2fbb5C9CpPdF9a7a9AG6ZzahDq7/vNaP/o9VuP/4N69+DI/sHAAA='}]}
+
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			self.lambda_module.handler(testInput, "none")
+
+		# Records processed are printed as one summary line, not a line per record
+		lines = output.getvalue().splitlines()
+		self.assertEqual(len(lines), 1)
+		self.assertTrue(lines[0].startswith("Processed record (" + str(len(testInput['records'])) + " times). Examples: "))
+
+		# Raising the log level hides the summary
+		self.lambda_module.LAMBDA_LOG_LEVEL = "WARNING"
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			self.lambda_module.handler(testInput, "none")
+		self.assertEqual(output.getvalue(), "")
+
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
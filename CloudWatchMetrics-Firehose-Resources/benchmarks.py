@@ -0,0 +1,59 @@
+import os, importlib, timeit, json, base64
+
+# Set environment variables before importing the function to benchmark
+benchmarkEnvironment = {"SPLUNK_SOURCE": "841154226728", "SPLUNK_EVENT_TYPE": "event", "SPLUNK_HOST": "841154226728", "SPLUNK_INDEX": "aws"}
+for variable in benchmarkEnvironment.keys():
+	os.environ.setdefault(variable, benchmarkEnvironment[variable])
+
+lambda_module = importlib.import_module('lambda')
+
+recordCount = 2000
+message = '{"metric_stream_name":"841154226728-us-west-2-cwmetrics-event-stream","account_id":"841154226728","region":"us-west-2","namespace":"AWS/SQS","metric_name":"NumberOfEmptyReceives","dimensions":{"QueueName":"841154226728-us-west-2-billingcur-sqs-queue"},"timestamp":1673455020000,"value":{"max":1.0,"min":0.0,"sum":6.0,"count":7.0},"unit":"Count"}'
+
+# The parsed events, so only building the HEC envelope is timed
+metricEvents = []
+for index in range(100):
+	splunkEvent = json.loads(lambda_module.parseEventAsEvent(message))
+	metricEvents.append((splunkEvent["time"] + index, splunkEvent["event"]))
+
+
+# Build a record's events by growing a string, the way the handler did before the envelope encoder
+def concatenateRecord(metricEvents):
+
+	formattedEvents = ""
+	for timestamp, splunkEvent in metricEvents:
+		formattedEvents += '{ "time": ' +  str(timestamp) + ', "host": "' + lambda_module.SPLUNK_HOST + '", "source": "' + lambda_module.SPLUNK_SOURCE + '", "sourcetype": "aws:cloudwatch", "index": "' + lambda_module.SPLUNK_INDEX + '", "event": ' + json.dumps(splunkEvent) + ' }' + "\n"
+
+	return base64.b64encode(bytearray(formattedEvents, 'utf-8'))
+
+
+# Build a record's events into a buffer with the envelope encoder, the way the handler does now
+def encodeRecord(metricEvents):
+
+	formattedEvents = bytearray()
+	for timestamp, splunkEvent in metricEvents:
+		formattedEvents += lambda_module.encodeEvent(lambda_module.eventEnvelope, timestamp, splunkEvent) + b"\n"
+
+	return base64.b64encode(formattedEvents)
+
+
+# Time building records both ways, and verify they're identical
+def benchmarkEventEnvelope():
+
+	if encodeRecord(metricEvents) != concatenateRecord(metricEvents):
+		raise Exception("Envelope encoder output doesn't match concatenation")
+
+	concatenateTime = timeit.timeit(lambda: concatenateRecord(metricEvents), number=recordCount)
+	encodeTime = timeit.timeit(lambda: encodeRecord(metricEvents), number=recordCount)
+	printResult("CloudWatch Metrics HEC envelope", concatenateTime, encodeTime)
+
+
+# Print events per second and the speedup
+def printResult(name, oldTime, newTime):
+
+	eventCount = recordCount * len(metricEvents)
+	print(name + ": " + str(round(eventCount / oldTime)) + " events/sec before, " + str(round(eventCount / newTime)) + " events/sec after, " + str(round(oldTime / newTime, 2)) + "x faster")
+
+
+if __name__ == "__main__":
+	benchmarkEventEnvelope()
@@ -5,8 +5,27 @@ SPLUNK_SOURCE = os.environ['SPLUNK_SOURCE']
 SPLUNK_HOST = os.environ['SPLUNK_HOST']
 SPLUNK_INDEX = os.environ['SPLUNK_INDEX']
 
-# Parse message and return event-formatted record
-def parseEventAsEvent(message):
+encodeJSON = json.JSONEncoder().encode
+
+# Build the Splunk HEC event format once as bytes, so only the time and event need to be encoded for each event
+def createEventEnvelope(host, source, sourcetype, index, eventSeparator, closing):
+
+	envelope = ', "host": "' + host + '", "source": "' + source + '", "sourcetype": "' + sourcetype + '", "index": "' + index + '", "event":' + eventSeparator
+	return b'{ "time": %b' + envelope.encode("utf-8").replace(b"%", b"%%") + b'%b' + closing.encode("utf-8").replace(b"%", b"%%")
+
+
+# Encode an event in the Splunk HEC event format
+def encodeEvent(envelope, timestamp, event):
+
+	return envelope % (str(timestamp).encode("utf-8"), encodeJSON(event).encode("utf-8"))
+
+
+# Build the HEC envelopes once for all of the events
+eventEnvelope = createEventEnvelope(SPLUNK_HOST, SPLUNK_SOURCE, "aws:cloudwatch", SPLUNK_INDEX, " ", " }")
+metricEnvelope = createEventEnvelope(SPLUNK_HOST, SPLUNK_SOURCE, "aws:cloudwatch:metric", SPLUNK_INDEX, " ", " }")
+
+# Parse message and return event-formatted record, encoded as bytes
+def encodeEventAsEvent(message):
 
 	# Parse as JSON event
 	jsonMessage = json.loads(message)
@@ -29,10 +48,15 @@ def parseEventAsEvent(message):
 	splunkEvent["metric_dimensions"] = metric_dimensions[:-1]
 
 	# Return Splunk event
-	return '{ "time": ' +  str(jsonMessage['timestamp']) + ', "host": "' + SPLUNK_HOST + '", "source": "' + SPLUNK_SOURCE + '", "sourcetype": "aws:cloudwatch", "index": "' + SPLUNK_INDEX + '", "event": ' + json.dumps(splunkEvent) + ' }'
+	return encodeEvent(eventEnvelope, jsonMessage['timestamp'], splunkEvent)
 
-# Parse message and return metric-formatted record
-def parseEventAsMetric(message):
+# Parse message and return event-formatted record
+def parseEventAsEvent(message):
+
+	return encodeEventAsEvent(message).decode("utf-8")
+
+# Parse message and return metric-formatted record, encoded as bytes
+def encodeEventAsMetric(message):
 
 	# Parse as JSON event
 	jsonMessage = json.loads(message)
@@ -53,7 +77,12 @@ def parseEventAsMetric(message):
 		splunkEvent[dimensionKey] = jsonMessage['dimensions'][str(dimensionKey)]
 
 	# Return Splunk event
-	return '{ "time": ' +  str(jsonMessage['timestamp']) + ', "host": "' + SPLUNK_HOST + '", "source": "' + SPLUNK_SOURCE + '", "sourcetype": "aws:cloudwatch:metric", "index": "' + SPLUNK_INDEX + '", "event": ' + json.dumps(splunkEvent) + ' }'
+	return encodeEvent(metricEnvelope, jsonMessage['timestamp'], splunkEvent)
+
+# Parse message and return metric-formatted record
+def parseEventAsMetric(message):
+
+	return encodeEventAsMetric(message).decode("utf-8")
 
 # Default Lambda handler
 def handler(event, context):
@@ -65,20 +94,20 @@ def handler(event, context):
 
 		data = base64.b64decode(record['data']).decode('utf-8').splitlines()
 
-		formattedEvents = ""
+		formattedEvents = bytearray()
 		returnEvent = {}
 
 		for message in data:
 
 			match SPLUNK_EVENT_TYPE:
 				case "event": # Parse event as event-style message
-					formattedEvents += parseEventAsEvent(message) + "\n"
+					formattedEvents += encodeEventAsEvent(message) + b"\n"
 				case "metric": # Parse event as metric-style message
-					formattedEvents += parseEventAsMetric(message) + "\n"
+					formattedEvents += encodeEventAsMetric(message) + b"\n"
 
 		returnEvent['recordId'] = dict(record)['recordId']
 		returnEvent['result'] = "Ok"
-		returnEvent['data'] = base64.b64encode(bytearray(formattedEvents, 'utf-8'))
+		returnEvent['data'] = base64.b64encode(formattedEvents)
 
 		returnRecords.append(returnEvent)
 
@@ -0,0 +1,381 @@
+import os, sys, importlib, timeit, json, gzip, datetime, time, threading, tempfile, resource, subprocess, argparse, moto, boto3, pyarrow, pyarrow.parquet
+
+# Set environment variables before importing the function to benchmark
+benchmarkEnvironment = {"firehoseDeliverySreamName": "kdf-benchmark", "AWS_REGION": "us-east-1", "SPLUNK_INDEX": "main", "SPLUNK_TIME_PREFIX": "main", "SPLUNK_EVENT_DELIMITER": "space", "SPLUNK_TIME_DELINEATED_FIELD": "10", "SPLUNK_TIME_FORMAT": "delineated-epoch", "SPLUNK_STRFTIME_FORMAT": "main", "SPLUNK_SOURCETYPE": "aws:cloudwatchlogs:vpcflow", "SPLUNK_SOURCE": "s3://bucket/AWSLogs/841154226728/vpcflowlogs", "SPLUNK_HOST": "841154226728", "SPLUNK_JSON_FORMAT": "main", "SPLUNK_CSV_TO_JSON": "false", "SPLUNK_IGNORE_FIRST_LINE": "true", "SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS": "false", "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_SESSION_TOKEN": "testing", "AWS_DEFAULT_REGION": "us-east-1"}
+for variable in benchmarkEnvironment.keys():
+	os.environ.setdefault(variable, benchmarkEnvironment[variable])
+
+lambda_module = importlib.import_module('lambda')
+
+eventCount = 200000
+event = "2 841154226728 eni-0b48139ba00b9b7bb 192.73.240.132 172.21.12.101 443 60816 6 158 71263 1672790555 1672790581 ACCEPT OK"
+timestamp = 1672790555.0
+
+
+# Build the event by concatenating strings, the way sendEvents did before the envelope encoder
+def concatenateEvent(timestamp, event):
+
+	splunkEvent = '{ "time": ' +  str(timestamp) + ', "host": "' + lambda_module.SPLUNK_HOST + '", "source": "' + lambda_module.SPLUNK_SOURCE + '", "sourcetype": "' + lambda_module.SPLUNK_SOURCETYPE + '", "index": "' + lambda_module.SPLUNK_INDEX + '", "event":  ' + json.dumps(event) + ' }'
+	return str(splunkEvent).encode("utf-8")
+
+
+# Time building HEC events both ways, and verify they're identical
+def benchmarkEventEnvelope():
+
+	eventEnvelope = lambda_module.createEventEnvelope(lambda_module.SPLUNK_HOST, lambda_module.SPLUNK_SOURCE, lambda_module.SPLUNK_SOURCETYPE, lambda_module.SPLUNK_INDEX, "  ", " }")
+	if lambda_module.encodeEvent(eventEnvelope, timestamp, event) != concatenateEvent(timestamp, event):
+		raise Exception("Envelope encoder output doesn't match concatenation")
+
+	concatenateTime = timeit.timeit(lambda: concatenateEvent(timestamp, event), number=eventCount)
+	encodeTime = timeit.timeit(lambda: lambda_module.encodeEvent(eventEnvelope, timestamp, event), number=eventCount)
+	printResult("S3 HEC envelope", concatenateTime, encodeTime)
+
+
+# Time converting a CUR-like CSV file to JSON both ways, and verify the events are identical
+def benchmarkColumnarCsv():
+
+	lambda_module.SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS = "true"
+	header = ",".join(["lineItem/Column" + str(column) for column in range(30)])
+	csvFile = (header + "\n" + "".join([",".join([str(row * column) if column % 2 == 0 else "" for column in range(30)]) + "\n" for row in range(eventCount)])).encode("utf-8")
+	chunks = [csvFile[offset:offset + lambda_module.streamChunkSize] for offset in range(0, len(csvFile), lambda_module.streamChunkSize)]
+
+	lineEvents = lambda_module.csvToJSON(lambda_module.cleanFirstLine(csvFile.decode("utf-8").split("\n")[:-1]))
+	if list(lambda_module.columnarCsvToJSON(chunks, "false")) != lineEvents:
+		raise Exception("Columnar CSV conversion output doesn't match line-by-line conversion")
+
+	lineTime = timeit.timeit(lambda: lambda_module.csvToJSON(lambda_module.cleanFirstLine(csvFile.decode("utf-8").split("\n")[:-1])), number=1)
+	columnarTime = timeit.timeit(lambda: list(lambda_module.columnarCsvToJSON(chunks, "false")), number=1)
+	printResult("S3 CSV to JSON", lineTime, columnarTime)
+
+
+# Print events per second and the speedup
+def printResult(name, oldTime, newTime):
+
+	print(name + ": " + str(round(eventCount / oldTime)) + " events/sec before, " + str(round(eventCount / newTime)) + " events/sec after, " + str(round(oldTime / newTime, 2)) + "x faster")
+
+
+# Handler benchmarks run the real handler against a moto S3 bucket, with a stub Firehose client so the results measure the function rather than moto's Firehose
+benchmarkBucket = "benchmark-source-bucket"
+benchmarkSizes = {"1MB": 1048576, "10MB": 10485760, "100MB": 104857600, "1GB": 1073741824}
+benchmarkResultsDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark-results")
+benchmarkResultPrefix = "Benchmark result: "
+benchmarkStartTime = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Settings each profile's handler benchmark starts from, the same way tests.py resets them
+defaultHandlerSettings = {"SPLUNK_SOURCETYPE": "main", "SPLUNK_JSON_FORMAT": "main", "SPLUNK_CSV_TO_JSON": "main", "SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS": "main", "SPLUNK_TIME_FORMAT": "main", "SPLUNK_TIME_PREFIX": "main", "SPLUNK_TIME_DELINEATED_FIELD": "main", "SPLUNK_EVENT_DELIMITER": "main", "SPLUNK_STRFTIME_FORMAT": "main", "SPLUNK_IGNORE_FIRST_LINE": "main"}
+
+# Import the function in a fresh interpreter, the way a cold start does, and print how long it took and which heavy dependencies it imported
+initBenchmarkScript = "import time, importlib, sys, json; startTime = time.perf_counter(); importlib.import_module('lambda'); print(json.dumps({'seconds': time.perf_counter() - startTime, 'modules': [moduleName for moduleName in ['pandas', 'pyarrow', 'dateutil'] if moduleName in sys.modules]}))"
+initBenchmarkRuns = 5
+
+# Functions timed as stages of the pipeline. In streaming mode, downloading and sending overlap, so their times add up to more than the total.
+benchmarkStages = {"download": ["downloadS3Object", "loadS3Object", "streamS3Object", "retrieveS3ObjectHead", "readRangedChunks"], "uncompress": ["uncompressFile"], "send": ["putRecordsToFirehose"]}
+
+
+# Count the PutRecordBatch calls the function makes, and accept every record
+class StubFirehoseClient:
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.calls = 0
+		self.records = 0
+		self.bytes = 0
+
+	def put_record_batch(self, DeliveryStreamName, Records):
+		with self.lock:
+			self.calls += 1
+			self.records += len(Records)
+			self.bytes += sum(len(record['Data']) for record in Records)
+
+		return {"FailedPutCount": 0, "RequestResponses": [{"RecordId": "benchmark"} for record in Records]}
+
+
+# Write lines from createLine to path until it holds size bytes before compression, and return how many events were written
+def writeLines(path, size, header, createLine):
+
+	eventCount = 0
+	openFile = gzip.open if path.endswith(".gz") else open
+	with openFile(path, "wt") as f:
+		written = 0
+		if header is not None:
+			written += f.write(header + "\n")
+
+		while written < size:
+			written += f.write(createLine(eventCount) + "\n")
+			eventCount += 1
+
+	return eventCount
+
+
+# Generate a CloudTrail file, with every event in one Records list
+def generateCloudTrail(path, size):
+
+	eventCount = 0
+	with gzip.open(path, "wt") as f:
+		written = f.write('{"Records":[')
+		while written < size:
+			eventTime = (benchmarkStartTime + datetime.timedelta(seconds=eventCount)).strftime("%Y-%m-%dT%H:%M:%SZ")
+			record = {"eventVersion": "1.08", "userIdentity": {"type": "AssumedRole", "principalId": "AROAV2CJ256E23ZOBRSAF:benchmark-" + str(eventCount % 50), "arn": "arn:aws:sts::123456789012:assumed-role/benchmark/benchmark-" + str(eventCount % 50), "accountId": "123456789012"}, "eventTime": eventTime, "eventSource": "s3.amazonaws.com", "eventName": ["GetObject", "PutObject", "ListBucket", "HeadObject"][eventCount % 4], "awsRegion": "us-west-2", "sourceIPAddress": "10.0." + str(eventCount % 256) + "." + str(eventCount % 200), "userAgent": "aws-sdk-java/1.12.261 Linux/5.10.135 OpenJDK_64-Bit_Server_VM/25.342-b07", "requestParameters": {"bucketName": "benchmark-bucket", "key": "data/" + str(eventCount) + ".json"}, "responseElements": None, "requestID": "BENCHMARK" + str(eventCount), "eventID": "00000000-0000-0000-0000-" + str(eventCount).zfill(12), "readOnly": True, "eventType": "AwsApiCall", "managementEvent": False, "recipientAccountId": "123456789012"}
+			written += f.write(("," if eventCount > 0 else "") + json.dumps(record))
+			eventCount += 1
+		f.write("]}")
+
+	return eventCount
+
+
+# Generate a VPC flow log file, with its header line
+def generateVpcFlow(path, size):
+
+	header = "version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end action log-status"
+	start = int(benchmarkStartTime.timestamp())
+	return writeLines(path, size, header, lambda eventCount: "2 123456789012 eni-0b48139ba00b9b7bb 10.0." + str(eventCount % 256) + "." + str(eventCount % 200) + " 172.21.12.101 443 " + str(1024 + eventCount % 60000) + " 6 " + str(eventCount % 500) + " " + str(eventCount % 90000) + " " + str(start + eventCount) + " " + str(start + eventCount + 30) + " ACCEPT OK")
+
+
+# Generate a Route 53 resolver query log file, with one JSON event per line
+def generateRoute53Resolver(path, size):
+
+	return writeLines(path, size, None, lambda eventCount: json.dumps({"version": "1.100000", "account_id": "123456789012", "region": "us-west-2", "vpc_id": "vpc-08bd700000000bbaa", "query_timestamp": (benchmarkStartTime + datetime.timedelta(seconds=eventCount)).strftime("%Y-%m-%dT%H:%M:%SZ"), "query_name": "host" + str(eventCount % 1000) + ".example.com.", "query_type": "A", "query_class": "IN", "rcode": "NOERROR", "answers": [{"Rdata": "10.0.0." + str(eventCount % 256), "Type": "A", "Class": "IN"}], "srcaddr": "172.21.12.101", "srcport": str(1024 + eventCount % 60000), "transport": "UDP", "srcids": {"instance": "i-0b486830192751535"}}, separators=(",", ":")))
+
+
+# Generate an S3 server access log file
+def generateS3ServerAccess(path, size):
+
+	return writeLines(path, size, None, lambda eventCount: "d2b1828e428fd0fc94f09e0df9e09766e034d88de30f07560182746128287467 benchmark-bucket " + (benchmarkStartTime + datetime.timedelta(seconds=eventCount)).strftime("[%d/%b/%Y:%H:%M:%S +0000]") + " 10.0." + str(eventCount % 256) + ".1 arn:aws:sts::123456789012:assumed-role/benchmark/benchmark 1WEG6G1N8100F" + str(eventCount % 1000).zfill(3) + " REST.GET.OBJECT data/" + str(eventCount) + '.json "GET /benchmark-bucket/data/' + str(eventCount) + '.json HTTP/1.1" 200 - 892 892 20 19 "-" "aws-sdk-java/1.12.261" - Pu/icXEeVP= SigV4 ECDHE-RSA-AES128-GCM-SHA256 AuthHeader benchmark-bucket.s3.us-west-2.amazonaws.com TLSv1.2 - -')
+
+
+# Generate a CUR CSV file, with its header line
+def generateCurCsv(path, size):
+
+	header = "identity/LineItemId,identity/TimeInterval,lineItem/UsageStartDate,lineItem/UsageAccountId,lineItem/ProductCode,lineItem/UsageType,lineItem/UsageAmount,lineItem/UnblendedCost,resourceTags/user:team"
+	return writeLines(path, size, header, lambda eventCount: str(eventCount) + ",2023-01-01T00:00:00Z/2023-01-01T01:00:00Z,2023-01-01T00:00:00Z,123456789012," + ["AmazonEC2", "AmazonS3", "AWSLambda"][eventCount % 3] + ",USW2-BoxUsage:m5.large," + str(eventCount % 24) + "," + str(round(eventCount * 0.0001, 6)) + "," + ["", "platform", "data"][eventCount % 3])
+
+
+# Generate a CUR Parquet file, a row group at a time, until its rows hold about size bytes in memory
+def generateCurParquet(path, size):
+
+	rowGroupSize = 65536
+	eventCount = 0
+	written = 0
+	writer = None
+	while written < size:
+		rows = range(eventCount, eventCount + rowGroupSize)
+		table = pyarrow.table({"identity_line_item_id": [str(row) for row in rows], "line_item_usage_start_date": [datetime.datetime(2023, 1, 1)] * rowGroupSize, "line_item_usage_account_id": ["123456789012"] * rowGroupSize, "line_item_product_code": [["AmazonEC2", "AmazonS3", "AWSLambda"][row % 3] for row in rows], "line_item_usage_amount": [float(row % 24) for row in rows], "line_item_unblended_cost": [row * 0.0001 for row in rows]})
+
+		# Keep the last row group to the rows needed to reach size
+		if written + table.nbytes > size:
+			table = table.slice(0, max(1, int(rowGroupSize * (size - written) / table.nbytes)))
+
+		if writer is None:
+			writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+		writer.write_table(table)
+		eventCount += table.num_rows
+		written += table.nbytes
+	writer.close()
+
+	return eventCount
+
+
+# Settings and a generator for each supported profile
+handlerProfiles = {
+	"cloudtrail": {"key": "AWSLogs/123456789012/CloudTrail/us-west-2/2023/01/01/benchmark.json.gz", "generator": generateCloudTrail, "settings": {"SPLUNK_SOURCETYPE": "aws:cloudtrail", "SPLUNK_JSON_FORMAT": "eventsInRecords", "SPLUNK_TIME_PREFIX": "eventTime", "SPLUNK_TIME_FORMAT": "prefix-ISO8601"}},
+	"vpcflow": {"key": "AWSLogs/123456789012/vpcflowlogs/us-west-2/2023/01/01/benchmark.log.gz", "generator": generateVpcFlow, "settings": {"SPLUNK_SOURCETYPE": "aws:cloudwatchlogs:vpcflow", "SPLUNK_EVENT_DELIMITER": "space", "SPLUNK_IGNORE_FIRST_LINE": "true", "SPLUNK_TIME_DELINEATED_FIELD": "10", "SPLUNK_TIME_FORMAT": "delineated-epoch"}},
+	"route53Resolver": {"key": "AWSLogs/123456789012/vpcdnsquerylogs/vpc-08bd700000000bbaa/2023/01/01/benchmark.log.gz", "generator": generateRoute53Resolver, "settings": {"SPLUNK_SOURCETYPE": "aws:route53", "SPLUNK_TIME_PREFIX": "query_timestamp", "SPLUNK_TIME_FORMAT": "prefix-ISO8601"}},
+	"s3ServerAccess": {"key": "s3-access-logs/2023-01-01-00-00-00-BENCHMARK", "generator": generateS3ServerAccess, "settings": {"SPLUNK_SOURCETYPE": "aws:s3:accesslogs", "SPLUNK_TIME_PREFIX": "eventTime", "SPLUNK_TIME_FORMAT": "delineated-strftime", "SPLUNK_STRFTIME_FORMAT": "[%d/%b/%Y:%H:%M:%S", "SPLUNK_TIME_DELINEATED_FIELD": "2", "SPLUNK_EVENT_DELIMITER": "space"}},
+	"curCsv": {"key": "cur/benchmark/20230101-20230201/20230105T000000Z/benchmark-00001.csv.gz", "generator": generateCurCsv, "settings": {"SPLUNK_SOURCETYPE": "aws:billing:cur", "SPLUNK_CSV_TO_JSON": "true", "SPLUNK_IGNORE_FIRST_LINE": "false", "SPLUNK_TIME_PREFIX": "UsageStartDate", "SPLUNK_TIME_FORMAT": "prefix-ISO8601"}},
+	"curParquet": {"key": "cur/benchmark/20230101-20230201/20230105T000000Z/benchmark-00001.snappy.parquet", "generator": generateCurParquet, "settings": {"SPLUNK_SOURCETYPE": "aws:billing:cur", "SPLUNK_JSON_FORMAT": "NDJSON", "SPLUNK_TIME_PREFIX": "line_item_usage_start_date", "SPLUNK_TIME_FORMAT": "prefix-epoch"}}
+}
+
+
+# Time each call to a function of the function being benchmarked, adding it to its stage
+def timeStage(stage, function):
+
+	def timedFunction(*args, **kwargs):
+		startTime = time.perf_counter()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			with stage["lock"]:
+				stage["seconds"] += time.perf_counter() - startTime
+				stage["calls"] += 1
+
+	return timedFunction
+
+
+# Return how many bytes the files under a directory use
+def retrieveDirectoryBytes(directory):
+
+	directoryBytes = 0
+	for path, directories, files in os.walk(directory):
+		for file in files:
+			try:
+				directoryBytes += os.path.getsize(os.path.join(path, file))
+			except OSError:
+				pass
+
+	return directoryBytes
+
+
+# Sample /tmp while the handler runs, keeping the most it used above what it used before the handler started
+def monitorTmpUsage(tmpUsage, stopped):
+
+	while not stopped.is_set():
+		tmpUsage["peak"] = max(tmpUsage["peak"], retrieveDirectoryBytes("/tmp") - tmpUsage["baseline"])
+		stopped.wait(0.05)
+
+
+# Run the handler once against a generated object, and return what it measured
+def runHandlerBenchmark(profileName, sizeName):
+
+	profile = handlerProfiles[profileName]
+	for setting, value in dict(defaultHandlerSettings, **profile["settings"]).items():
+		setattr(lambda_module, setting, value)
+
+	# Generate the object outside of /tmp, so it doesn't count towards the function's /tmp usage, and upload it to the mock bucket
+	mock = moto.mock_aws()
+	mock.start()
+	s3Client = boto3.client('s3', region_name="us-east-1")
+	s3Client.create_bucket(Bucket=benchmarkBucket)
+	with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(__file__))) as generatedDirectory:
+		generatedPath = os.path.join(generatedDirectory, profile["key"].split("/")[-1])
+		eventCount = profile["generator"](generatedPath, benchmarkSizes[sizeName])
+		objectBytes = os.path.getsize(generatedPath)
+		s3Client.upload_file(generatedPath, benchmarkBucket, profile["key"])
+
+	# Replace the Firehose client, and time each stage
+	firehoseClient = StubFirehoseClient()
+	lambda_module.firehoseClient = firehoseClient
+	stages = {}
+	for stageName, functionNames in benchmarkStages.items():
+		stages[stageName] = {"seconds": 0.0, "calls": 0, "lock": threading.Lock()}
+		for functionName in functionNames:
+			setattr(lambda_module, functionName, timeStage(stages[stageName], getattr(lambda_module, functionName)))
+
+	# Run the handler, sampling /tmp as it goes
+	tmpUsage = {"baseline": retrieveDirectoryBytes("/tmp"), "peak": 0}
+	stopped = threading.Event()
+	monitor = threading.Thread(target=monitorTmpUsage, args=(tmpUsage, stopped))
+	monitor.start()
+	body = {"Records": [{"eventSource": "aws:s3", "s3": {"bucket": {"name": benchmarkBucket}, "object": {"key": profile["key"], "size": objectBytes}}}]}
+	startTime = time.perf_counter()
+	response = lambda_module.handler({"Records": [{"messageId": "benchmark", "receiptHandle": "benchmark", "body": json.dumps(body), "eventSource": "aws:sqs"}]}, "none")
+	seconds = time.perf_counter() - startTime
+	stopped.set()
+	monitor.join()
+	mock.stop()
+
+	return {"profile": profileName, "size": sizeName, "objectBytes": objectBytes, "events": eventCount, "seconds": round(seconds, 3), "eventsPerSecond": round(eventCount / seconds), "megabytesPerSecond": round(benchmarkSizes[sizeName] / 1048576 / seconds, 2), "peakRssBytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, "peakTmpBytes": tmpUsage["peak"], "putRecordBatchCalls": firehoseClient.calls, "firehoseRecords": firehoseClient.records, "firehoseBytes": firehoseClient.bytes, "stages": {stageName: {"seconds": round(stage["seconds"], 3), "calls": stage["calls"]} for stageName, stage in stages.items()}, "failedMessages": len(response["batchItemFailures"])}
+
+
+# Run each profile and size in its own process, so peak RSS and the function's caches start fresh, and store the results under a label
+def runHandlerBenchmarks(profileNames, sizeNames, label):
+
+	results = []
+	for profileName in profileNames:
+		for sizeName in sizeNames:
+			process = subprocess.run([sys.executable, os.path.abspath(__file__), "case", profileName, sizeName], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+			resultLines = [line for line in process.stdout.splitlines() if line.startswith(benchmarkResultPrefix)]
+			if process.returncode != 0 or len(resultLines) == 0:
+				print("Unable to benchmark " + profileName + " at " + sizeName + ": " + process.stderr.strip().split("\n")[-1])
+				continue
+
+			result = json.loads(resultLines[-1][len(benchmarkResultPrefix):])
+			results.append(result)
+			print(profileName + " " + sizeName + ": " + str(result["eventsPerSecond"]) + " events/sec, " + str(result["megabytesPerSecond"]) + " MB/sec, " + str(round(result["peakRssBytes"] / 1048576)) + " MB peak RSS, " + str(round(result["peakTmpBytes"] / 1048576)) + " MB peak /tmp, " + str(result["putRecordBatchCalls"]) + " PutRecordBatch calls")
+
+	saveBenchmarkResults(label, results)
+
+
+# Store results with the function's settings, so runs can be compared between versions
+def saveBenchmarkResults(label, results):
+
+	os.makedirs(benchmarkResultsDirectory, exist_ok=True)
+	resultsPath = os.path.join(benchmarkResultsDirectory, label + ".json")
+	with open(resultsPath, "w") as f:
+		json.dump({"label": label, "createdAt": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "lambdaSettings": {variable: value for variable, value in os.environ.items() if variable.startswith("LAMBDA_")}, "results": results}, f, indent=2)
+	print("Saved results to " + resultsPath)
+
+
+# Time importing the function with each profile's settings, keeping the median of several fresh interpreters
+def runInitBenchmarks(profileNames, label):
+
+	results = []
+	for profileName in profileNames:
+		environment = dict(os.environ, **defaultHandlerSettings)
+		environment.update(handlerProfiles[profileName]["settings"])
+
+		runs = []
+		for run in range(initBenchmarkRuns):
+			process = subprocess.run([sys.executable, "-c", initBenchmarkScript], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), env=environment)
+			if process.returncode != 0:
+				break
+			runs.append(json.loads(process.stdout.splitlines()[-1]))
+
+		if len(runs) < initBenchmarkRuns:
+			print("Unable to benchmark initialization for " + profileName + ": " + process.stderr.strip().split("\n")[-1])
+			continue
+
+		seconds = sorted(run["seconds"] for run in runs)[initBenchmarkRuns // 2]
+		results.append({"profile": profileName, "initSeconds": round(seconds, 3), "modules": runs[-1]["modules"]})
+		print(profileName + ": " + str(round(seconds * 1000)) + " ms to initialize, importing " + (", ".join(runs[-1]["modules"]) or "no heavy dependencies"))
+
+	saveBenchmarkResults(label + "-init", results)
+
+
+# Compare stored results, printing how each profile and size changed from the baseline
+def compareHandlerBenchmarks(baselinePath, comparisonPath):
+
+	with open(baselinePath) as f:
+		baseline = {(result["profile"], result["size"]): result for result in json.load(f)["results"]}
+	with open(comparisonPath) as f:
+		comparison = json.load(f)["results"]
+
+	for result in comparison:
+		if (result["profile"], result["size"]) not in baseline:
+			continue
+
+		baselineResult = baseline[(result["profile"], result["size"])]
+		print(result["profile"] + " " + result["size"] + ": " + str(round(result["eventsPerSecond"] / baselineResult["eventsPerSecond"], 2)) + "x events/sec, " + str(round(result["peakRssBytes"] / max(1, baselineResult["peakRssBytes"]), 2)) + "x peak RSS, " + str(round(result["peakTmpBytes"] / 1048576)) + " MB peak /tmp (was " + str(round(baselineResult["peakTmpBytes"] / 1048576)) + "), " + str(result["putRecordBatchCalls"]) + " PutRecordBatch calls (was " + str(baselineResult["putRecordBatchCalls"]) + ")")
+
+
+# Return the current commit, to label results by version
+def retrieveBenchmarkLabel():
+
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "local"
+
+
+if __name__ == "__main__":
+
+	# Without arguments, run the microbenchmarks
+	if len(sys.argv) == 1:
+		benchmarkEventEnvelope()
+		benchmarkColumnarCsv()
+		sys.exit()
+
+	parser = argparse.ArgumentParser(description="Benchmark the S3 to Firehose Lambda function.")
+	commands = parser.add_subparsers(dest="command", required=True)
+	handlerCommand = commands.add_parser("handler", help="Run the handler against generated objects and store the results. LAMBDA_ environment variables are passed to the function.")
+	handlerCommand.add_argument("--profiles", default=",".join(handlerProfiles.keys()), help="Comma-separated profiles: " + ", ".join(handlerProfiles.keys()))
+	handlerCommand.add_argument("--sizes", default="1MB,10MB,100MB", help="Comma-separated uncompressed object sizes: " + ", ".join(benchmarkSizes.keys()))
+	handlerCommand.add_argument("--label", default=retrieveBenchmarkLabel(), help="Name to store the results under in benchmark-results. Defaults to the current commit.")
+	initCommand = commands.add_parser("init", help="Time initializing the function with each profile's settings and store the results. LAMBDA_ environment variables are passed to the function.")
+	initCommand.add_argument("--profiles", default=",".join(handlerProfiles.keys()), help="Comma-separated profiles: " + ", ".join(handlerProfiles.keys()))
+	initCommand.add_argument("--label", default=retrieveBenchmarkLabel(), help="Name to store the results under in benchmark-results, followed by -init. Defaults to the current commit.")
+	caseCommand = commands.add_parser("case", help="Run the handler once and print the result as JSON.")
+	caseCommand.add_argument("profile", choices=handlerProfiles.keys())
+	caseCommand.add_argument("size", choices=benchmarkSizes.keys())
+	compareCommand = commands.add_parser("compare", help="Compare two stored results files.")
+	compareCommand.add_argument("baseline")
+	compareCommand.add_argument("comparison")
+	arguments = parser.parse_args()
+
+	if arguments.command == "handler":
+		runHandlerBenchmarks(arguments.profiles.split(","), arguments.sizes.split(","), arguments.label)
+	elif arguments.command == "init":
+		runInitBenchmarks(arguments.profiles.split(","), arguments.label)
+	elif arguments.command == "case":
+		print(benchmarkResultPrefix + json.dumps(runHandlerBenchmark(arguments.profile, arguments.size)))
+	else:
+		compareHandlerBenchmarks(arguments.baseline, arguments.comparison)
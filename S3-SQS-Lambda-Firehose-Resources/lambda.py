@@ -1,10 +1,24 @@
-import boto3, gzip, json, os, sys, shutil, re, dateutil.parser, time, csv, datetime, pandas, pyarrow, urllib.parse, random
+import boto3, botocore.config, gzip, json, os, shutil, re, time, csv, datetime, urllib.parse, random, zlib, codecs, itertools, threading, concurrent.futures, functools, hashlib, io, tempfile, importlib, fnmatch, base64, math
 
 # AWS-related setup
-s3Client = boto3.client('s3')
+# Pool enough connections for each object being processed at once to download all of its byte ranges at once
+s3Client = boto3.client('s3', config=botocore.config.Config(max_pool_connections=max(10, int(os.environ.get('LAMBDA_CONCURRENT_OBJECTS', "1")) * 16)))
 firehoseDeliverySreamName = os.environ['firehoseDeliverySreamName']
-firehoseClient = boto3.client('firehose', region_name=os.environ['AWS_REGION'])
-recordBatch = []
+# Pool enough connections for each sender thread to have its own
+firehoseClient = boto3.client('firehose', region_name=os.environ['AWS_REGION'], config=botocore.config.Config(max_pool_connections=max(10, int(os.environ.get('LAMBDA_FIREHOSE_SENDER_THREADS', "0")))))
+recordBatch = {"records": [], "bytes": 0, "packedRecord": bytearray(), "failedSends": 0}
+firehoseSender = None
+firehoseSenderSlots = None
+pendingSends = []
+objectState = threading.local()
+metricsLock = threading.Lock()
+logLock = threading.Lock()
+logState = {"lines": 0, "suppressed": 0, "repeated": {}, "lastSummary": time.time()}
+dynamodbClient = None
+sqsClient = None
+invocationDeadline = None
+invocationEndTime = None
+firehoseRateLimiter = None
 
 # Splunk-related setup
 SPLUNK_INDEX = os.environ['SPLUNK_INDEX']
@@ -21,11 +35,109 @@ SPLUNK_CSV_TO_JSON = os.environ['SPLUNK_CSV_TO_JSON']
 SPLUNK_IGNORE_FIRST_LINE = os.environ['SPLUNK_IGNORE_FIRST_LINE']
 SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS = os.environ['SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS']
 
+# Processing-related setup
+LAMBDA_STREAMING_MODE = os.environ.get('LAMBDA_STREAMING_MODE', "false")
+LAMBDA_PACK_EVENTS = os.environ.get('LAMBDA_PACK_EVENTS', "false")
+LAMBDA_FIREHOSE_SENDER_THREADS = os.environ.get('LAMBDA_FIREHOSE_SENDER_THREADS', "0")
+LAMBDA_FIREHOSE_MAX_BYTES_PER_SECOND = os.environ.get('LAMBDA_FIREHOSE_MAX_BYTES_PER_SECOND', "0")
+LAMBDA_CONCURRENT_OBJECTS = os.environ.get('LAMBDA_CONCURRENT_OBJECTS', "1")
+LAMBDA_CONCURRENT_OBJECT_BYTES = os.environ.get('LAMBDA_CONCURRENT_OBJECT_BYTES', "268435456")
+LAMBDA_VECTORIZED_TIMESTAMPS = os.environ.get('LAMBDA_VECTORIZED_TIMESTAMPS', "false")
+LAMBDA_COLUMNAR_CSV = os.environ.get('LAMBDA_COLUMNAR_CSV', "false")
+LAMBDA_CUR_FINGERPRINT_LOCATION = os.environ.get('LAMBDA_CUR_FINGERPRINT_LOCATION', "")
+LAMBDA_RANGED_DOWNLOAD_THREADS = os.environ.get('LAMBDA_RANGED_DOWNLOAD_THREADS', "0")
+LAMBDA_IN_MEMORY_OBJECT_BYTES = os.environ.get('LAMBDA_IN_MEMORY_OBJECT_BYTES', "0")
+LAMBDA_EVENT_FILTER_RULES = os.environ.get('LAMBDA_EVENT_FILTER_RULES', "")
+LAMBDA_FIELD_PROJECTION = os.environ.get('LAMBDA_FIELD_PROJECTION', "")
+LAMBDA_OBJECT_LEDGER = os.environ.get('LAMBDA_OBJECT_LEDGER', "")
+LAMBDA_CONTINUATION_QUEUE_URL = os.environ.get('LAMBDA_CONTINUATION_QUEUE_URL', "")
+LAMBDA_METRICS_NAMESPACE = os.environ.get('LAMBDA_METRICS_NAMESPACE', "")
+LAMBDA_LOG_LEVEL = os.environ.get('LAMBDA_LOG_LEVEL', "INFO")
+LAMBDA_LOG_LINE_BUDGET = os.environ.get('LAMBDA_LOG_LINE_BUDGET', "0")
+LAMBDA_ROUTING_TABLE = os.environ.get('LAMBDA_ROUTING_TABLE', "")
+LAMBDA_SPILL_LOCATION = os.environ.get('LAMBDA_SPILL_LOCATION', "")
+LAMBDA_SPILL_AFTER_ATTEMPTS = os.environ.get('LAMBDA_SPILL_AFTER_ATTEMPTS', "3")
+
 # Lambda things
 validFileTypes = ["gz", "gzip", "json", "csv", "log", "parquet", "txt", "ndjson", "jsonl"]
 unsupportedFileTypes = ["CloudTrail-Digest", "billing-report-Manifest"]
 delimiterMapping = {"space": " ", "tab": "	", "comma": ",", "semicolon": ";"}
 maxRetriesToFirehose = 11
+# Results of sending a batch that mean its records don't need to be sent again
+deliveredResults = ["Sent to Firehose", "Spilled to S3"]
+maxFirehoseBackoffSeconds = 16
+replayBytesPerSecond = 1048576
+firehoseRetryMarginSeconds = 10
+firehoseThrottlingErrorCodes = ["ServiceUnavailableException", "ThrottlingException", "LimitExceededException"]
+rateLimiterWindowSeconds = 10
+rateLimiterDecrease = 0.5
+rateLimiterIncreaseBytes = 262144
+minimumBytesPerSecond = 262144
+maxRecordsPerBatch = 500
+maxBytesPerBatch = 4194304
+maxBytesPerRecord = 1024000
+streamChunkSize = 1048576
+rangedDownloadSize = 8388608
+maxRangedDownloadThreads = 16
+decompressSliceSize = 65536
+parquetBatchSize = 10000
+csvBlockSize = 4194304
+compressedFileTypes = ["gz", "gzip"]
+compressedSizeRatio = 10
+iso8601FastPattern = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}:\d{2})?")
+epochDigitsPattern = re.compile(r"\d{10,13}")
+# delineated-epoch and delineated-ISO8601 are left out, as float() and fromisoformat are already as fast per row as pandas is for a whole chunk
+vectorizedTimeFormats = ["delineated-strftime"]
+timestampChunkSize = 10000
+encodeJSON = json.JSONEncoder().encode
+curVersionPattern = re.compile(r"\d{8}T\d{6}Z|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+curLineItemIdFields = ["LineItemId", "identity/LineItemId", "identity_line_item_id"]
+curTimeIntervalFields = ["TimeInterval", "identity/TimeInterval", "identity_time_interval"]
+curHashSize = 8
+columnFieldPattern = re.compile(r"-?\d+")
+truncatedFieldSuffix = "...[truncated]"
+ledgerRetentionDays = 30
+checkpointMarginMillis = 60000
+checkpointMarginFraction = 0.2
+logLevels = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+logExampleCount = 3
+logExampleLength = 256
+logSummaryInterval = 60
+# Settings a routing table profile can set for the objects it matches. Settings a profile leaves out come from the function's environment variables.
+routingSettings = ["SPLUNK_INDEX", "SPLUNK_TIME_PREFIX", "SPLUNK_EVENT_DELIMITER", "SPLUNK_TIME_DELINEATED_FIELD", "SPLUNK_TIME_FORMAT", "SPLUNK_STRFTIME_FORMAT", "SPLUNK_SOURCETYPE", "SPLUNK_SOURCE", "SPLUNK_HOST", "SPLUNK_JSON_FORMAT", "SPLUNK_CSV_TO_JSON", "SPLUNK_IGNORE_FIRST_LINE", "SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS", "LAMBDA_EVENT_FILTER_RULES", "LAMBDA_FIELD_PROJECTION", "LAMBDA_CUR_FINGERPRINT_LOCATION"]
+# Metrics emitted for each object. Streamed objects are downloaded and uncompressed as their events are read, so that time is counted as EventBreakTime.
+metricUnits = {"ObjectTime": "Milliseconds", "DownloadTime": "Milliseconds", "UncompressTime": "Milliseconds", "EventBreakTime": "Milliseconds", "TimestampTime": "Milliseconds", "EnvelopeTime": "Milliseconds", "FirehoseSendTime": "Milliseconds", "ObjectBytes": "Bytes", "Events": "Count", "TimestampFallbacks": "Count", "FirehoseBatches": "Count", "FirehoseRetries": "Count", "FirehoseThrottles": "Count", "FirehoseThrottleWaitTime": "Milliseconds", "SpilledRecords": "Count", "FirehoseRecords": "Count", "FirehoseBytes": "Bytes"}
+
+
+# Import a dependency the first time it's needed. pandas, pyarrow and dateutil take seconds to import between them, and most deployments never use them.
+@functools.lru_cache(maxsize=None)
+def retrieveModule(moduleName):
+	return importlib.import_module(moduleName)
+
+
+# Import the dependencies this deployment's settings are known to need while the function initializes, and leave the rest until an object needs them
+def importConfiguredModules():
+
+	moduleNames = []
+	# Vectorized timestamps use pandas
+	if LAMBDA_VECTORIZED_TIMESTAMPS == "true" and SPLUNK_TIME_FORMAT in vectorizedTimeFormats:
+		moduleNames.append("pandas")
+	# Columnar CSV conversion uses pyarrow
+	if SPLUNK_CSV_TO_JSON == "true" and LAMBDA_COLUMNAR_CSV == "true":
+		moduleNames.extend(["pyarrow", "pyarrow.csv", "pyarrow.compute"])
+	# Cost and Usage Reports can be exported as Parquet
+	if SPLUNK_SOURCETYPE == "aws:billing:cur":
+		moduleNames.extend(["pyarrow", "pyarrow.parquet"])
+	# ISO8601 timestamps that fromisoformat can't parse use dateutil
+	if "ISO8601" in SPLUNK_TIME_FORMAT:
+		moduleNames.append("dateutil.parser")
+
+	for moduleName in moduleNames:
+		retrieveModule(moduleName)
+
+	return moduleNames
+
+importConfiguredModules()
 
 # Create delimiter for delimiting events
 def createDelimiter(SPLUNK_EVENT_DELIMITER):
@@ -49,6 +161,13 @@ def retrieveObjectInfo(record):
 		result = {}
 		result["bucket"] = bucket
 		result["key"] = key
+
+		# Continuation messages say which event or byte to resume the object from
+		if "resumeFromEvent" in record:
+			result["resumeFromEvent"] = int(record["resumeFromEvent"])
+		if "resumeFromByte" in record:
+			result["resumeFromByte"] = int(record["resumeFromByte"])
+
 		return result
 
 	# Return an error if the record doesn't have a valid file defined in it
@@ -72,7 +191,7 @@ def isValidFileType(key):
 		return True
 
 	# Check for aws:s3:accesslogs
-	if SPLUNK_SOURCETYPE == "aws:s3:accesslogs" and len(key.split(".")) == 1:
+	if retrieveSetting("SPLUNK_SOURCETYPE") == "aws:s3:accesslogs" and len(key.split(".")) == 1:
 		return True
 
 	return False
@@ -81,9 +200,12 @@ def isValidFileType(key):
 # Retrieve the S3 object, and return the new path
 def downloadS3Object(bucket, key):
 
+	scratchDirectory = None
+
 	try:
-		# Define the path for the file
-		path = "/tmp/" + key.split("/")[-1]
+		# Define the path for the file, in its own scratch directory so objects with the same file name don't overwrite each other
+		scratchDirectory = tempfile.mkdtemp(prefix="s3-", dir="/tmp")
+		path = scratchDirectory + "/" + key.split("/")[-1]
 
 		# Download the file from the S3 bucket
 		s3Client.download_file(bucket, key, path)
@@ -91,10 +213,112 @@ def downloadS3Object(bucket, key):
 		# Return the new file path
 		return(path)
 
+	except:
+		# Remove the scratch directory if the file didn't download
+		if scratchDirectory is not None:
+			shutil.rmtree(scratchDirectory, ignore_errors=True)
+
+		return "Unable to download file s3://" + bucket + "/" + key
+
+
+# Download a small S3 object into memory and uncompress it there, then return the uncompressed file and its extension
+def loadS3Object(bucket, key):
+
+	try:
+		objectData = s3Client.get_object(Bucket=bucket, Key=key)['Body'].read()
+	except:
+		return "Unable to download file s3://" + bucket + "/" + key
+
+	# Set file extension, looking past the compression extension the same way uncompressFile does
+	fileName = key.split("/")[-1]
+	extension = fileName.split(".")[-1]
+
+	if extension in compressedFileTypes:
+		try:
+			objectData = gzip.decompress(objectData)
+		except:
+			return "Unable to uncompress file s3://" + bucket + "/" + key
+
+		fileName = fileName[0:(-1*(len(extension)) - 1)]
+		extension = fileName.split(".")[-1]
+
+	return {"file": io.BytesIO(objectData), "extension": extension}
+
+
+# Open the S3 object as a stream, from the start or from a byte offset, and return the body without writing it to /tmp
+def streamS3Object(bucket, key, firstByte=0):
+
+	try:
+		# Request the object from the S3 bucket
+		if firstByte > 0:
+			response = s3Client.get_object(Bucket=bucket, Key=key, Range="bytes=" + str(firstByte) + "-")
+		else:
+			response = s3Client.get_object(Bucket=bucket, Key=key)
+
+		# Return the streaming body
+		return response['Body']
+
+	except:
+		return "Unable to download file s3://" + bucket + "/" + key
+
+
+# Look up the size, ETag, and version of an S3 object
+def retrieveS3ObjectHead(bucket, key):
+
+	try:
+		response = s3Client.head_object(Bucket=bucket, Key=key)
+		return {"size": response['ContentLength'], "etag": response['ETag'], "version": response.get('VersionId', "")}
+
 	except:
 		return "Unable to download file s3://" + bucket + "/" + key
 
 
+# Work out how many byte ranges of an object to download at once
+def retrieveRangedDownloadThreads():
+
+	# Lambda's network bandwidth grows with its memory, so download one more range at once for each 512 MB
+	if LAMBDA_RANGED_DOWNLOAD_THREADS == "auto":
+		return min(maxRangedDownloadThreads, max(2, int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', "1024")) // 512))
+
+	return int(LAMBDA_RANGED_DOWNLOAD_THREADS)
+
+
+# Download one byte range of an S3 object, failing if the object has changed since it was first looked up
+def downloadS3Range(bucket, key, etag, start, end):
+
+	return s3Client.get_object(Bucket=bucket, Key=key, Range="bytes=" + str(start) + "-" + str(end), IfMatch=etag)['Body'].read()
+
+
+# Download an S3 object in byte ranges at the same time, and yield the ranges in order as they arrive. Lines cut across ranges are put back together by whatever splits the chunks into events.
+def readRangedChunks(bucket, key, objectHead, threads, firstByte=0):
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as rangeDownloader:
+		pendingRanges = []
+
+		for start in range(firstByte, objectHead["size"], rangedDownloadSize):
+			end = min(start + rangedDownloadSize, objectHead["size"]) - 1
+			pendingRanges.append(rangeDownloader.submit(downloadS3Range, bucket, key, objectHead["etag"], start, end))
+
+			# Keep one range ready ahead of the ones downloading, so memory use stays bounded
+			if len(pendingRanges) > threads:
+				yield pendingRanges.pop(0).result()
+
+		for pendingRange in pendingRanges:
+			yield pendingRange.result()
+
+
+# Read a stream in fixed-size chunks
+def readChunks(body):
+
+	while True:
+		chunk = body.read(streamChunkSize)
+
+		if len(chunk) == 0:
+			break
+
+		yield chunk
+
+
 # Uncompress the file if it needs to be uncompressed, then return the path and the new file extension
 def uncompressFile(path):
 
@@ -123,18 +347,6 @@ def uncompressFile(path):
 				# Remove the uncompressed file
 				os.remove(path)
 
-				return uncompressedFilePath
-			case "parquet":
-
-				df = pandas.read_parquet(path)
-				json_array = df.to_json(orient='records', lines=True)
-				uncompressedFilePath = uncompressedFilePath + ".json"
-				with open(uncompressedFilePath, "w") as f_out:
-					f_out.write(json_array)
-
-				# Remove the uncompressed file
-				os.remove(path)
-
 				return uncompressedFilePath
 
 	except:
@@ -143,10 +355,44 @@ def uncompressFile(path):
 	return path
 
 
+# Uncompress a stream of chunks if it needs to be uncompressed, one chunk at a time
+def streamUncompress(chunks, extension):
+
+	# Pass through chunks that aren't compressed
+	if extension not in compressedFileTypes:
+		yield from chunks
+		return
+
+	decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+	memberStarted = False
+
+	for chunk in chunks:
+
+		# Feed the decompressor in slices so highly compressed data doesn't expand all at once
+		chunk = memoryview(chunk)
+		for offset in range(0, len(chunk), decompressSliceSize):
+			data = chunk[offset:offset + decompressSliceSize]
+
+			while len(data) > 0:
+				memberStarted = True
+				yield decompressor.decompress(data)
+				data = b""
+
+				# Start a new decompressor if there's another gzip member after this one
+				if decompressor.eof:
+					data = decompressor.unused_data
+					decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+					memberStarted = False
+
+	# Fail the same way gzip does on a truncated file
+	if memberStarted:
+		raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+
 # Split events into a list. Additional file extensions should be added here.
 def eventBreak(events, extension, ignoreFirstLine):
 
-	if extension == "csv" or extension == "log" or SPLUNK_SOURCETYPE == "aws:s3:accesslogs":
+	if extension == "csv" or extension == "log" or retrieveSetting("SPLUNK_SOURCETYPE") == "aws:s3:accesslogs":
 
 		splitEvents = events.split("\n")
 
@@ -163,13 +409,13 @@ def eventBreak(events, extension, ignoreFirstLine):
 
 	elif extension == "json" or extension == "txt" or extension=="jsonl":
 
-		if SPLUNK_JSON_FORMAT == "eventsInRecords":
+		if retrieveSetting("SPLUNK_JSON_FORMAT") == "eventsInRecords":
 			splitEvents = json.loads(events)["Records"]
 			events = ""
 
 			return splitEvents
 
-		elif SPLUNK_JSON_FORMAT == "NDJSON":
+		elif retrieveSetting("SPLUNK_JSON_FORMAT") == "NDJSON":
 			splitEvents = events.split("\n")
 			events = ""
 			
@@ -182,11 +428,225 @@ def eventBreak(events, extension, ignoreFirstLine):
 		return "File type invalid"
 
 
+# Convert Parquet values that JSON can't represent, the same way pandas' to_json does
+def parquetValueToJSON(value):
+
+	if isinstance(value, datetime.datetime):
+		if value.tzinfo is None:
+			value = value.replace(tzinfo=datetime.timezone.utc)
+		return round(value.timestamp() * 1000)
+
+	if isinstance(value, datetime.date):
+		return round(datetime.datetime(value.year, value.month, value.day, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+	if isinstance(value, bytes):
+		return value.decode("utf-8", errors="replace")
+
+	return str(value)
+
+
+# Replace NaN and infinite floats with null, which is what pandas' to_json writes, since JSON can't represent them
+def parquetRowToJSON(value):
+
+	if isinstance(value, float) and not math.isfinite(value):
+		return None
+
+	if isinstance(value, dict):
+		return {key: parquetRowToJSON(item) for key, item in value.items()}
+
+	if isinstance(value, list):
+		return [parquetRowToJSON(item) for item in value]
+
+	return value
+
+
+# Split a Parquet file into NDJSON events, reading one record batch at a time
+def parquetEventBreak(path):
+
+	parquetFile = retrieveModule("pyarrow.parquet").ParquetFile(path)
+
+	for parquetBatch in parquetFile.iter_batches(batch_size=parquetBatchSize):
+		for row in parquetBatch.to_pylist():
+			yield json.dumps(parquetRowToJSON(row), separators=(",", ":"), default=parquetValueToJSON, allow_nan=False)
+
+
+# Split a stream of chunks into lines the same way chunksToLines does, counting the bytes of the object up to the end of each line, so a checkpoint can resume from the byte after the last line sent
+def chunksToTrackedLines(chunks, bytesRead):
+
+	remainder = b""
+
+	for chunk in chunks:
+		lines = (remainder + chunk).split(b"\n")
+		remainder = lines.pop()
+
+		for line in lines:
+			yield from splitTrackedLine(line, len(line) + 1, bytesRead)
+
+	# Return the last line if the file doesn't end with a new line
+	if len(remainder) > 0:
+		yield from splitTrackedLine(remainder, len(remainder), bytesRead)
+
+
+# Split one line of an object, counting the bytes of each part of it before it's returned
+def splitTrackedLine(line, lineBytes, bytesRead):
+
+	# Translate line endings the same way reading the file in text mode does, where a trailing "\r" is part of the line ending
+	lines = line.split(b"\r")
+	if len(lines) > 1 and lines[-1] == b"":
+		lines.pop()
+
+	for subline in lines[:-1]:
+		bytesRead[0] += len(subline) + 1
+		lineBytes -= len(subline) + 1
+		yield subline.decode("utf-8")
+
+	bytesRead[0] += lineBytes
+	yield lines[-1].decode("utf-8")
+
+
+# Check whether an object can be continued from a byte offset. It has to be uncompressed, with one event per line, and without a header line the events after it need.
+def canResumeFromByte(key):
+
+	extension = key.split("/")[-1].split(".")[-1]
+
+	if extension in compressedFileTypes or retrieveSetting("SPLUNK_CSV_TO_JSON") == "true" or retrieveSetting("SPLUNK_SOURCETYPE") == "aws:billing:cur":
+		return False
+
+	if extension == "csv" or extension == "log" or retrieveSetting("SPLUNK_SOURCETYPE") == "aws:s3:accesslogs":
+		return True
+
+	return extension in ["json", "txt", "jsonl"] and retrieveSetting("SPLUNK_JSON_FORMAT") == "NDJSON"
+
+
+# Split a stream of chunks into lines, the same way eventBreak splits a whole file
+def chunksToLines(chunks):
+
+	remainder = b""
+
+	for chunk in chunks:
+
+		# Only decode up to the last complete line, and carry the rest over to the next chunk
+		block = remainder + chunk
+		lastNewline = block.rfind(b"\n")
+		if lastNewline == -1:
+			remainder = block
+			continue
+
+		remainder = block[lastNewline + 1:]
+		lines = block[:lastNewline].decode("utf-8")
+
+		# Translate line endings the same way reading the file in text mode does
+		if "\r" in lines:
+			lines = lines.removesuffix("\r").replace("\r\n", "\n").replace("\r", "\n")
+
+		yield from lines.split("\n")
+
+	# Return the last line if the file doesn't end with a new line
+	if len(remainder) > 0:
+		lines = remainder.decode("utf-8")
+		if "\r" in lines:
+			lines = lines.replace("\r\n", "\n").replace("\r", "\n").removesuffix("\n")
+
+		yield from lines.split("\n")
+
+
+# Yield each event in the "Records" list of a JSON object without loading the whole object
+def chunksToRecords(chunks):
+
+	decoder = json.JSONDecoder()
+	textDecoder = codecs.getincrementaldecoder("utf-8")()
+	chunks = iter(chunks)
+	buffer = ""
+	position = 0
+	streamEnded = False
+
+	# Read more of the stream into the buffer, dropping what has already been parsed
+	def readMore():
+		nonlocal buffer, position, streamEnded
+		chunk = next(chunks, None)
+		if chunk is None:
+			streamEnded = True
+			buffer = buffer[position:] + textDecoder.decode(b"", final=True)
+		else:
+			buffer = buffer[position:] + textDecoder.decode(chunk)
+		position = 0
+
+	# Find the opening of the "Records" list
+	recordsStart = re.compile(r'\s*\{\s*"Records"\s*:\s*\[')
+	while True:
+		match = recordsStart.match(buffer)
+		if match or streamEnded or len(buffer.lstrip()) > 32:
+			break
+		readMore()
+
+	# Fall back to loading the whole object if "Records" isn't the first key
+	if match is None:
+		while not streamEnded:
+			readMore()
+		yield from json.loads(buffer)["Records"]
+		return
+
+	position = match.end()
+
+	while True:
+
+		# Skip whitespace and commas between records
+		while True:
+			while position < len(buffer) and buffer[position] in " \t\r\n,":
+				position += 1
+			if position < len(buffer) or streamEnded:
+				break
+			readMore()
+
+		# Stop at the end of the list
+		if position >= len(buffer):
+			raise ValueError("Unterminated Records list")
+		if buffer[position] == "]":
+			return
+
+		# Decode the next record, reading more of the stream if the record isn't complete yet
+		try:
+			record, end = decoder.raw_decode(buffer, position)
+			if end == len(buffer) and not streamEnded:
+				raise ValueError("Record may continue in the next chunk")
+		except ValueError:
+			if streamEnded:
+				raise
+			readMore()
+			continue
+
+		position = end
+		yield record
+
+
+# Split a stream of chunks into events. Additional file extensions should be added here, as they are in eventBreak.
+def streamEventBreak(chunks, extension, ignoreFirstLine):
+
+	if extension == "csv" or extension == "log" or retrieveSetting("SPLUNK_SOURCETYPE") == "aws:s3:accesslogs":
+
+		splitEvents = chunksToLines(chunks)
+
+		if ignoreFirstLine == "true":
+			splitEvents = itertools.islice(splitEvents, 1, None)
+
+		return splitEvents
+
+	elif extension == "json" or extension == "txt" or extension=="jsonl":
+
+		if retrieveSetting("SPLUNK_JSON_FORMAT") == "eventsInRecords":
+			return chunksToRecords(chunks)
+
+		elif retrieveSetting("SPLUNK_JSON_FORMAT") == "NDJSON":
+			return chunksToLines(chunks)
+
+	return "File type invalid"
+
+
 # Clean up first line 
 def cleanFirstLine(splitEvents):
 
 	# If the sourcetype is aws:billing:cur, remove everything before the "/" in the CSV header
-	if SPLUNK_SOURCETYPE == "aws:billing:cur":
+	if retrieveSetting("SPLUNK_SOURCETYPE") == "aws:billing:cur":
 		
 		header = splitEvents[0]
 		
@@ -200,226 +660,1933 @@ def cleanFirstLine(splitEvents):
 	return splitEvents
 
 
+# Clean up the first line of a stream of events
+def streamCleanFirstLine(splitEvents):
+
+	splitEvents = iter(splitEvents)
+
+	# Clean up the header, then pass the rest of the events through
+	for header in splitEvents:
+		yield cleanFirstLine([header])[0]
+		break
+
+	yield from splitEvents
+
+
 # Handle CSV to JSON conversion, and optionally remove null fields
 def csvToJSON(splitEvents):
 
-	newEvents = []
+	return list(streamCsvToJSON(splitEvents))
+
+
+# Handle CSV to JSON conversion one row at a time, and optionally remove null fields
+def streamCsvToJSON(splitEvents):
 
 	# Change CSVs with headers to JSON format
 	csvSplit = csv.DictReader(splitEvents)
-	for csvRow in csvSplit: 
-		newEvents.append(csvRow)
 
 	# Remove JSON fields with null or no value
-	if SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS == "true":
+	if retrieveSetting("SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS") == "true":
 
-		newEventsWithoutEmptyValues = []
-		for newEvent in newEvents:
+		for csvRow in csvSplit:
 			newEventWithoutEmptyValues = {}
-			
-			for newEventKey in newEvent.keys():
-				if len(newEvent[newEventKey]) > 0:
-					newEventWithoutEmptyValues[newEventKey] = newEvent[newEventKey]
 
-			newEventsWithoutEmptyValues.append(newEventWithoutEmptyValues)
+			for newEventKey in csvRow.keys():
+				if len(csvRow[newEventKey]) > 0:
+					newEventWithoutEmptyValues[newEventKey] = csvRow[newEventKey]
+
+			yield newEventWithoutEmptyValues
 
-		newEvents.clear()
-		return newEventsWithoutEmptyValues
+	else:
+		yield from csvSplit
 
-	return newEvents
 
+# Read the field names from a CSV header line, cleaning it up the same way as the line-by-line conversion
+def readCsvHeader(line):
 
-# Set timestamp on event
-def getTimestamp(event, delimiter):
+	header = line.decode("utf-8").removesuffix("\r")
+
+	# Clean up first line of events
+	if retrieveSetting("SPLUNK_SOURCETYPE") == "aws:billing:cur":
+		header = cleanFirstLine([header])[0]
+
+	return header
+
+
+# Convert a block of CSV lines to JSON with pyarrow, and optionally remove empty fields
+def convertCsvBlock(block, header):
+
+	fieldNames = next(csv.reader([header]), [])
+
+	# Note rows with the wrong number of fields, which csv.DictReader handles differently
+	invalidRows = []
+	def skipInvalidRow(row):
+		invalidRows.append(row.text)
+		return "skip"
+
+	pyarrow = retrieveModule("pyarrow")
+	pyarrowCsv = retrieveModule("pyarrow.csv")
+	pyarrowCompute = retrieveModule("pyarrow.compute")
+	readOptions = pyarrowCsv.ReadOptions(column_names=fieldNames)
+	parseOptions = pyarrowCsv.ParseOptions(invalid_row_handler=skipInvalidRow)
+	convertOptions = pyarrowCsv.ConvertOptions(column_types={fieldName: pyarrow.string() for fieldName in fieldNames}, strings_can_be_null=False, quoted_strings_can_be_null=False)
+	csvTable = pyarrowCsv.read_csv(pyarrow.py_buffer(block), read_options=readOptions, parse_options=parseOptions, convert_options=convertOptions)
+
+	# Convert the block line by line if it has rows with the wrong number of fields, or quoted fields with line breaks, which the line-by-line conversion joins together, so the events and their order are the same either way
+	if len(invalidRows) > 0 or any(pyarrowCompute.any(pyarrowCompute.match_substring_regex(column, "[\\r\\n]")).as_py() for column in csvTable.columns):
+		yield from streamCsvToJSON(itertools.chain([header], chunksToLines([block])))
+		return
+
+	removeEmptyFields = retrieveSetting("SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS") == "true"
+	columnNames = []
+	columnValues = []
+
+	for fieldName, column in zip(fieldNames, csvTable.columns):
+
+		# Drop columns that are empty for every row in the block. With duplicate field names the last value wins, so every column is needed to know which one that is.
+		if removeEmptyFields and len(set(fieldNames)) == len(fieldNames):
+			if pyarrowCompute.max(pyarrowCompute.utf8_length(column)).as_py() in [None, 0]:
+				continue
+
+		columnNames.append(fieldName)
+		columnValues.append(column.to_pylist())
+
+	for row in zip(*columnValues):
+		csvRow = dict(zip(columnNames, row))
+
+		# Remove JSON fields with no value
+		if removeEmptyFields:
+			yield {fieldName: csvRow[fieldName] for fieldName in csvRow.keys() if len(csvRow[fieldName]) > 0}
+		else:
+			yield csvRow
+
+
+# Handle CSV to JSON conversion a block of lines at a time with pyarrow, and optionally remove null fields
+def columnarCsvToJSON(chunks, ignoreFirstLine):
+
+	block = bytearray()
+	header = None
+	linesToSkip = 0
+	if ignoreFirstLine == "true":
+		linesToSkip = 1
+
+	for chunk in chunks:
+		block += chunk
+
+		# Read the header line before anything else
+		while header is None:
+			lineEnd = block.find(b"\n")
+			if lineEnd == -1:
+				break
+
+			line = bytes(block[:lineEnd])
+			del block[:lineEnd + 1]
+
+			if linesToSkip > 0:
+				linesToSkip -= 1
+			else:
+				header = readCsvHeader(line)
 
+		# Convert whole lines once there's a full block of them, without splitting a quoted field across blocks
+		if header is not None and len(block) >= csvBlockSize:
+			lineEnd = block.rfind(b"\n")
+			if lineEnd != -1 and block.count(b'"', 0, lineEnd) % 2 == 0:
+				yield from convertCsvBlock(bytes(block[:lineEnd + 1]), header)
+				del block[:lineEnd + 1]
+
+	# The header can be the only line, without a newline after it
+	if header is None and linesToSkip == 0 and len(block) > 0:
+		header = readCsvHeader(bytes(block))
+		block.clear()
+
+	# Convert whatever is left
+	if header is not None and len(block) > 0:
+		yield from convertCsvBlock(bytes(block), header)
+
+
+# Parse an ISO8601 timestamp, using the much faster fromisoformat when the timestamp is in a format it parses the same way as dateutil
+def parseISO8601(iso8601Timestamp):
+
+	if iso8601FastPattern.fullmatch(iso8601Timestamp):
+		return datetime.datetime.fromisoformat(iso8601Timestamp).timestamp()
+
+	return retrieveModule("dateutil.parser").parse(iso8601Timestamp).timestamp()
+
+
+# Return the current time for time formats that aren't supported
+def extractCurrentTime(event, delimiter):
+
+	return time.time()
+
+
+# Build the function that extracts the timestamp from an event for the time format settings, so the settings are only looked at and the patterns are only compiled once
+@functools.lru_cache(maxsize=None)
+def retrieveTimestampExtractor(timeFormat, timePrefix, timeDelineatedField, strftimeFormat):
+
+	# Only split events as far as the time field. An invalid field number fails on every event, the same way it did when splitting each event.
 	try:
-		match SPLUNK_TIME_FORMAT:
-			case "prefix-ISO8601": # For ISO8601 (%Y-%m-%dT%H-%M-%S.%fZ)
-				
-				if len(SPLUNK_TIME_PREFIX) > 0:
-					regexGroupIndex = 2
-				else: 
-					regexGroupIndex = 0
-
-				iso8601Timestamp = re.search("" + SPLUNK_TIME_PREFIX + r"(.{1,5})?(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(.\d{0,10})?Z)", str(event)).group(regexGroupIndex) #fix eventTime
-				return dateutil.parser.parse(iso8601Timestamp).timestamp()
-
-			case "prefix-epoch":# For prefix epoch formats
-				
-				epochTimeString = re.search("" + SPLUNK_TIME_PREFIX + r"(.{1,5})?\d{10,13}", str(event)).group(0)
-				epochTime = re.search(r"\d{10,13}", str(epochTimeString)).group(0)
-				if len(epochTime) == 13:
-					epochTime = float(epochTime) / 1000
+		field = int(timeDelineatedField)
+		maxSplit = field + 1
+		if field < 0:
+			maxSplit = -1
+	except ValueError:
+		field = None
+		maxSplit = -1
+
+	match timeFormat:
+		case "prefix-ISO8601": # For ISO8601 (%Y-%m-%dT%H-%M-%S.%fZ)
+
+			if len(timePrefix) > 0:
+				regexGroupIndex = 2
+			else: 
+				regexGroupIndex = 0
 
+			iso8601Pattern = re.compile("" + timePrefix + r"(.{1,5})?(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(.\d{0,10})?Z)")
+
+			def extractTimestamp(event, delimiter):
+				return parseISO8601(iso8601Pattern.search(str(event)).group(regexGroupIndex))
+
+		case "prefix-epoch": # For prefix epoch formats
+
+			epochPattern = re.compile("" + timePrefix + r"(.{1,5})?\d{10,13}")
+
+			def extractTimestamp(event, delimiter):
+				epochTime = epochDigitsPattern.search(epochPattern.search(str(event)).group(0)).group(0)
+				if len(epochTime) == 13:
+					return float(epochTime) / 1000
 				return float(epochTime)
 
-			case "delineated-epoch": # For field-delimited epoch time
-				
-				epochTime = float(event.split(delimiter)[int(SPLUNK_TIME_DELINEATED_FIELD)])
-				return epochTime
+		case "delineated-epoch": # For field-delimited epoch time
 
-			case "delineated-ISO8601": # For delineated ISO8601 (%Y-%m-%dT%H-%M-%S.%fZ)
-				
-				iso8601Timestamp = event.split(delimiter)[int(SPLUNK_TIME_DELINEATED_FIELD)]
-				return dateutil.parser.parse(iso8601Timestamp).timestamp()
-			
-			case "delineated-strftime": # For custom strftime formats
-				
-				rawTimeStamp = event.split(delimiter)[int(SPLUNK_TIME_DELINEATED_FIELD)]
-				return int(datetime.datetime.strptime(rawTimeStamp, SPLUNK_STRFTIME_FORMAT).strftime("%s"))
+			def extractTimestamp(event, delimiter):
+				return float(event.split(delimiter, maxSplit)[field])
+
+		case "delineated-ISO8601": # For delineated ISO8601 (%Y-%m-%dT%H-%M-%S.%fZ)
+
+			def extractTimestamp(event, delimiter):
+				return parseISO8601(event.split(delimiter, maxSplit)[field])
+
+		case "delineated-strftime": # For custom strftime formats
+
+			def extractTimestamp(event, delimiter):
+				return int(datetime.datetime.strptime(event.split(delimiter, maxSplit)[field], strftimeFormat).strftime("%s"))
+
+		case _:
+			return extractCurrentTime
+
+	return extractTimestamp
+
+
+# Set timestamp on event
+def getTimestamp(event, delimiter, extractTimestamp=None):
+
+	try:
+		if extractTimestamp is None:
+			extractTimestamp = retrieveTimestampExtractor(retrieveSetting("SPLUNK_TIME_FORMAT"), retrieveSetting("SPLUNK_TIME_PREFIX"), retrieveSetting("SPLUNK_TIME_DELINEATED_FIELD"), retrieveSetting("SPLUNK_STRFTIME_FORMAT"))
+
+		return extractTimestamp(event, delimiter)
 	
 	except:
 		# If not standard, set to current time
-		print("Unable to extract timestamp.  Falling back to current time.")
+		logRepeated("Unable to extract timestamp.  Falling back to current time.", str(event))
+		addMetric(retrieveObjectMetrics(), "TimestampFallbacks", 1)
 		return time.time()
 
-	return time.time()
+# Set timestamps on a chunk of events. Delimited events have their time fields converted for the whole chunk at once, and rows that don't convert fall back to getTimestamp.
+def getTimestamps(events, delimiter, extractTimestamp):
 
+	timestamps = None
 
-# Buffer and send events to Firehose
-def bufferAndSendEventsToFirehose(event, final, objectName, eventBatch):
+	if LAMBDA_VECTORIZED_TIMESTAMPS == "true" and retrieveSetting("SPLUNK_TIME_FORMAT") in vectorizedTimeFormats:
+		try:
+			timestamps = convertTimeFields(events, delimiter)
+		except:
+			timestamps = None
 
-	# Add current event ot recordBatch
-	if len(event) > 0: # This will be 0 if it's a final call to clear the buffer
-		recordBatch.append({"Data": event})
+	# Convert every row one at a time
+	if timestamps is None:
+		return [getTimestamp(event, delimiter, extractTimestamp) for event in events]
 
-	# Attempt to send until maxRetriesToFirehose is hit 
-	sendingAttempt = 1
-	while sendingAttempt <= maxRetriesToFirehose:
+	# Convert the rows that didn't convert one at a time
+	for index in range(len(events)):
+		if timestamps[index] is None:
+			timestamps[index] = getTimestamp(events[index], delimiter, extractTimestamp)
 
-		try:
-			# If there are more than 450 records or 4500000B in the sending queue or this is the final sending and there are records to send, send the event to Splunk and clear the queue
-			if len(recordBatch) >= 450 or sys.getsizeof(recordBatch) >= 4500000 or (final == True and len(recordBatch) >= 1):
-				
-				# Incrmenet eventBatch for logging
-				if sendingAttempt == 1:
-					eventBatch[0] += 1
-				
-				# Send the event batch
-				response = firehoseClient.put_record_batch(DeliveryStreamName=firehoseDeliverySreamName, Records=recordBatch)
-
-				# If no messages failed...
-				if response['FailedPutCount'] == 0:
-					recordBatch.clear()
-					return("Sent to Firehose")
-				# If messages failed...
-				else:
-					print("Unable to send file to Firehose. Error message: " + response['RequestResponses'][0]['ErrorMessage'])
-
-			# If the threshold for sending wasn't reached...
-			else:
-				if (final == True and len(recordBatch) == 0):
-					return("Final try, no events buffered")
-				else: 
-					return("Event buffered")
+	return timestamps
 
-		# Print exception for debugging
-		except Exception as e:
-			print("Unable to send file to Firehose: " + str(e))
 
-		# Exponential backoff with jitter
-		sendingAttempt += 1
-		sleepTime = 2 ** sendingAttempt
-		jitter = random.uniform(0, sleepTime)
-		totalSleepTime = sleepTime + jitter
-		print("Retrying in " + str(round(totalSleepTime, 2)) + " seconds for attempt " + str(sendingAttempt) + " on eventBatch " + str(eventBatch[0]) + " for object " + objectName)
-		time.sleep(totalSleepTime)
+# Convert the time fields of a chunk of delimited events at once, returning None for rows that didn't convert. Raises if a row can't be converted at all, so the chunk is converted one row at a time instead.
+def convertTimeFields(events, delimiter):
 
-	# Open failure with max retries being reached
-	return "Max firehose retries reached"
+	# Pull out the time field, only splitting as far as it
+	field = int(retrieveSetting("SPLUNK_TIME_DELINEATED_FIELD"))
+	maxSplit = field + 1
+	if field < 0:
+		maxSplit = -1
+	timeFields = [event.split(delimiter, maxSplit)[field] for event in events]
 
+	match retrieveSetting("SPLUNK_TIME_FORMAT"):
+		case "delineated-strftime":
 
-# Default Lambda handler
-def handler(event, context):
+			# strftime("%s") uses local time and ignores time zones, so only convert here when local time is UTC and the format has no time zone
+			if time.timezone != 0 or time.daylight != 0 or "%z" in retrieveSetting("SPLUNK_STRFTIME_FORMAT") or "%Z" in retrieveSetting("SPLUNK_STRFTIME_FORMAT"):
+				return None
 
-	# Create delineated field break
-	delimiter = createDelimiter(SPLUNK_EVENT_DELIMITER)
+			pandas = retrieveModule("pandas")
+			parsed = pandas.to_datetime(pandas.Series(timeFields, dtype=object), format=retrieveSetting("SPLUNK_STRFTIME_FORMAT"), errors="coerce")
+			seconds = (parsed - pandas.Timestamp("1970-01-01")) // pandas.Timedelta(seconds=1)
+			return [None if pandas.isna(second) else int(second) for second in seconds.tolist()]
 
-	# Loop through each SQS message
-	for message in event['Records']:
+	return None
 
-		# Retrieve bucket name and key from SQS message
-		objectInfo = retrieveObjectInfo(message)
 
-		# Set eventBatch value, on a per-object basis
-		eventBatch = [0]
+# Return the records that failed in a PutRecordBatch response, and a summary of the failures grouped by error code
+def retrieveFailedRecords(records, response):
 
-		# If a string was returned instead of a dictionary, print the error and stop this loop
-		if isinstance(objectInfo, str):
-			print(objectInfo)
-			continue
+	failedRecords = []
+	errorCodes = {}
 
-		# Validate file types
-		isValidFileTypeResult = isValidFileType(objectInfo["key"])
-		if not isValidFileTypeResult:
-			print("Unsupported file type: s3://" + objectInfo["bucket"] + "/" + objectInfo["key"])
-			continue
-		
-		# Retrieve the S3 object and uncompress it
-		downloadResult = downloadS3Object(objectInfo["bucket"], objectInfo["key"])
-		
-		# If the file was unable to be downloaded, print the error and stop this loop
-		if "Unable to download" in downloadResult:
-			print(downloadResult)
-			continue
+	# RequestResponses is in the same order as the records that were sent
+	for record, recordResponse in zip(records, response['RequestResponses']):
+		if 'ErrorCode' in recordResponse:
+			failedRecords.append(record)
 
-		# Send file info to be uncompressed
-		uncompressResult = uncompressFile(downloadResult)
+			if recordResponse['ErrorCode'] not in errorCodes:
+				errorCodes[recordResponse['ErrorCode']] = {"count": 0, "message": recordResponse.get('ErrorMessage', "")}
+			errorCodes[recordResponse['ErrorCode']]["count"] += 1
 
-		# If the file was unable to be compressed, print the error and stop this loop
-		if "Unable to uncompress file" in uncompressResult:
-			print("Unable to uncompress file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"])
-			continue
+	errorSummary = ", ".join(errorCode + " (" + str(errorCodes[errorCode]["count"]) + " records): " + errorCodes[errorCode]["message"] for errorCode in errorCodes.keys())
 
-		# Try to read the file contents into memory
-		try:
-			with open(uncompressResult, 'r') as f:
-				events = f.read()
-		except:
-			print("Unable to read file contents into memory")
-			continue
+	return failedRecords, errorSummary
 
-		# Set extension 
-		extension = uncompressResult.split(".")[-1]
 
-		# Split events
-		splitEvents = eventBreak(events, extension, SPLUNK_IGNORE_FIRST_LINE)
+# Create the Firehose rate limiter the first time it's needed, so it's shared by every object and sender thread and kept across invocations
+def retrieveFirehoseRateLimiter():
 
-		# Clean up first line of events
-		if SPLUNK_SOURCETYPE == "aws:billing:cur":
-			splitEvents = cleanFirstLine(splitEvents)
+	global firehoseRateLimiter
 
-		# If a string was returned instead of a list, print the error and stop this loop
-		if isinstance(splitEvents, str):
-			print("File type unsupported s3://" + objectInfo["bucket"] + "/" + objectInfo["key"])
-			continue
+	if firehoseRateLimiter is None:
+		# A rate of 0 doesn't limit sends until Firehose throttles them
+		firehoseRateLimiter = {"lock": threading.Lock(), "bytesPerSecond": float(LAMBDA_FIREHOSE_MAX_BYTES_PER_SECOND), "maxBytesPerSecond": float(LAMBDA_FIREHOSE_MAX_BYTES_PER_SECOND), "tokens": 0.0, "lastRefill": time.monotonic(), "windowStart": time.monotonic(), "windowBytes": 0, "throttles": 0, "waitSeconds": 0.0}
 
-		# Transform CSV to JSON
-		if SPLUNK_CSV_TO_JSON == "true":
-			splitEvents = csvToJSON(splitEvents)
+	return firehoseRateLimiter
 
-		# Loop through split events
-		for splitEvent in splitEvents:
 
-			# Get timestamp
-			timestamp = getTimestamp(splitEvent, delimiter)
+# Sleep, but not past the point where the invocation needs to stop retrying. Returns False if there's no time left to sleep.
+def sleepWithinInvocation(seconds):
 
-			# Construct event to send to Splunk
-			splunkEvent = '{ "time": ' +  str(timestamp) + ', "host": "' + SPLUNK_HOST + '", "source": "' + SPLUNK_SOURCE + '", "sourcetype": "' + SPLUNK_SOURCETYPE + '", "index": "' + SPLUNK_INDEX + '", "event":  ' + json.dumps(splitEvent) + ' }'
+	if invocationEndTime is not None:
+		remainingSeconds = invocationEndTime - time.time() - firehoseRetryMarginSeconds
+		if remainingSeconds <= 0:
+			return False
+		seconds = min(seconds, remainingSeconds)
 
-			# Buffer and send the events to Firehose
-			result = bufferAndSendEventsToFirehose(str(splunkEvent), False, objectInfo["key"], eventBatch)
+	if seconds > 0:
+		time.sleep(seconds)
 
-			# Error logging
-			if result.startswith("Unable to send file to Firehose"):
-				print(result + " Firehose name: " + firehoseDeliverySreamName + ". File path: s3://" + objectInfo["bucket"] + "/" + objectInfo["key"])
+	return True
 
-		# Send the remaining events to Firehose, effectively clearing the buffered events in recordBatch
-		bufferAndSendEventsToFirehose("", True, objectInfo["key"], eventBatch)
 
-		# Delete the file to clear up space in /tmp to make room for the next one
-		os.remove(uncompressResult)
+# Take a batch's bytes from the token bucket, waiting for the bucket to refill if the batch would go over the current rate. Returns False if there's no time left to wait.
+def waitForFirehoseRate(batchBytes, metrics):
 
-		# Logging
-		print("Processed file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"])
+	limiter = retrieveFirehoseRateLimiter()
+
+	with limiter["lock"]:
+		now = time.monotonic()
+
+		# Keep the rate sends are being made at, to start limiting from if Firehose throttles them
+		if now - limiter["windowStart"] >= rateLimiterWindowSeconds:
+			limiter["windowStart"] = now
+			limiter["windowBytes"] = 0
+		limiter["windowBytes"] += batchBytes
+
+		if limiter["bytesPerSecond"] <= 0:
+			return True
+
+		# Refill the bucket for the time since the last send, holding at most a second of sends, then reserve the batch's bytes. Sends that go over wait until the bucket has refilled.
+		limiter["tokens"] = min(limiter["bytesPerSecond"], limiter["tokens"] + (now - limiter["lastRefill"]) * limiter["bytesPerSecond"])
+		limiter["lastRefill"] = now
+		limiter["tokens"] -= batchBytes
+		waitSeconds = max(0.0, -limiter["tokens"] / limiter["bytesPerSecond"])
+		limiter["waitSeconds"] += waitSeconds
+
+	if waitSeconds > 0:
+		addMetric(metrics, "FirehoseThrottleWaitTime", waitSeconds * 1000)
+		return sleepWithinInvocation(waitSeconds)
+
+	return True
+
+
+# Adjust the send rate after a send: add to it after a send Firehose accepted, and cut it in half after a send Firehose throttled
+def updateFirehoseRate(throttled, metrics):
+
+	limiter = retrieveFirehoseRateLimiter()
+
+	with limiter["lock"]:
+		if throttled:
+			limiter["throttles"] += 1
+
+			# Start from the rate sends were being made at when Firehose first throttles them
+			currentRate = limiter["bytesPerSecond"]
+			if currentRate <= 0:
+				currentRate = limiter["windowBytes"] / max(time.monotonic() - limiter["windowStart"], 1.0)
+
+			limiter["bytesPerSecond"] = max(minimumBytesPerSecond, currentRate * rateLimiterDecrease)
+			limiter["tokens"] = min(limiter["tokens"], 0.0)
+
+		elif limiter["bytesPerSecond"] > 0:
+			limiter["bytesPerSecond"] += rateLimiterIncreaseBytes
+			if limiter["maxBytesPerSecond"] > 0:
+				limiter["bytesPerSecond"] = min(limiter["bytesPerSecond"], limiter["maxBytesPerSecond"])
+
+	if throttled:
+		addMetric(metrics, "FirehoseThrottles", 1)
+
+
+# Check whether a failed send was Firehose throttling the function, from the exception or from the error codes of the failed records
+def isFirehoseThrottle(exception=None, response=None):
+
+	if exception is not None:
+		return getattr(exception, "response", {}).get("Error", {}).get("Code", "") in firehoseThrottlingErrorCodes
+
+	return any(recordResponse.get("ErrorCode", "") in firehoseThrottlingErrorCodes for recordResponse in response["RequestResponses"])
+
+
+# Print how often Firehose throttled sends during the invocation, and the rate sends are limited to, so the delivery stream's quotas can be sized
+def logFirehoseThrottles():
+
+	limiter = retrieveFirehoseRateLimiter()
+
+	with limiter["lock"]:
+		throttles = limiter["throttles"]
+		waitSeconds = limiter["waitSeconds"]
+		rate = limiter["bytesPerSecond"]
+		limiter["throttles"] = 0
+		limiter["waitSeconds"] = 0.0
+
+	if throttles > 0 or waitSeconds > 0:
+		log("Firehose throttled " + str(throttles) + " sends during this invocation, sends waited " + str(round(waitSeconds, 2)) + " seconds for the rate limiter, and sends are limited to " + str(round(rate)) + " bytes per second", "WARNING")
 
+
+# Send records to Firehose, retrying until maxRetriesToFirehose is hit or the invocation is about to time out. If a spill location is configured, records are spilled to S3 after LAMBDA_SPILL_AFTER_ATTEMPTS attempts instead.
+def putRecordsToFirehose(records, objectName, eventBatchNumber, metrics=None):
+
+	# Count the batch for the object's metrics
+	if metrics is not None:
+		addMetric(metrics, "FirehoseBatches", 1)
+		addMetric(metrics, "FirehoseRecords", len(records))
+		addMetric(metrics, "FirehoseBytes", sum(len(record["Data"]) for record in records))
+
+	# Attempt to send until maxRetriesToFirehose is hit, or the spill attempts are used up
+	maxAttempts = maxRetriesToFirehose
+	if LAMBDA_SPILL_LOCATION != "":
+		maxAttempts = max(1, min(maxRetriesToFirehose, int(LAMBDA_SPILL_AFTER_ATTEMPTS)))
+
+	result, records = sendRecordsToFirehose(records, objectName, eventBatchNumber, metrics, maxAttempts)
+	if result == "Sent to Firehose":
+		return result
+
+	# Spill the records to S3 and keep going, if a spill location is configured
+	if LAMBDA_SPILL_LOCATION != "":
+		spillResult = spillToS3(records, objectName, eventBatchNumber)
+		if spillResult.startswith("Spilled"):
+			logRepeated("Spilled records Firehose didn't accept to S3", spillResult + " for eventBatch " + str(eventBatchNumber) + " of object " + objectName)
+			addMetric(metrics, "SpilledRecords", len(records))
+			return "Spilled to S3"
+		log(spillResult, "ERROR")
+
+	# Open failure with max retries being reached. Drop the records, as keeping them would push the next batch over the Firehose limits.
+	log("Dropping " + str(len(records)) + " records in eventBatch " + str(eventBatchNumber) + " for object " + objectName, "ERROR")
+	return result
+
+
+# Try to send records to Firehose up to maxAttempts times, resending only the records Firehose didn't accept. Returns the result and the records that still weren't sent.
+def sendRecordsToFirehose(records, objectName, eventBatchNumber, metrics, maxAttempts):
+
+	sendingAttempt = 1
+	while sendingAttempt <= maxAttempts:
+
+		# Wait until the rate limiter lets the batch through
+		if not waitForFirehoseRate(sum(len(record["Data"]) for record in records), metrics):
+			break
+
+		throttled = False
+		try:
+			# Send the event batch
+			startTime = time.perf_counter()
+			response = firehoseClient.put_record_batch(DeliveryStreamName=firehoseDeliverySreamName, Records=records)
+			addTiming(metrics, "FirehoseSendTime", startTime)
+
+			# If no messages failed...
+			if response['FailedPutCount'] == 0:
+				updateFirehoseRate(False, metrics)
+				return "Sent to Firehose", []
+			# If messages failed, keep only the failed records so the next attempt doesn't resend the ones that succeeded
+			else:
+				throttled = isFirehoseThrottle(response=response)
+				failedRecords, errorSummary = retrieveFailedRecords(records, response)
+				logRepeated("Unable to send some records to Firehose", str(len(failedRecords)) + " of " + str(len(records)) + " records for object " + objectName + ". Errors: " + errorSummary)
+				records = failedRecords
+
+				# If the response didn't identify any failed records, there's nothing left to resend
+				if len(failedRecords) == 0:
+					updateFirehoseRate(throttled, metrics)
+					return "Sent to Firehose", []
+
+		# Print exception for debugging
+		except Exception as e:
+			throttled = isFirehoseThrottle(exception=e)
+			logRepeated("Unable to send file to Firehose", str(e))
+
+		sendingAttempt += 1
+		addMetric(metrics, "FirehoseRetries", 1)
+		updateFirehoseRate(throttled, metrics)
+
+		# Don't wait after the last attempt
+		if sendingAttempt > maxAttempts:
+			break
+
+		# Throttled sends are slowed down by the rate limiter instead of sleeping here
+		if throttled:
+			logRepeated("Retrying Firehose sends", "attempt " + str(sendingAttempt) + " on eventBatch " + str(eventBatchNumber) + " for object " + objectName + " after Firehose throttled it")
+			continue
+
+		# Exponential backoff with jitter for other errors
+		sleepTime = min(maxFirehoseBackoffSeconds, 2 ** sendingAttempt)
+		totalSleepTime = random.uniform(sleepTime / 2, sleepTime)
+		logRepeated("Retrying Firehose sends", "attempt " + str(sendingAttempt) + " on eventBatch " + str(eventBatchNumber) + " for object " + objectName + " in " + str(round(totalSleepTime, 2)) + " seconds")
+		if not sleepWithinInvocation(totalSleepTime):
+			break
+
+	# Stop before the invocation times out, so the object is retried instead of the function being stopped partway through
+	if sendingAttempt <= maxAttempts:
+		logRepeated("Stopping Firehose retries before the invocation times out", "eventBatch " + str(eventBatchNumber) + " for object " + objectName, "ERROR")
+
+	return "Max firehose retries reached", records
+
+
+# Write records Firehose wouldn't take to the spill location, compressed, so they can be replayed later instead of being dropped. A replay passes the key of the spilled batch to replace it with the records it couldn't send.
+def spillToS3(records, objectName, eventBatchNumber, key=None):
+
+	spillData = gzip.compress(json.dumps({"objectName": objectName, "eventBatch": eventBatchNumber, "records": [base64.b64encode(record["Data"]).decode("utf-8") for record in records]}).encode("utf-8"))
+
+	# Keys start with the time they were spilled, so replays send the oldest batches first
+	bucket, prefix = LAMBDA_SPILL_LOCATION[5:].split("/", 1)
+	if key is None:
+		key = prefix.rstrip("/") + "/" + time.strftime("%Y/%m/%d/%H%M%S", time.gmtime()) + "-" + os.urandom(8).hex() + ".json.gz"
+
+	try:
+		s3Client.put_object(Bucket=bucket, Key=key, Body=spillData)
+	except Exception as e:
+		return "Unable to spill records to s3://" + bucket + "/" + key + ": " + str(e)
+
+	return "Spilled " + str(len(records)) + " records to s3://" + bucket + "/" + key
+
+
+# Send spilled batches back to Firehose, oldest first, at no more than maxBytesPerSecond (replayBytesPerSecond by default). The rate limiter goes back to its own rate once the replay is done.
+def replaySpilledBatches(options):
+
+	result = {"replayedBatches": 0, "replayedRecords": 0, "remainingBatches": 0}
+
+	if LAMBDA_SPILL_LOCATION == "":
+		log("Unable to replay spilled batches, as no spill location is configured", "ERROR")
+		return result
+
+	limiter = retrieveFirehoseRateLimiter()
+	with limiter["lock"]:
+		sendingRate = (limiter["bytesPerSecond"], limiter["maxBytesPerSecond"])
+		limiter["bytesPerSecond"] = float(options.get("maxBytesPerSecond", replayBytesPerSecond))
+		limiter["maxBytesPerSecond"] = limiter["bytesPerSecond"]
+
+	try:
+		replaySpilledObjects(result)
+	finally:
+		with limiter["lock"]:
+			limiter["bytesPerSecond"], limiter["maxBytesPerSecond"] = sendingRate
+
+	log("Replayed " + str(result["replayedBatches"]) + " spilled batches with " + str(result["replayedRecords"]) + " records to Firehose, with " + str(result["remainingBatches"]) + " batches left to replay")
+
+	return result
+
+
+# Replay each spilled object, stopping when a batch still can't be fully sent or the invocation is about to time out, and leaving the rest for the next replay
+def replaySpilledObjects(result):
+
+	bucket, prefix = LAMBDA_SPILL_LOCATION[5:].split("/", 1)
+	replaying = True
+
+	for page in s3Client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix.rstrip("/") + "/"):
+		for spilledObject in page.get("Contents", []):
+
+			# Count what's left once the replay has stopped
+			if not replaying or (invocationEndTime is not None and invocationEndTime - time.time() <= firehoseRetryMarginSeconds):
+				replaying = False
+				result["remainingBatches"] += 1
+				continue
+
+			spill = json.loads(gzip.decompress(s3Client.get_object(Bucket=bucket, Key=spilledObject["Key"])["Body"].read()))
+			records = [{"Data": base64.b64decode(record)} for record in spill["records"]]
+
+			sendResult, unsentRecords = sendRecordsToFirehose(records, spill["objectName"], spill["eventBatch"], None, maxRetriesToFirehose)
+			result["replayedRecords"] += len(records) - len(unsentRecords)
+
+			# Keep only the records that still can't be sent, so the next replay doesn't send the others again
+			if sendResult != "Sent to Firehose":
+				replaying = False
+				result["remainingBatches"] += 1
+				if len(unsentRecords) < len(records):
+					spillResult = spillToS3(unsentRecords, spill["objectName"], spill["eventBatch"], spilledObject["Key"])
+					if not spillResult.startswith("Spilled"):
+						log(spillResult, "ERROR")
+				continue
+
+			s3Client.delete_object(Bucket=bucket, Key=spilledObject["Key"])
+			result["replayedBatches"] += 1
+
+
+# Create the sender threads the first time they're needed, so they're reused across invocations
+def retrieveFirehoseSender():
+
+	global firehoseSender, firehoseSenderSlots
+
+	if firehoseSender is None:
+		senderThreads = int(LAMBDA_FIREHOSE_SENDER_THREADS)
+		firehoseSender = concurrent.futures.ThreadPoolExecutor(max_workers=senderThreads)
+		# Each thread can have one batch in flight and one waiting, after which parsing waits for a free slot
+		firehoseSenderSlots = threading.BoundedSemaphore(senderThreads * 2)
+
+	return firehoseSender
+
+
+# Return the record batch for the object this thread is processing
+def retrieveRecordBatch():
+
+	return getattr(objectState, "recordBatch", recordBatch)
+
+
+# Return the background sends for the object this thread is processing
+def retrievePendingSends():
+
+	return getattr(objectState, "pendingSends", pendingSends)
+
+
+# Send the buffered records to Firehose, in the background if sender threads are configured
+def sendRecordBatch(objectName, eventBatch):
+
+	batch = retrieveRecordBatch()
+
+	# Incrmenet eventBatch for logging
+	eventBatch[0] += 1
+
+	# Hand the records off and start a new buffer
+	records = batch["records"]
+	batch["records"] = []
+	batch["bytes"] = 0
+
+	# Send in the foreground if sender threads aren't configured
+	if int(LAMBDA_FIREHOSE_SENDER_THREADS) <= 0:
+		result = putRecordsToFirehose(records, objectName, eventBatch[0], retrieveObjectMetrics())
+		if result not in deliveredResults:
+			batch["failedSends"] += 1
+		return result
+
+	# Queue the records for the sender threads, waiting if the queue is full
+	sender = retrieveFirehoseSender()
+	firehoseSenderSlots.acquire()
+	try:
+		pendingSend = sender.submit(putRecordsToFirehose, records, objectName, eventBatch[0], retrieveObjectMetrics())
+	except Exception:
+		firehoseSenderSlots.release()
+		raise
+	pendingSend.add_done_callback(lambda future: firehoseSenderSlots.release())
+	retrievePendingSends().append(pendingSend)
+
+	return "Queued for Firehose"
+
+
+# Wait for the batches being sent in the background to finish
+def waitForPendingSends():
+
+	batch = retrieveRecordBatch()
+	sends = retrievePendingSends()
+	result = "Sent to Firehose"
+
+	while len(sends) > 0:
+		pendingResult = sends.pop(0).result()
+		if pendingResult not in deliveredResults:
+			batch["failedSends"] += 1
+			result = pendingResult
+
+	return result
+
+
+# Discard the records buffered for an object that failed part way through, so they aren't sent with the next object's events
+def resetRecordBatch():
+
+	batch = retrieveRecordBatch()
+
+	# Let the batches already handed to the sender threads finish, without counting them against the next object
+	sends = retrievePendingSends()
+	concurrent.futures.wait(sends)
+	sends.clear()
+
+	batch["records"] = []
+	batch["bytes"] = 0
+	batch["packedRecord"].clear()
+	batch["failedSends"] = 0
+
+
+# Add a record to recordBatch, sending the batch when the next record wouldn't fit in a PutRecordBatch request
+def addRecordToBatch(record, objectName, eventBatch):
+
+	batch = retrieveRecordBatch()
+	result = "Event buffered"
+
+	# Send the batch first if this record would push it over the size limit
+	if batch["bytes"] + len(record) > maxBytesPerBatch:
+		result = sendRecordBatch(objectName, eventBatch)
+
+	batch["records"].append({"Data": record})
+	batch["bytes"] += len(record)
+
+	# Send the batch as soon as it has the maximum number of records
+	if len(batch["records"]) >= maxRecordsPerBatch:
+		result = sendRecordBatch(objectName, eventBatch)
+
+	return result
+
+
+# Buffer and send events to Firehose
+def bufferAndSendEventsToFirehose(event, final, objectName, eventBatch):
+
+	batch = retrieveRecordBatch()
+	result = "Event buffered"
+
+	# Add current event to recordBatch
+	if len(event) > 0: # This will be 0 if it's a final call to clear the buffer
+
+		# Size the event by its encoded bytes, which is what Firehose limits
+		if isinstance(event, str):
+			event = event.encode("utf-8")
+
+		# Firehose rejects the whole batch if one record is too large, so the event can't be sent. Count it as a failed send, so the object isn't reported as processed.
+		if len(event) > maxBytesPerRecord:
+			batch["failedSends"] += 1
+			return "Event too large to send to Firehose (" + str(len(event)) + " bytes)"
+
+		# Pack multiple events into each record, since Splunk HEC accepts concatenated events
+		if LAMBDA_PACK_EVENTS == "true":
+
+			# Close the packed record if this event doesn't fit in it
+			if len(batch["packedRecord"]) + len(event) > maxBytesPerRecord:
+				result = addRecordToBatch(bytes(batch["packedRecord"]), objectName, eventBatch)
+				batch["packedRecord"].clear()
+
+			batch["packedRecord"] += event
+
+		else:
+			result = addRecordToBatch(event, objectName, eventBatch)
+
+	# If this is the final sending, send whatever is buffered
+	if final == True:
+
+		# Close the packed record
+		if len(batch["packedRecord"]) > 0:
+			result = addRecordToBatch(bytes(batch["packedRecord"]), objectName, eventBatch)
+			batch["packedRecord"].clear()
+
+		if len(batch["records"]) > 0:
+			result = sendRecordBatch(objectName, eventBatch)
+
+		# Wait for the batches being sent in the background
+		if len(retrievePendingSends()) > 0:
+			result = waitForPendingSends()
+
+		# Report a failure if any batch for this object was dropped along the way, then start counting again for the next object
+		if batch["failedSends"] > 0:
+			result = "Max firehose retries reached"
+			batch["failedSends"] = 0
+
+		# If nothing was buffered and nothing was sent along the way...
+		if result == "Event buffered":
+			return("Final try, no events buffered")
+
+	return result
+
+
+# Build the Splunk HEC event format once as bytes, so only the time and event need to be encoded for each event. Each profile's envelope is only built once.
+@functools.lru_cache(maxsize=None)
+def createEventEnvelope(host, source, sourcetype, index, eventSeparator, closing):
+
+	envelope = ', "host": "' + host + '", "source": "' + source + '", "sourcetype": "' + sourcetype + '", "index": "' + index + '", "event":' + eventSeparator
+	return b'{ "time": %b' + envelope.encode("utf-8").replace(b"%", b"%%") + b'%b' + closing.encode("utf-8").replace(b"%", b"%%")
+
+
+# Encode an event in the Splunk HEC event format
+def encodeEvent(envelope, timestamp, event):
+
+	return envelope % (str(timestamp).encode("utf-8"), encodeJSON(event).encode("utf-8"))
+
+
+# Build the test for one field in an event filter rule
+def compileFilterCondition(condition):
+
+	if "equals" in condition:
+		expectedValue = condition["equals"]
+		return lambda fieldValue: fieldValue == expectedValue
+
+	elif "in" in condition:
+		expectedValues = condition["in"]
+
+		# Look values up in a set, unless some of them can't be hashed
+		try:
+			expectedValues = set(expectedValues)
+		except TypeError:
+			pass
+
+		def isExpectedValue(fieldValue):
+			try:
+				return fieldValue in expectedValues
+			except TypeError:
+				return False
+
+		return isExpectedValue
+
+	elif "regex" in condition:
+		pattern = re.compile(condition["regex"])
+		return lambda fieldValue: isinstance(fieldValue, str) and pattern.search(fieldValue) is not None
+
+	raise ValueError("Unable to compile event filter condition " + json.dumps(condition))
+
+
+# Build an event filter rule. Fields are "_raw" for the whole event, a column number for delimited events, or a dotted path for JSON events.
+def compileFilterRule(rule, ruleNumber):
+
+	conditions = []
+
+	for field, condition in rule["match"].items():
+		if field == "_raw":
+			conditions.append(("raw", None, compileFilterCondition(condition)))
+		elif columnFieldPattern.fullmatch(field):
+			conditions.append(("column", int(field), compileFilterCondition(condition)))
+		else:
+			conditions.append(("json", field.split("."), compileFilterCondition(condition)))
+
+	return (rule.get("name", "rule " + str(ruleNumber)), conditions)
+
+
+# Read a JSON setting, from the setting itself or from a file in S3 if it's an s3:// path
+def readJSONSetting(setting):
+
+	if setting.startswith("s3://"):
+		bucket, key = setting[5:].split("/", 1)
+		setting = s3Client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+	return json.loads(setting)
+
+
+# Load and compile the event filter rules, from the setting itself or from a rules file in S3. This only happens once for the same setting.
+@functools.lru_cache
+def retrieveEventFilter(filterRules):
+
+	if filterRules == "":
+		return []
+
+	try:
+		return [compileFilterRule(rule, ruleNumber) for ruleNumber, rule in enumerate(readJSONSetting(filterRules), 1)]
+
+	except Exception as e:
+		log("Unable to load event filter rules, events won't be filtered: " + str(e), "WARNING")
+		return []
+
+
+# Look up a field in an event for the event filter, splitting or parsing the event at most once
+def retrieveFilterField(event, kind, key, delimiter, parsedEvent):
+
+	if kind == "raw":
+		if isinstance(event, str):
+			return event
+		return encodeJSON(event)
+
+	elif kind == "column":
+		if "columns" not in parsedEvent:
+			parsedEvent["columns"] = event.split(delimiter) if isinstance(event, str) else []
+
+		try:
+			return parsedEvent["columns"][key]
+		except IndexError:
+			return None
+
+	if "json" not in parsedEvent:
+		if isinstance(event, dict):
+			parsedEvent["json"] = event
+		else:
+			try:
+				parsedEvent["json"] = json.loads(event)
+			except:
+				parsedEvent["json"] = None
+
+	fieldValue = parsedEvent["json"]
+	for keyPart in key:
+		if not isinstance(fieldValue, dict) or keyPart not in fieldValue:
+			return None
+		fieldValue = fieldValue[keyPart]
+
+	return fieldValue
+
+
+# Drop events that match any of the event filter rules, counting how many each rule dropped
+def filterEvents(splitEvents, eventFilter, delimiter, droppedEvents):
+
+	for event in splitEvents:
+		parsedEvent = {}
+
+		for ruleName, conditions in eventFilter:
+			if all(test(retrieveFilterField(event, kind, key, delimiter, parsedEvent)) for kind, key, test in conditions):
+				droppedEvents[ruleName] = droppedEvents.get(ruleName, 0) + 1
+				break
+
+		else:
+			yield event
+
+
+# Build a tree of dotted field paths, so nested fields are looked up one level at a time. Leaves are True, or the value given for the path.
+def createFieldTree(fieldPaths):
+
+	fieldTree = {}
+
+	for fieldPath in fieldPaths:
+		branch = fieldTree
+		keys = fieldPath.split(".")
+
+		for key in keys[:-1]:
+			# A parent field that's already in the tree covers this one too
+			if not isinstance(branch.setdefault(key, {}), dict):
+				break
+			branch = branch[key]
+
+		else:
+			branch[keys[-1]] = fieldPaths[fieldPath] if isinstance(fieldPaths, dict) else True
+
+	return fieldTree
+
+
+# Load and build the field projection, from the setting itself or from a file in S3. This only happens once for the same setting.
+@functools.lru_cache
+def retrieveFieldProjection(fieldProjection):
+
+	if fieldProjection == "":
+		return None
+
+	try:
+		fieldProjection = readJSONSetting(fieldProjection)
+		return {"include": createFieldTree(fieldProjection.get("include", [])), "exclude": createFieldTree(fieldProjection.get("exclude", [])), "maxFieldBytes": createFieldTree({fieldPath: int(maxBytes) for fieldPath, maxBytes in fieldProjection.get("maxFieldBytes", {}).items()})}
+
+	except Exception as e:
+		log("Unable to load field projection, events won't be projected: " + str(e), "WARNING")
+		return None
+
+
+# Keep only the fields of an event that are in the field tree
+def includeFields(event, fieldTree, savedBytes):
+
+	projectedEvent = {}
+
+	for key, value in event.items():
+		branch = fieldTree.get(key)
+
+		if branch is True:
+			projectedEvent[key] = value
+		elif isinstance(branch, dict) and isinstance(value, dict):
+			projectedEvent[key] = includeFields(value, branch, savedBytes)
+		else:
+			savedBytes[0] += len(encodeJSON({key: value}))
+
+	return projectedEvent
+
+
+# Remove the fields of an event that are in the field tree
+def excludeFields(event, fieldTree, savedBytes):
+
+	# Leave events without any of the fields as they are
+	if fieldTree.keys().isdisjoint(event):
+		return event
+
+	projectedEvent = {}
+
+	for key, value in event.items():
+		branch = fieldTree.get(key)
+
+		if branch is True:
+			savedBytes[0] += len(encodeJSON({key: value}))
+		elif isinstance(branch, dict) and isinstance(value, dict):
+			projectedEvent[key] = excludeFields(value, branch, savedBytes)
+		else:
+			projectedEvent[key] = value
+
+	return projectedEvent
+
+
+# Truncate the fields of an event that are larger than their size cap in the field tree. Fields that aren't strings are truncated as JSON text.
+def truncateFields(event, fieldTree, savedBytes):
+
+	# Leave events without any of the fields as they are
+	if fieldTree.keys().isdisjoint(event):
+		return event
+
+	projectedEvent = dict(event)
+
+	for key, branch in fieldTree.items():
+		if key not in projectedEvent:
+			continue
+
+		value = projectedEvent[key]
+
+		if isinstance(branch, dict):
+			if isinstance(value, dict):
+				projectedEvent[key] = truncateFields(value, branch, savedBytes)
+			continue
+
+		fieldBytes = (value if isinstance(value, str) else encodeJSON(value)).encode("utf-8")
+		if len(fieldBytes) > branch:
+			projectedEvent[key] = fieldBytes[:branch].decode("utf-8", errors="ignore") + truncatedFieldSuffix
+			savedBytes[0] += len(fieldBytes) - branch - len(truncatedFieldSuffix)
+
+	return projectedEvent
+
+
+# Apply the field projection to JSON events, counting roughly how many bytes it saved
+def projectEvents(splitEvents, fieldProjection, savedBytes):
+
+	for event in splitEvents:
+
+		if isinstance(event, dict):
+			if len(fieldProjection["include"]) > 0:
+				event = includeFields(event, fieldProjection["include"], savedBytes)
+			if len(fieldProjection["exclude"]) > 0:
+				event = excludeFields(event, fieldProjection["exclude"], savedBytes)
+			if len(fieldProjection["maxFieldBytes"]) > 0:
+				event = truncateFields(event, fieldProjection["maxFieldBytes"], savedBytes)
+
+		yield event
+
+
+# Find where the fingerprint index for a CUR object is kept. Each part of a report has its own index in a folder for the report's billing period. Each version of a report is written under a new version folder with the same file names, so version folders are left out.
+def retrieveCurFingerprintPath(objectInfo):
+
+	scopedKey = "/".join([segment for segment in objectInfo["key"].split("/") if not curVersionPattern.fullmatch(segment)])
+
+	return retrieveSetting("LAMBDA_CUR_FINGERPRINT_LOCATION").rstrip("/") + "/" + objectInfo["bucket"] + "/" + scopedKey + ".fingerprints.gz"
+
+
+# Load the fingerprints of the line items sent from the last version of a CUR object
+def loadCurFingerprints(path):
+
+	try:
+		if path.startswith("s3://"):
+			bucket, key = path[5:].split("/", 1)
+			fingerprintData = s3Client.get_object(Bucket=bucket, Key=key)["Body"].read()
+		else:
+			with open(path, 'rb') as f:
+				fingerprintData = f.read()
+
+		fingerprintData = gzip.decompress(fingerprintData)
+	except:
+		log("No CUR fingerprint index found at " + path + ", sending every line item")
+		return {}
+
+	# Each fingerprint is a line item key followed by a row hash
+	return {fingerprintData[offset:offset + curHashSize]: fingerprintData[offset + curHashSize:offset + 2 * curHashSize] for offset in range(0, len(fingerprintData), 2 * curHashSize)}
+
+
+# Load the fingerprints of the line items sent from the other parts of a CUR object's billing period, since line items can move between parts from one version of a report to the next
+def loadOtherCurFingerprints(path):
+
+	folder = path.rsplit("/", 1)[0] + "/"
+
+	try:
+		if folder.startswith("s3://"):
+			bucket, prefix = folder[5:].split("/", 1)
+			paths = []
+			for page in s3Client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+				paths += ["s3://" + bucket + "/" + item["Key"] for item in page.get("Contents", [])]
+		else:
+			paths = [folder + fileName for fileName in os.listdir(folder)]
+	except:
+		return {}
+
+	otherFingerprints = {}
+	for otherPath in paths:
+		if otherPath != path and otherPath.endswith(".fingerprints.gz") and "/" not in otherPath[len(folder):]:
+			otherFingerprints.update(loadCurFingerprints(otherPath))
+
+	return otherFingerprints
+
+
+# Save the fingerprints of the line items sent from a CUR object
+def saveCurFingerprints(path, fingerprints):
+
+	fingerprintData = gzip.compress(b"".join([lineItemKey + rowHash for lineItemKey, rowHash in fingerprints.items()]))
+
+	try:
+		if path.startswith("s3://"):
+			bucket, key = path[5:].split("/", 1)
+			s3Client.put_object(Bucket=bucket, Key=key, Body=fingerprintData)
+		else:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path + ".tmp", 'wb') as f:
+				f.write(fingerprintData)
+			os.replace(path + ".tmp", path)
+	except:
+		return "Unable to save CUR fingerprint index " + path
+
+	return "Saved " + str(len(fingerprints)) + " CUR line item fingerprints to " + path
+
+
+# Only pass through CUR line items that are new or have changed since they were last sent, and record the fingerprint of every line item
+def filterChangedLineItems(splitEvents, previousFingerprints, currentFingerprints):
+
+	fieldNames = None
+
+	for event in splitEvents:
+
+		# Read the line item from the event, whether it's already been converted to JSON or is still a CSV line
+		if isinstance(event, dict):
+			lineItem = event
+			rowData = encodeJSON(event).encode("utf-8")
+		else:
+			rowData = event.encode("utf-8")
+
+			if event.startswith("{"):
+				try:
+					lineItem = json.loads(event)
+				except:
+					lineItem = {}
+			elif fieldNames is None:
+				fieldNames = next(csv.reader([event]), [])
+				lineItem = {}
+			else:
+				lineItem = dict(zip(fieldNames, next(csv.reader([event]), [])))
+
+		lineItemId = next((lineItem[field] for field in curLineItemIdFields if field in lineItem), None)
+
+		# Pass through events that aren't line items, like the CSV header
+		if not lineItemId:
+			yield event
+			continue
+
+		# The same line item ID can be used for more than one time interval
+		timeInterval = next((lineItem[field] for field in curTimeIntervalFields if field in lineItem), "")
+		lineItemKey = hashlib.blake2b((str(lineItemId) + "|" + str(timeInterval)).encode("utf-8"), digest_size=curHashSize).digest()
+		rowHash = hashlib.blake2b(rowData, digest_size=curHashSize).digest()
+
+		currentFingerprints[lineItemKey] = rowHash
+
+		if previousFingerprints.get(lineItemKey) != rowHash:
+			yield event
+
+
+# Create the SQS client the first time a continuation message needs it
+def retrieveSQSClient():
+
+	global sqsClient
+
+	if sqsClient is None:
+		sqsClient = boto3.client('sqs', region_name=os.environ['AWS_REGION'])
+
+	return sqsClient
+
+
+# Count the events read from an object, so a checkpoint knows where to resume from
+def countEvents(splitEvents, eventsRead):
+
+	for event in splitEvents:
+		eventsRead[0] += 1
+		yield event
+
+
+# Queue a message to continue an object from its checkpoint in another invocation
+def sendContinuationMessage(objectInfo):
+
+	try:
+		body = json.loads(objectInfo["message"]['body'])
+		body.pop("resumeFromEvent", None)
+		body.pop("resumeFromByte", None)
+		body.update(objectInfo["checkpoint"])
+		retrieveSQSClient().send_message(QueueUrl=LAMBDA_CONTINUATION_QUEUE_URL, MessageBody=json.dumps(body))
+	except:
+		return "Unable to queue continuation message for s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+
+	if "resumeFromByte" in objectInfo["checkpoint"]:
+		return "Checkpointed file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"] + " at byte " + str(objectInfo["checkpoint"]["resumeFromByte"])
+
+	return "Checkpointed file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"] + " at event " + str(objectInfo["checkpoint"]["resumeFromEvent"])
+
+
+# Record what was sent once all of an object's events have reached Firehose, or continue the object in another invocation if it stopped at a checkpoint. Returns False if the message should be retried.
+def finishObject(objectInfo):
+
+	# Save the fingerprints of the CUR line items sent, keeping the last version's for line items that weren't in this one, since they may have moved to another part of the report
+	if "curFingerprints" in objectInfo:
+		log(saveCurFingerprints(objectInfo["curFingerprintPath"], {**objectInfo["previousCurFingerprints"], **objectInfo["curFingerprints"]}))
+
+	if "checkpoint" in objectInfo:
+		continuationResult = sendContinuationMessage(objectInfo)
+		log(continuationResult)
+		return continuationResult.startswith("Checkpointed file")
+
+	# Record the object in the ledger
+	if "ledgerKey" in objectInfo:
+		log(recordInLedger(objectInfo["ledgerKey"]))
+
+	# Logging
+	log("Processed file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"])
+	return True
+
+
+# Create the DynamoDB client the first time the ledger needs it
+def retrieveDynamoDBClient():
+
+	global dynamodbClient
+
+	if dynamodbClient is None:
+		dynamodbClient = boto3.client('dynamodb', region_name=os.environ['AWS_REGION'])
+
+	return dynamodbClient
+
+
+# Build the ledger key for the version of the object in an SQS message, from the S3 notification or from S3 if the notification doesn't have it
+def retrieveLedgerKey(message, objectInfo):
+
+	try:
+		s3Object = json.loads(message['body'])['Records'][0]['s3']['object']
+		etag = s3Object['eTag']
+		version = s3Object.get('versionId', "")
+	except:
+		objectHead = retrieveS3ObjectHead(objectInfo["bucket"], objectInfo["key"])
+
+		# If the object couldn't be looked up, it can't be checked against the ledger
+		if isinstance(objectHead, str):
+			return None
+
+		etag = objectHead["etag"]
+		version = objectHead["version"]
+
+	return objectInfo["bucket"] + "/" + objectInfo["key"] + "/" + etag.strip('"') + "/" + version
+
+
+# Check whether an object version has already been sent, in DynamoDB or in a local ledger directory
+def isInLedger(ledgerKey):
+
+	try:
+		if LAMBDA_OBJECT_LEDGER.startswith("dynamodb://"):
+			response = retrieveDynamoDBClient().get_item(TableName=LAMBDA_OBJECT_LEDGER[11:], Key={"objectId": {"S": ledgerKey}}, ConsistentRead=True)
+			return "Item" in response
+
+		return os.path.exists(LAMBDA_OBJECT_LEDGER + "/" + hashlib.sha256(ledgerKey.encode("utf-8")).hexdigest())
+
+	# If the ledger can't be read, process the object rather than risk skipping it
+	except:
+		log("Unable to check object ledger for " + ledgerKey, "WARNING")
+		return False
+
+
+# Record that an object version has been sent, so redelivered messages for it are skipped
+def recordInLedger(ledgerKey):
+
+	try:
+		if LAMBDA_OBJECT_LEDGER.startswith("dynamodb://"):
+			expiresAt = int(time.time()) + ledgerRetentionDays * 86400
+			retrieveDynamoDBClient().put_item(TableName=LAMBDA_OBJECT_LEDGER[11:], Item={"objectId": {"S": ledgerKey}, "processedAt": {"N": str(int(time.time()))}, "expiresAt": {"N": str(expiresAt)}})
+		else:
+			os.makedirs(LAMBDA_OBJECT_LEDGER, exist_ok=True)
+			with open(LAMBDA_OBJECT_LEDGER + "/" + hashlib.sha256(ledgerKey.encode("utf-8")).hexdigest(), 'w') as f:
+				f.write(ledgerKey)
+	except:
+		return "Unable to record object in ledger " + ledgerKey
+
+	return "Recorded object in ledger " + ledgerKey
+
+
+# Timestamp, format, and send split events to Firehose
+def sendEvents(splitEvents, delimiter, objectInfo, eventBatch):
+
+	# Look up the timestamp extractor once for all of the events
+	extractTimestamp = retrieveTimestampExtractor(retrieveSetting("SPLUNK_TIME_FORMAT"), retrieveSetting("SPLUNK_TIME_PREFIX"), retrieveSetting("SPLUNK_TIME_DELINEATED_FIELD"), retrieveSetting("SPLUNK_STRFTIME_FORMAT"))
+
+	# Build the HEC envelope once for all of the events
+	eventEnvelope = createEventEnvelope(retrieveSetting("SPLUNK_HOST"), retrieveSetting("SPLUNK_SOURCE"), retrieveSetting("SPLUNK_SOURCETYPE"), retrieveSetting("SPLUNK_INDEX"), "  ", " }")
+
+	# Skip the events sent before the checkpoint this object is continued from
+	if objectInfo.get("resumeFromEvent", 0) > 0:
+		splitEvents = itertools.islice(splitEvents, objectInfo["resumeFromEvent"], None)
+
+	# Count the events read, if the object might need to stop at a checkpoint
+	eventsRead = [0]
+	if invocationDeadline is not None:
+		splitEvents = countEvents(splitEvents, eventsRead)
+
+	# Drop events that match the event filter rules before they're sent
+	eventFilter = retrieveEventFilter(retrieveSetting("LAMBDA_EVENT_FILTER_RULES"))
+	droppedEvents = {}
+	if len(eventFilter) > 0:
+		splitEvents = filterEvents(splitEvents, eventFilter, delimiter, droppedEvents)
+
+	# Look up which fields of JSON events to keep and truncate. Events are projected after their timestamps are read, so the time field can be left out.
+	fieldProjection = retrieveFieldProjection(retrieveSetting("LAMBDA_FIELD_PROJECTION"))
+	savedBytes = [0]
+
+	# Only send CUR line items that are new or changed since the last version of the report
+	if retrieveSetting("SPLUNK_SOURCETYPE") == "aws:billing:cur" and retrieveSetting("LAMBDA_CUR_FINGERPRINT_LOCATION") != "":
+		objectInfo["curFingerprintPath"] = retrieveCurFingerprintPath(objectInfo)
+		objectInfo["previousCurFingerprints"] = loadCurFingerprints(objectInfo["curFingerprintPath"])
+
+		objectInfo["curFingerprints"] = {}
+
+		# Line items are compared with every part of the billing period, preferring this object's own index
+		splitEvents = filterChangedLineItems(splitEvents, {**loadOtherCurFingerprints(objectInfo["curFingerprintPath"]), **objectInfo["previousCurFingerprints"]}, objectInfo["curFingerprints"])
+
+	# Loop through split events a chunk at a time
+	metrics = retrieveObjectMetrics()
+	splitEvents = iter(splitEvents)
+	while True:
+		startTime = time.perf_counter()
+		chunk = list(itertools.islice(splitEvents, timestampChunkSize))
+		addTiming(metrics, "EventBreakTime", startTime)
+		if len(chunk) == 0:
+			break
+		addMetric(metrics, "Events", len(chunk))
+
+		# Get timestamps
+		startTime = time.perf_counter()
+		timestamps = getTimestamps(chunk, delimiter, extractTimestamp)
+		addTiming(metrics, "TimestampTime", startTime)
+
+		# Construct events to send to Splunk, keeping only the fields that are needed from JSON events
+		startTime = time.perf_counter()
+		if fieldProjection is not None:
+			chunk = list(projectEvents(chunk, fieldProjection, savedBytes))
+		splunkEvents = [encodeEvent(eventEnvelope, timestamp, splitEvent) for splitEvent, timestamp in zip(chunk, timestamps)]
+		addTiming(metrics, "EnvelopeTime", startTime)
+
+		for splunkEvent in splunkEvents:
+
+			# Buffer and send the events to Firehose
+			result = bufferAndSendEventsToFirehose(splunkEvent, False, objectInfo["key"], eventBatch)
+
+			# Error logging
+			if result.startswith("Max firehose retries reached") or result.startswith("Event too large"):
+				logRepeated(result.split(" (")[0] + ". Firehose name: " + firehoseDeliverySreamName + ". File path: s3://" + objectInfo["bucket"] + "/" + objectInfo["key"], result, "ERROR")
+
+		# Stop at a checkpoint if the invocation is about to time out, so the rest of the object can be continued in another one
+		if invocationDeadline is not None and time.time() > invocationDeadline:
+
+			# Objects with their bytes counted are continued from the byte after the last line sent. Other objects, like compressed ones, are read again from the start with the events already sent skipped, which takes longer for each continuation of a large object.
+			if "bytesRead" in objectInfo:
+				objectInfo["checkpoint"] = {"resumeFromByte": objectInfo["bytesRead"][0]}
+			else:
+				objectInfo["checkpoint"] = {"resumeFromEvent": objectInfo.get("resumeFromEvent", 0) + eventsRead[0]}
+			break
+
+	# Log how many events each event filter rule dropped
+	for ruleName, droppedCount in droppedEvents.items():
+		log("Dropped " + str(droppedCount) + " events matching event filter rule " + ruleName + ". File path: s3://" + objectInfo["bucket"] + "/" + objectInfo["key"])
+
+	# Log how many bytes the field projection saved
+	if savedBytes[0] > 0:
+		log("Saved about " + str(savedBytes[0]) + " bytes by projecting event fields. File path: s3://" + objectInfo["bucket"] + "/" + objectInfo["key"])
+
+
+# Stream the object from S3 and send its events to Firehose without staging it in /tmp
+def streamObject(objectInfo, delimiter, eventBatch):
+
+	body = None
+	chunks = None
+	rangedDownloadThreads = retrieveRangedDownloadThreads()
+	resumeFromByte = objectInfo.get("resumeFromByte", 0)
+
+	# Look up the object to download large objects in byte ranges at the same time if ranged downloads are enabled, or to check there's anything left after the byte it's continued from
+	if rangedDownloadThreads > 1 or resumeFromByte > 0:
+		objectHead = retrieveS3ObjectHead(objectInfo["bucket"], objectInfo["key"])
+
+		# If the file was unable to be looked up, return the error
+		if isinstance(objectHead, str):
+			return objectHead
+
+		if resumeFromByte >= objectHead["size"]:
+			chunks = iter([])
+		elif rangedDownloadThreads > 1 and objectHead["size"] - resumeFromByte > rangedDownloadSize:
+			chunks = readRangedChunks(objectInfo["bucket"], objectInfo["key"], objectHead, rangedDownloadThreads, resumeFromByte)
+
+	# Otherwise, open the S3 object as a stream
+	if chunks is None:
+		body = streamS3Object(objectInfo["bucket"], objectInfo["key"], resumeFromByte)
+
+		# If the file was unable to be downloaded, return the error
+		if isinstance(body, str):
+			return body
+
+		chunks = readChunks(body)
+
+	try:
+		# Set extensions, looking past the compression extension the same way uncompressFile does
+		fileName = objectInfo["key"].split("/")[-1]
+		compression = fileName.split(".")[-1]
+		if compression in compressedFileTypes:
+			fileName = fileName[0:(-1*(len(compression)) - 1)]
+		extension = fileName.split(".")[-1]
+
+		# Convert CSV files to JSON a block of lines at a time if columnar conversion is enabled
+		if extension == "csv" and retrieveSetting("SPLUNK_CSV_TO_JSON") == "true" and LAMBDA_COLUMNAR_CSV == "true":
+			splitEvents = columnarCsvToJSON(streamUncompress(chunks, compression), retrieveSetting("SPLUNK_IGNORE_FIRST_LINE"))
+
+			try:
+				sendEvents(splitEvents, delimiter, objectInfo, eventBatch)
+			except:
+				return "Unable to stream file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+
+			return "Streamed file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+
+		# Count the bytes of each line read if the object might stop at a checkpoint and can be continued from a byte offset. An object continued from a byte offset has already skipped its first line.
+		if (invocationDeadline is not None or resumeFromByte > 0) and canResumeFromByte(objectInfo["key"]):
+			objectInfo["bytesRead"] = [resumeFromByte]
+			splitEvents = chunksToTrackedLines(chunks, objectInfo["bytesRead"])
+
+			if retrieveSetting("SPLUNK_IGNORE_FIRST_LINE") == "true" and resumeFromByte == 0:
+				splitEvents = itertools.islice(splitEvents, 1, None)
+
+		# Otherwise, uncompress and split events as the object is read
+		else:
+			splitEvents = streamEventBreak(streamUncompress(chunks, compression), extension, retrieveSetting("SPLUNK_IGNORE_FIRST_LINE"))
+
+		# If a string was returned instead of events, return the error
+		if isinstance(splitEvents, str):
+			return "File type unsupported s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+
+		# Clean up first line of events
+		if retrieveSetting("SPLUNK_SOURCETYPE") == "aws:billing:cur":
+			splitEvents = streamCleanFirstLine(splitEvents)
+
+		# Transform CSV to JSON
+		if retrieveSetting("SPLUNK_CSV_TO_JSON") == "true":
+			splitEvents = streamCsvToJSON(splitEvents)
+
+		# Send events as they are read
+		try:
+			sendEvents(splitEvents, delimiter, objectInfo, eventBatch)
+		except:
+			return "Unable to stream file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+
+		return "Streamed file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+
+	finally:
+		if body is not None:
+			body.close()
+
+
+# Process the object in one SQS message. Returns False if the message should be retried because the object didn't fully reach Firehose.
+def processMessage(message, delimiter):
+
+	# Retrieve bucket name and key from SQS message
+	objectInfo = retrieveObjectInfo(message)
+
+	# Set eventBatch value, on a per-object basis
+	eventBatch = [0]
+
+	# If a string was returned instead of a dictionary, print the error and stop processing this object
+	if isinstance(objectInfo, str):
+		log(objectInfo, "ERROR")
+		return True
+
+	# Keep the message, so the object can be continued from a checkpoint
+	objectInfo["message"] = message
+
+	# Validate file types
+	isValidFileTypeResult = isValidFileType(objectInfo["key"])
+	if not isValidFileTypeResult:
+		log("Unsupported file type: s3://" + objectInfo["bucket"] + "/" + objectInfo["key"], "WARNING")
+		return True
+
+	# Skip objects that have already been sent, if the object ledger is enabled
+	if LAMBDA_OBJECT_LEDGER != "":
+		ledgerKey = retrieveLedgerKey(message, objectInfo)
+
+		if ledgerKey is not None:
+			if isInLedger(ledgerKey):
+				log("Already processed file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"] + ", skipping")
+				return True
+
+			objectInfo["ledgerKey"] = ledgerKey
+	
+	# Stream the object straight from S3 if streaming is enabled, or if it's continued from a checkpoint and can be continued from a byte offset next time. Parquet needs random access, so it's always downloaded.
+	isContinuation = "resumeFromEvent" in objectInfo or "resumeFromByte" in objectInfo
+	if (LAMBDA_STREAMING_MODE == "true" or (isContinuation and canResumeFromByte(objectInfo["key"]))) and not objectInfo["key"].endswith(".parquet"):
+
+		streamResult = streamObject(objectInfo, delimiter, eventBatch)
+
+		# If the file was unable to be streamed, print the error, discard the events buffered from it so they aren't sent again when it's retried, and stop processing this object
+		if not streamResult.startswith("Streamed file"):
+			log(streamResult, "ERROR")
+			resetRecordBatch()
+			return False
+
+		# Send the remaining events to Firehose, effectively clearing the buffered events in recordBatch
+		finalResult = bufferAndSendEventsToFirehose("", True, objectInfo["key"], eventBatch)
+
+		# If any events were dropped, print the error and stop processing this object
+		if finalResult == "Max firehose retries reached":
+			log("Unable to send all events to Firehose for s3://" + objectInfo["bucket"] + "/" + objectInfo["key"], "ERROR")
+			return False
+
+		# Record what was sent
+		return finishObject(objectInfo)
+
+	# Keep small objects in memory instead of writing them to /tmp
+	if int(LAMBDA_IN_MEMORY_OBJECT_BYTES) > 0:
+		objectSize = retrieveObjectSize(message, objectInfo)
+
+		if objectSize is not None and objectSize <= int(LAMBDA_IN_MEMORY_OBJECT_BYTES):
+			startTime = time.perf_counter()
+			loadResult = loadS3Object(objectInfo["bucket"], objectInfo["key"])
+			addTiming(retrieveObjectMetrics(), "DownloadTime", startTime)
+			addMetric(retrieveObjectMetrics(), "ObjectBytes", objectSize)
+
+			# If the file was unable to be downloaded or uncompressed, print the error and stop processing this object
+			if isinstance(loadResult, str):
+				log(loadResult, "ERROR")
+				return False
+
+			return processObjectFile(objectInfo, loadResult["file"], loadResult["extension"], delimiter, eventBatch)
+
+	# Retrieve the S3 object and uncompress it
+	startTime = time.perf_counter()
+	downloadResult = downloadS3Object(objectInfo["bucket"], objectInfo["key"])
+	addTiming(retrieveObjectMetrics(), "DownloadTime", startTime)
+	
+	# If the file was unable to be downloaded, print the error and stop processing this object
+	if "Unable to download" in downloadResult:
+		log(downloadResult, "ERROR")
+		return False
+
+	try:
+		addMetric(retrieveObjectMetrics(), "ObjectBytes", os.path.getsize(downloadResult))
+
+		# Send file info to be uncompressed
+		startTime = time.perf_counter()
+		uncompressResult = uncompressFile(downloadResult)
+		addTiming(retrieveObjectMetrics(), "UncompressTime", startTime)
+
+		# If the file was unable to be compressed, print the error and stop processing this object
+		if "Unable to uncompress file" in uncompressResult:
+			log("Unable to uncompress file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"], "ERROR")
+			return False
+
+		# Set extension 
+		extension = uncompressResult.split(".")[-1]
+
+		with open(uncompressResult, 'rb') as objectFile:
+			return processObjectFile(objectInfo, objectFile, extension, delimiter, eventBatch)
+
+	finally:
+		# Delete the scratch directory to clear up space in /tmp to make room for the next one
+		shutil.rmtree(os.path.dirname(downloadResult), ignore_errors=True)
+
+
+# Send the events in an uncompressed object, read from a file in /tmp or from memory. Returns False if the message should be retried because the object didn't fully reach Firehose.
+def processObjectFile(objectInfo, objectFile, extension, delimiter, eventBatch):
+
+	# Read Parquet files one record batch at a time and send the rows as NDJSON events. CSV files converted to JSON are read a block of lines at a time if columnar conversion is enabled.
+	if extension == "parquet" or (extension == "csv" and retrieveSetting("SPLUNK_CSV_TO_JSON") == "true" and LAMBDA_COLUMNAR_CSV == "true"):
+
+		# Send split events
+		try:
+			if extension == "parquet":
+				sendEvents(parquetEventBreak(objectFile), delimiter, objectInfo, eventBatch)
+			else:
+				sendEvents(columnarCsvToJSON(readChunks(objectFile), retrieveSetting("SPLUNK_IGNORE_FIRST_LINE")), delimiter, objectInfo, eventBatch)
+			parquetResult = "Processed file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+		except Exception:
+			parquetResult = "Unable to read " + extension + " file s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+
+		# Send the remaining events to Firehose, effectively clearing the buffered events in recordBatch. If the file couldn't be read, discard them instead so they aren't sent again when it's retried.
+		if parquetResult.startswith("Processed file"):
+			finalResult = bufferAndSendEventsToFirehose("", True, objectInfo["key"], eventBatch)
+
+			# If any events were dropped, report the object as not processed
+			if finalResult == "Max firehose retries reached":
+				parquetResult = "Unable to send all events to Firehose for s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+		else:
+			resetRecordBatch()
+
+		# Record what was sent
+		if parquetResult.startswith("Processed file"):
+			return finishObject(objectInfo)
+
+		# Logging
+		log(parquetResult, "ERROR")
+		return False
+
+	# Try to read the file contents into memory
+	startTime = time.perf_counter()
+	try:
+		events = io.TextIOWrapper(objectFile).read()
+	except:
+		log("Unable to read file contents into memory", "ERROR")
+		return False
+
+	# Split events
+	splitEvents = eventBreak(events, extension, retrieveSetting("SPLUNK_IGNORE_FIRST_LINE"))
+
+	# Clean up first line of events
+	if retrieveSetting("SPLUNK_SOURCETYPE") == "aws:billing:cur":
+		splitEvents = cleanFirstLine(splitEvents)
+
+	# If a string was returned instead of a list, print the error and stop processing this object
+	if isinstance(splitEvents, str):
+		log("File type unsupported s3://" + objectInfo["bucket"] + "/" + objectInfo["key"], "WARNING")
+		return True
+
+	# Transform CSV to JSON
+	if retrieveSetting("SPLUNK_CSV_TO_JSON") == "true":
+		splitEvents = csvToJSON(splitEvents)
+	addTiming(retrieveObjectMetrics(), "EventBreakTime", startTime)
+
+	# Send split events
+	sendEvents(splitEvents, delimiter, objectInfo, eventBatch)
+
+	# Send the remaining events to Firehose, effectively clearing the buffered events in recordBatch
+	finalResult = bufferAndSendEventsToFirehose("", True, objectInfo["key"], eventBatch)
+
+	# If any events were dropped, print the error and report the object as not processed
+	if finalResult == "Max firehose retries reached":
+		log("Unable to send all events to Firehose for s3://" + objectInfo["bucket"] + "/" + objectInfo["key"], "ERROR")
+		return False
+
+	# Record what was sent
+	return finishObject(objectInfo)
+
+
+# Look up an object's size from its S3 notification, or from S3 if the notification doesn't have it
+def retrieveObjectSize(message, objectInfo):
+
+	try:
+		return int(json.loads(message['body'])['Records'][0]['s3']['object']['size'])
+	except:
+		objectHead = retrieveS3ObjectHead(objectInfo["bucket"], objectInfo["key"])
+
+		# If the object couldn't be looked up, the size is unknown
+		if isinstance(objectHead, str):
+			return None
+
+		return objectHead["size"]
+
+
+# Estimate how many bytes of memory and /tmp an object will use while it's processed
+def estimateObjectBytes(message):
+
+	try:
+		record = json.loads(message['body'])
+		key = record['Records'][0]['s3']['object']['key']
+		size = int(record['Records'][0]['s3']['object'].get('size', 0))
+	except:
+		return 0
+
+	# Compressed objects take up much more space once they're uncompressed
+	if key.split(".")[-1] in compressedFileTypes:
+		size = size * compressedSizeRatio
+
+	return size
+
+
+# Wait until the object fits in the byte budget and no other object with the same file name, like another version of the same CUR report, is being processed, then reserve it
+def reserveObjectBytes(budget, message):
+
+	# Objects larger than the whole budget are processed once nothing else is
+	size = min(estimateObjectBytes(message), budget["limit"])
+	fileName = None
+	objectInfo = retrieveObjectInfo(message)
+	if isinstance(objectInfo, dict):
+		fileName = objectInfo["key"].split("/")[-1]
+
+	with budget["condition"]:
+		while budget["used"] + size > budget["limit"] or fileName in budget["fileNames"]:
+			budget["condition"].wait()
+		budget["used"] += size
+		if fileName is not None:
+			budget["fileNames"].add(fileName)
+
+	return size, fileName
+
+
+# Return an object's reservation to the byte budget
+def releaseObjectBytes(budget, size, fileName):
+
+	with budget["condition"]:
+		budget["used"] -= size
+		budget["fileNames"].discard(fileName)
+		budget["condition"].notify_all()
+
+
+# Load and compile the routing table, from the setting itself or from a routing table file in S3. This only happens once for the same setting.
+@functools.lru_cache
+def retrieveRoutingTable(routingTable):
+
+	if routingTable == "":
+		return []
+
+	try:
+		routes = []
+		for routeNumber, route in enumerate(readJSONSetting(routingTable), 1):
+			# Filter rules and field projections can be given as JSON in the profile itself, the same as in their environment variables
+			profile = {settingName: json.dumps(value) if isinstance(value, (dict, list)) else str(value) for settingName, value in route["profile"].items()}
+
+			unknownSettings = [settingName for settingName in profile.keys() if settingName not in routingSettings]
+			if len(unknownSettings) > 0:
+				raise ValueError("route " + str(routeNumber) + " has unknown settings: " + ", ".join(unknownSettings))
+
+			# Match the bucket name and the start of the key with shell-style wildcards
+			routes.append({"bucket": re.compile(fnmatch.translate(route.get("bucket", "*"))), "keyPrefix": re.compile(fnmatch.translate(route.get("keyPrefix", "") + "*")), "profile": profile})
+
+		return routes
+
+	except Exception as e:
+		log("Unable to load routing table, objects will use the function's settings: " + str(e), "WARNING")
+		return []
+
+
+# Find the profile for an object in the routing table, using the first route that matches its bucket and key
+def routeObject(objectInfo):
+
+	if not isinstance(objectInfo, dict):
+		return None
+
+	for route in retrieveRoutingTable(LAMBDA_ROUTING_TABLE):
+		if route["bucket"].match(objectInfo["bucket"]) and route["keyPrefix"].match(objectInfo["key"]):
+			return route["profile"]
+
+	return None
+
+
+# Look up a setting for the object being processed, from its routing table profile if it sets it, or else from the function's environment variables
+def retrieveSetting(settingName):
+
+	profile = getattr(objectState, "profile", None)
+	if profile is not None and settingName in profile:
+		return profile[settingName]
+
+	return globals()[settingName]
+
+
+# Process the object in one SQS message, treating an unexpected error as a failure to retry
+def tryProcessMessage(message, delimiter):
+
+	# Use the profile the object routes to, if a routing table is configured
+	objectState.profile = None
+	if LAMBDA_ROUTING_TABLE != "":
+		objectState.profile = routeObject(retrieveObjectInfo(message))
+		delimiter = createDelimiter(retrieveSetting("SPLUNK_EVENT_DELIMITER"))
+
+	# Collect the object's metrics, if metrics are enabled
+	if LAMBDA_METRICS_NAMESPACE != "":
+		objectState.metrics = createObjectMetrics()
+	startTime = time.perf_counter()
+
+	try:
+		return processMessage(message, delimiter)
+	except Exception as e:
+		log("Unable to process SQS message: " + str(e), "ERROR")
+		resetRecordBatch()
+		return False
+	finally:
+		if LAMBDA_METRICS_NAMESPACE != "":
+			addTiming(objectState.metrics, "ObjectTime", startTime)
+			emitObjectMetrics(objectState.metrics, retrieveObjectInfo(message))
+			del objectState.metrics
+		objectState.profile = None
+
+
+# Process the object in one SQS message from a worker thread, with its own record batch
+def processMessageConcurrently(message, delimiter, budget, size, fileName):
+
+	objectState.recordBatch = {"records": [], "bytes": 0, "packedRecord": bytearray(), "failedSends": 0}
+	objectState.pendingSends = []
+
+	try:
+		return tryProcessMessage(message, delimiter)
+	finally:
+		del objectState.recordBatch
+		del objectState.pendingSends
+		releaseObjectBytes(budget, size, fileName)
+
+
+# Print a log line if its level is enabled, counting it against the invocation's line budget
+def log(message, level="INFO"):
+
+	if logLevels.get(level, logLevels["INFO"]) < logLevels.get(LAMBDA_LOG_LEVEL, logLevels["INFO"]):
+		return
+
+	with logLock:
+		if int(LAMBDA_LOG_LINE_BUDGET) > 0 and logState["lines"] >= int(LAMBDA_LOG_LINE_BUDGET):
+			logState["suppressed"] += 1
+			return
+		logState["lines"] += 1
+
+	print(message)
+
+
+# Count a message that can repeat for every event or batch, keeping a few examples, instead of printing it each time. The counts are printed as a summary every logSummaryInterval seconds and at the end of the invocation.
+def logRepeated(message, example="", level="WARNING"):
+
+	if logLevels.get(level, logLevels["INFO"]) < logLevels.get(LAMBDA_LOG_LEVEL, logLevels["INFO"]):
+		return
+
+	with logLock:
+		if message not in logState["repeated"]:
+			logState["repeated"][message] = {"count": 0, "examples": [], "level": level}
+
+		repeated = logState["repeated"][message]
+		repeated["count"] += 1
+		if len(example) > 0 and len(repeated["examples"]) < logExampleCount:
+			repeated["examples"].append(example[:logExampleLength])
+
+		summaryDue = time.time() - logState["lastSummary"] >= logSummaryInterval
+
+	if summaryDue:
+		flushLogSummaries()
+
+
+# Print a summary line for each repeated message counted since the last summary. Summaries aren't held to the line budget, since there's at most one per message each interval.
+def flushLogSummaries():
+
+	with logLock:
+		repeatedMessages = logState["repeated"]
+		logState["repeated"] = {}
+		logState["lastSummary"] = time.time()
+
+	for message, repeated in repeatedMessages.items():
+		summary = message + " (" + str(repeated["count"]) + " times)"
+		if len(repeated["examples"]) > 0:
+			summary += ". Examples: " + " | ".join(repeated["examples"])
+		print(summary)
+
+
+# Start counting log lines against the line budget for a new invocation
+def startInvocationLog():
+
+	with logLock:
+		logState["lines"] = 0
+		logState["suppressed"] = 0
+
+
+# Print the repeated messages left at the end of an invocation, and how many lines went over the line budget
+def finishInvocationLog():
+
+	flushLogSummaries()
+
+	if logState["suppressed"] > 0:
+		print("Suppressed " + str(logState["suppressed"]) + " log lines over the budget of " + LAMBDA_LOG_LINE_BUDGET + " lines for this invocation")
+
+
+# Start an object's metrics at zero
+def createObjectMetrics():
+
+	return {metricName: 0 for metricName in metricUnits.keys()}
+
+
+# Return the metrics for the object this thread is processing, or None if metrics aren't enabled
+def retrieveObjectMetrics():
+
+	return getattr(objectState, "metrics", None)
+
+
+# Add to one of an object's metrics. Sender threads add to the metrics of the object they're sending for, so adding is locked.
+def addMetric(metrics, metricName, value):
+
+	if metrics is None:
+		return
+
+	with metricsLock:
+		metrics[metricName] += value
+
+
+# Add the milliseconds since startTime to one of an object's timing metrics
+def addTiming(metrics, metricName, startTime):
+
+	if metrics is not None:
+		addMetric(metrics, metricName, (time.perf_counter() - startTime) * 1000)
+
+
+# Print an object's metrics in CloudWatch Embedded Metric Format, so CloudWatch Logs turns them into metrics without any extra API calls
+def emitObjectMetrics(metrics, objectInfo):
+
+	metricsLog = {"_aws": {"Timestamp": int(time.time() * 1000), "CloudWatchMetrics": [{"Namespace": LAMBDA_METRICS_NAMESPACE, "Dimensions": [["sourcetype"]], "Metrics": [{"Name": metricName, "Unit": metricUnit} for metricName, metricUnit in metricUnits.items()]}]}, "sourcetype": retrieveSetting("SPLUNK_SOURCETYPE")}
+
+	for metricName in metricUnits.keys():
+		metricsLog[metricName] = round(metrics[metricName], 3)
+
+	# Keep the object's path with its metrics, so slow objects can be found in the logs
+	if isinstance(objectInfo, dict):
+		metricsLog["filePath"] = "s3://" + objectInfo["bucket"] + "/" + objectInfo["key"]
+
+	print(json.dumps(metricsLog))
+
+
+# Default Lambda handler
+def handler(event, context):
+
+	global invocationDeadline, invocationEndTime
+
+	# Start counting log lines for this invocation
+	startInvocationLog()
+
+	# Create delineated field break
+	delimiter = createDelimiter(SPLUNK_EVENT_DELIMITER)
+
+	# Work out when the invocation times out, so Firehose retries don't sleep past it
+	invocationEndTime = None
+	if hasattr(context, "get_remaining_time_in_millis"):
+		invocationEndTime = time.time() + context.get_remaining_time_in_millis() / 1000
+
+	# Replay batches spilled to S3 when invoked with {"replaySpill": {}}, instead of processing SQS messages
+	if "replaySpill" in event:
+		replayResult = replaySpilledBatches(event["replaySpill"])
+		logFirehoseThrottles()
+		finishInvocationLog()
+		return replayResult
+
+	# Work out when objects should stop at a checkpoint, leaving time to flush their events before the invocation times out
+	invocationDeadline = None
+	if LAMBDA_CONTINUATION_QUEUE_URL != "" and hasattr(context, "get_remaining_time_in_millis"):
+		remainingMillis = context.get_remaining_time_in_millis()
+		invocationDeadline = time.time() + (remainingMillis - min(checkpointMarginMillis, remainingMillis * checkpointMarginFraction)) / 1000
+
+	# Messages whose objects didn't fully reach Firehose
+	batchItemFailures = []
+
+	# Process each SQS message one after another, unless concurrent objects are configured
+	concurrentObjects = int(LAMBDA_CONCURRENT_OBJECTS)
+	if concurrentObjects <= 1 or len(event['Records']) <= 1:
+		for message in event['Records']:
+			if not tryProcessMessage(message, delimiter):
+				batchItemFailures.append({"itemIdentifier": message['messageId']})
+
+	# Process several objects at once, starting the next one as soon as it fits in the byte budget
+	else:
+		budget = {"limit": int(LAMBDA_CONCURRENT_OBJECT_BYTES), "used": 0, "fileNames": set(), "condition": threading.Condition()}
+		processing = []
+		with concurrent.futures.ThreadPoolExecutor(max_workers=concurrentObjects) as executor:
+			for message in event['Records']:
+				size, fileName = reserveObjectBytes(budget, message)
+				processing.append((message, executor.submit(processMessageConcurrently, message, delimiter, budget, size, fileName)))
+
+		for message, result in processing:
+			if not result.result():
+				batchItemFailures.append({"itemIdentifier": message['messageId']})
+
+	# Print how often Firehose throttled sends, then the repeated messages that haven't been summarized yet
+	logFirehoseThrottles()
+	finishInvocationLog()
+
+	# Report only the failed messages, so SQS redelivers just those objects instead of the whole batch
+	return {"batchItemFailures": batchItemFailures}
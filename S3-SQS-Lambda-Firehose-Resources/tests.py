@@ -1,5 +1,7 @@
-import unittest, os, importlib, time, moto, boto3, glob, shutil
+import unittest, unittest.mock, os, importlib, botocore.exceptions, base64, time, threading, moto, boto3, glob, shutil, gzip, json, datetime, decimal, pyarrow, pyarrow.parquet, dateutil.parser, subprocess, sys, tempfile
 
+# Files and directories the tests create in tmp, which tearDown deletes
+testTmpFiles = ["cloudtrail.json", "route53Resolver.log", "s3accesslog.json", "file1.json", "file2.json", "test.parquet", "cur-00001.csv.gz", "cur-00001.snappy.parquet", "cur-fingerprints", "object-ledger", "testFile1.log.gz", "testFile1.log", "testFile2.log.gz", "testFile2.log"]
 
 class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 
@@ -47,6 +49,32 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 		self.lambda_module.SPLUNK_TIME_DELINEATED_FIELD = "main"
 		self.lambda_module.SPLUNK_EVENT_DELIMITER = "main"
 		self.lambda_module.SPLUNK_STRFTIME_FORMAT = "main"
+		self.lambda_module.SPLUNK_IGNORE_FIRST_LINE = "main"
+		self.lambda_module.LAMBDA_STREAMING_MODE = "false"
+		self.lambda_module.LAMBDA_PACK_EVENTS = "false"
+		self.lambda_module.LAMBDA_FIREHOSE_SENDER_THREADS = "0"
+		self.lambda_module.LAMBDA_CONCURRENT_OBJECTS = "1"
+		self.lambda_module.LAMBDA_CONCURRENT_OBJECT_BYTES = "268435456"
+		self.lambda_module.LAMBDA_VECTORIZED_TIMESTAMPS = "false"
+		self.lambda_module.LAMBDA_COLUMNAR_CSV = "false"
+		self.lambda_module.LAMBDA_CUR_FINGERPRINT_LOCATION = ""
+		self.lambda_module.LAMBDA_RANGED_DOWNLOAD_THREADS = "0"
+		self.lambda_module.LAMBDA_IN_MEMORY_OBJECT_BYTES = "0"
+		self.lambda_module.LAMBDA_EVENT_FILTER_RULES = ""
+		self.lambda_module.LAMBDA_FIELD_PROJECTION = ""
+		self.lambda_module.LAMBDA_OBJECT_LEDGER = ""
+		self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL = ""
+		self.lambda_module.LAMBDA_METRICS_NAMESPACE = ""
+		self.lambda_module.LAMBDA_LOG_LEVEL = "INFO"
+		self.lambda_module.LAMBDA_LOG_LINE_BUDGET = "0"
+		self.lambda_module.LAMBDA_ROUTING_TABLE = ""
+		self.lambda_module.LAMBDA_FIREHOSE_MAX_BYTES_PER_SECOND = "0"
+		self.lambda_module.firehoseRateLimiter = None
+		self.lambda_module.invocationEndTime = None
+		self.lambda_module.LAMBDA_SPILL_LOCATION = ""
+		self.lambda_module.LAMBDA_SPILL_AFTER_ATTEMPTS = "3"
+		self.lambda_module.logState = {"lines": 0, "suppressed": 0, "repeated": {}, "lastSummary": time.time()}
+		self.lambda_module.recordBatch = {"records": [], "bytes": 0, "packedRecord": bytearray(), "failedSends": 0}
 
 		# Set up mock mock_iam
 		iamClient = boto3.client('iam')
@@ -175,6 +203,307 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 		self.assertEqual(self.lambda_module.csvToJSON(['version,account-id,interface-id,srcaddr,dstaddr,srcport,dstport,protocol,packets,bytes,start,end,action,log-status','2,841154226728,eni-0b48139ba00b9b7bb,3.225.203.212,172.21.12.101,443,33910,6,11,4832,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,91.240.118.245,172.21.12.101,54792,3414,6,1,40,1666655969,1666655995,REJECT,OK','2,841154226728,eni-0b48139ba00b9b7bb,3.208.215.234,172.21.12.101,443,44024,6,11,4832,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,3.223.109.193,38608,443,6,7,539,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,3.223.109.193,172.21.12.101,443,38608,6,10,675,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,54.192.76.118,172.21.12.101,443,56238,6,11,6829,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,3.223.109.193,172.21.12.101,443,59154,6,11,4832,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,5.8.18.58,172.21.12.101,54775,10623,6,1,40,1666655969,1666655995,REJECT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,3.208.215.234,44024,443,6,10,1450,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,192.73.240.132,41641,3478,17,2,136,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,192.73.252.65,172.21.12.101,3478,41641,17,1,72,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,52.94.181.224,172.21.12.101,443,45320,6,20,6719,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,3.225.203.212,60974,443,6,10,1450,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,52.94.181.224,45320,443,6,20,3269,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,3.223.109.193,172.21.12.101,443,57994,6,11,4832,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,192.73.242.204,41641,3478,17,2,136,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,98.225.75.79,41641,41648,17,282,104132,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,98.225.75.79,172.21.12.101,41648,41641,17,285,63974,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,52.43.162.85,9997,57818,6,173,11620,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,3.225.203.212,33910,443,6,10,1450,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,203.0.113.1,58070,12345,17,1,101,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,3.225.203.212,172.21.12.101,443,60974,6,11,4832,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,78.128.112.170,172.21.12.101,55754,57539,6,1,40,1666655969,1666655995,REJECT,OK','2,841154226728,eni-0b48139ba00b9b7bb,192.73.242.204,172.21.12.101,3478,41641,17,2,144,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,54.192.76.118,56238,443,6,10,1192,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,3.223.109.193,59154,443,6,10,1450,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,52.43.162.85,172.21.12.101,57818,9997,6,819,1162439,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,192.73.240.132,172.21.12.101,3478,41641,17,2,144,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,192.73.252.65,41641,3478,17,1,68,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,3.223.109.193,57994,443,6,10,1450,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,208.111.34.178,172.21.12.101,3478,41641,17,2,144,1666655969,1666655995,ACCEPT,OK','2,841154226728,eni-0b48139ba00b9b7bb,172.21.12.101,208.111.34.178,41641,3478,17,2,136,1666655969,1666655995,ACCEPT,OK']), [{'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '3.225.203.212', 'dstaddr': '172.21.12.101', 'srcport': '443', 'dstport': '33910', 'protocol': '6', 'packets': '11', 'bytes': '4832', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '91.240.118.245', 'dstaddr': '172.21.12.101', 'srcport': '54792', 'dstport': '3414', 'protocol': '6', 'packets': '1', 'bytes': '40', 'start': '1666655969', 'end': '1666655995', 'action': 'REJECT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '3.208.215.234', 'dstaddr': '172.21.12.101', 'srcport': '443', 'dstport': '44024', 'protocol': '6', 'packets': '11', 'bytes': '4832', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '3.223.109.193', 'srcport': '38608', 'dstport': '443', 'protocol': '6', 'packets': '7', 'bytes': '539', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '3.223.109.193', 'dstaddr': '172.21.12.101', 'srcport': '443', 'dstport': '38608', 'protocol': '6', 'packets': '10', 'bytes': '675', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '54.192.76.118', 'dstaddr': '172.21.12.101', 'srcport': '443', 'dstport': '56238', 'protocol': '6', 'packets': '11', 'bytes': '6829', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '3.223.109.193', 'dstaddr': '172.21.12.101', 'srcport': '443', 'dstport': '59154', 'protocol': '6', 'packets': '11', 'bytes': '4832', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '5.8.18.58', 'dstaddr': '172.21.12.101', 'srcport': '54775', 'dstport': '10623', 'protocol': '6', 'packets': '1', 'bytes': '40', 'start': '1666655969', 'end': '1666655995', 'action': 'REJECT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '3.208.215.234', 'srcport': '44024', 'dstport': '443', 'protocol': '6', 'packets': '10', 'bytes': '1450', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '192.73.240.132', 'srcport': '41641', 'dstport': '3478', 'protocol': '17', 'packets': '2', 'bytes': '136', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '192.73.252.65', 'dstaddr': '172.21.12.101', 'srcport': '3478', 'dstport': '41641', 'protocol': '17', 'packets': '1', 'bytes': '72', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '52.94.181.224', 'dstaddr': '172.21.12.101', 'srcport': '443', 'dstport': '45320', 'protocol': '6', 'packets': '20', 'bytes': '6719', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '3.225.203.212', 'srcport': '60974', 'dstport': '443', 'protocol': '6', 'packets': '10', 'bytes': '1450', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '52.94.181.224', 'srcport': '45320', 'dstport': '443', 'protocol': '6', 'packets': '20', 'bytes': '3269', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '3.223.109.193', 'dstaddr': '172.21.12.101', 'srcport': '443', 'dstport': '57994', 'protocol': '6', 'packets': '11', 'bytes': '4832', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '192.73.242.204', 'srcport': '41641', 'dstport': '3478', 'protocol': '17', 'packets': '2', 'bytes': '136', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '98.225.75.79', 'srcport': '41641', 'dstport': '41648', 'protocol': '17', 'packets': '282', 'bytes': '104132', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '98.225.75.79', 'dstaddr': '172.21.12.101', 'srcport': '41648', 'dstport': '41641', 'protocol': '17', 'packets': '285', 'bytes': '63974', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '52.43.162.85', 'srcport': '9997', 'dstport': '57818', 'protocol': '6', 'packets': '173', 'bytes': '11620', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '3.225.203.212', 'srcport': '33910', 'dstport': '443', 'protocol': '6', 'packets': '10', 'bytes': '1450', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '203.0.113.1', 'srcport': '58070', 'dstport': '12345', 'protocol': '17', 'packets': '1', 'bytes': '101', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '3.225.203.212', 'dstaddr': '172.21.12.101', 'srcport': '443', 'dstport': '60974', 'protocol': '6', 'packets': '11', 'bytes': '4832', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '78.128.112.170', 'dstaddr': '172.21.12.101', 'srcport': '55754', 'dstport': '57539', 'protocol': '6', 'packets': '1', 'bytes': '40', 'start': '1666655969', 'end': '1666655995', 'action': 'REJECT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '192.73.242.204', 'dstaddr': '172.21.12.101', 'srcport': '3478', 'dstport': '41641', 'protocol': '17', 'packets': '2', 'bytes': '144', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '54.192.76.118', 'srcport': '56238', 'dstport': '443', 'protocol': '6', 'packets': '10', 'bytes': '1192', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '3.223.109.193', 'srcport': '59154', 'dstport': '443', 'protocol': '6', 'packets': '10', 'bytes': '1450', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '52.43.162.85', 'dstaddr': '172.21.12.101', 'srcport': '57818', 'dstport': '9997', 'protocol': '6', 'packets': '819', 'bytes': '1162439', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '192.73.240.132', 'dstaddr': '172.21.12.101', 'srcport': '3478', 'dstport': '41641', 'protocol': '17', 'packets': '2', 'bytes': '144', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '192.73.252.65', 'srcport': '41641', 'dstport': '3478', 'protocol': '17', 'packets': '1', 'bytes': '68', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '3.223.109.193', 'srcport': '57994', 'dstport': '443', 'protocol': '6', 'packets': '10', 'bytes': '1450', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '208.111.34.178', 'dstaddr': '172.21.12.101', 'srcport': '3478', 'dstport': '41641', 'protocol': '17', 'packets': '2', 'bytes': '144', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}, {'version': '2', 'account-id': '841154226728', 'interface-id': 'eni-0b48139ba00b9b7bb', 'srcaddr': '172.21.12.101', 'dstaddr': '208.111.34.178', 'srcport': '41641', 'dstport': '3478', 'protocol': '17', 'packets': '2', 'bytes': '136', 'start': '1666655969', 'end': '1666655995', 'action': 'ACCEPT', 'log-status': 'OK'}])
 
 
+	def test_columnarCsvToJSON(self):
+
+		self.lambda_module.SPLUNK_CSV_TO_JSON = "true"
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:billing:cur"
+
+		# CUR header, quoted fields, empty fields, a column that's always empty, and a row with an extra field
+		csvLines = ['identity/LineItemId,lineItem/UsageAmount,product/region,product/empty', '1,"1,5",us-east-1,', '2,,"us-west-2",', '3,4,us-east-1,,extra']
+
+		for removeEmptyFields in ["false", "true"]:
+			self.lambda_module.SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS = removeEmptyFields
+
+			# Verify the events are the same as converting one line at a time, with the file split into small chunks
+			expectedEvents = self.lambda_module.csvToJSON(self.lambda_module.cleanFirstLine(list(csvLines)))
+			chunks = [("\r\n".join(csvLines) + "\r\n").encode("utf-8")[i:i + 7] for i in range(0, 200, 7)]
+			self.assertEqual(list(self.lambda_module.columnarCsvToJSON(chunks, "false")), expectedEvents)
+
+		# Verify the columns that are empty in every row are removed
+		self.assertEqual(expectedEvents[1], {"LineItemId": "2", "region": "us-west-2"})
+
+		# Test ignoring the first line, with a header and no newline at the end
+		self.assertEqual(list(self.lambda_module.columnarCsvToJSON([b'#version 1\nidentity/LineItemId\n1'], "true")), [{"LineItemId": "1"}])
+		self.assertEqual(list(self.lambda_module.columnarCsvToJSON([b'identity/LineItemId'], "false")), [])
+
+		# Quoted fields with line breaks, including one split across blocks, and rows with the wrong number of fields should match converting one line at a time, in the same order
+		self.lambda_module.SPLUNK_SOURCETYPE = ""
+		self.lambda_module.csvBlockSize = 20
+		self.lambda_module.SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS = "false"
+		csvLines = ['id,value', '1,"multi', 'line"', '2,short', '3,too,many,fields', '4', '5,"a ""quoted"" value"', '6,"split', 'across', 'blocks"', '7,last']
+		expectedEvents = self.lambda_module.csvToJSON(list(csvLines))
+		chunks = [("\n".join(csvLines) + "\n").encode("utf-8")[i:i + 7] for i in range(0, 200, 7)]
+		self.assertEqual(list(self.lambda_module.columnarCsvToJSON(chunks, "false")), expectedEvents)
+		self.lambda_module.csvBlockSize = 4194304
+		self.assertEqual([event["id"] for event in expectedEvents], ["1", "2", "3", "4", "5", "6", "7"])
+		self.assertEqual(expectedEvents[0]["value"], "multiline")
+
+
+	def test_filterChangedLineItems(self):
+
+		previousFingerprints = {}
+		currentFingerprints = {}
+
+		# Verify every line item is sent the first time, along with events that aren't line items
+		csvLines = ["LineItemId,TimeInterval,UnblendedCost", "a,2023-01-01T00:00:00Z/2023-01-01T01:00:00Z,1", "a,2023-01-01T01:00:00Z/2023-01-01T02:00:00Z,2", "b,2023-01-01T00:00:00Z/2023-01-01T01:00:00Z,3"]
+		self.assertEqual(list(self.lambda_module.filterChangedLineItems(csvLines, previousFingerprints, currentFingerprints)), csvLines)
+		self.assertEqual(len(currentFingerprints), 3)
+
+		# Verify only the changed and new line items are sent the next time
+		previousFingerprints = currentFingerprints
+		currentFingerprints = {}
+		csvLines = ["LineItemId,TimeInterval,UnblendedCost", "a,2023-01-01T00:00:00Z/2023-01-01T01:00:00Z,1", "a,2023-01-01T01:00:00Z/2023-01-01T02:00:00Z,5", "c,2023-01-01T00:00:00Z/2023-01-01T01:00:00Z,4"]
+		self.assertEqual(list(self.lambda_module.filterChangedLineItems(csvLines, previousFingerprints, currentFingerprints)), [csvLines[0], csvLines[2], csvLines[3]])
+
+		# Verify line items already converted to JSON are read too
+		events = [{"identity_line_item_id": "a", "line_item_unblended_cost": 1}, '{"identity_line_item_id": "b"}']
+		self.assertEqual(list(self.lambda_module.filterChangedLineItems(events, {}, currentFingerprints)), events)
+		self.assertEqual(list(self.lambda_module.filterChangedLineItems(events, currentFingerprints, {})), [])
+
+
+	def test_filterEvents(self):
+
+		# Compile rules for delimited columns, JSON fields, and the whole event
+		filterRules = json.dumps([
+			{"name": "nodata", "match": {"-1": {"in": ["NODATA", "SKIPDATA"]}}},
+			{"name": "describe", "match": {"eventName": {"regex": "^Describe"}, "readOnly": {"equals": True}}},
+			{"match": {"_raw": {"regex": "ELB-HealthChecker"}}},
+			{"name": "role", "match": {"userIdentity.type": {"equals": "AssumedRole"}, "eventSource": {"in": ["s3.amazonaws.com"]}}}
+		])
+		eventFilter = self.lambda_module.retrieveEventFilter(filterRules)
+		self.assertEqual(len(eventFilter), 4)
+
+		# Verify rules are only compiled once for the same setting
+		self.assertIs(self.lambda_module.retrieveEventFilter(filterRules), eventFilter)
+
+		events = [
+			"2 841154226728 eni-0b48139ba00b9b7bb - - - - - - - 1672790555 1672790581 - NODATA",
+			"2 841154226728 eni-0b48139ba00b9b7bb 192.73.240.132 172.21.12.101 443 60816 6 158 71263 1672790555 1672790581 ACCEPT OK",
+			{"eventName": "DescribeInstances", "readOnly": True},
+			{"eventName": "DescribeInstances", "readOnly": False},
+			'{"eventName": "GetObject", "eventSource": "s3.amazonaws.com", "userIdentity": {"type": "AssumedRole"}}',
+			'{"eventName": "GetObject", "eventSource": "s3.amazonaws.com", "userIdentity": {"type": "IAMUser"}}',
+			'http 2023-01-01T00:00:00.000000Z app/elb/123 10.0.0.1:1234 10.0.0.2:80 0.000 0.001 0.000 200 200 0 0 "GET http://10.0.0.2:80/ HTTP/1.1" "ELB-HealthChecker/2.0" - -'
+		]
+
+		# Verify matching events are dropped and counted per rule
+		droppedEvents = {}
+		self.assertEqual(list(self.lambda_module.filterEvents(events, eventFilter, " ", droppedEvents)), [events[1], events[3], events[5]])
+		self.assertEqual(droppedEvents, {"nodata": 1, "describe": 1, "rule 3": 1, "role": 1})
+
+		# Verify invalid rules don't filter anything
+		self.assertEqual(self.lambda_module.retrieveEventFilter('[{"name": "invalid", "match": {"eventName": {"startsWith": "Describe"}}}]'), [])
+		self.assertEqual(self.lambda_module.retrieveEventFilter("not json"), [])
+		self.assertEqual(self.lambda_module.retrieveEventFilter(""), [])
+
+
+	def test_projectEvents(self):
+
+		fieldProjection = self.lambda_module.retrieveFieldProjection(json.dumps({"include": ["eventTime", "eventName", "userIdentity.arn", "requestParameters", "responseElements"], "exclude": ["requestParameters.policy"], "maxFieldBytes": {"responseElements": 20, "requestParameters.bucketName": 4}}))
+
+		# Verify rules are only built once for the same setting
+		self.assertIs(self.lambda_module.retrieveFieldProjection(json.dumps({"include": ["eventTime", "eventName", "userIdentity.arn", "requestParameters", "responseElements"], "exclude": ["requestParameters.policy"], "maxFieldBytes": {"responseElements": 20, "requestParameters.bucketName": 4}})), fieldProjection)
+
+		events = [
+			{"eventTime": "2023-01-01T00:00:00Z", "eventName": "PutBucketPolicy", "awsRegion": "us-east-1", "userIdentity": {"arn": "arn:aws:iam::123456789012:user/test", "accountId": "123456789012"}, "requestParameters": {"bucketName": "bucket-name", "policy": "x" * 100}, "responseElements": {"x-amz-id-2": "y" * 100}},
+			"2 841154226728 eni-0b48139ba00b9b7bb 192.73.240.132 172.21.12.101 443 60816 6 158 71263 1672790555 1672790581 ACCEPT OK"
+		]
+		originalEvent = json.loads(json.dumps(events[0]))
+
+		# Verify fields are kept, removed, and truncated, and that events that aren't JSON are left as they are
+		savedBytes = [0]
+		projectedEvents = list(self.lambda_module.projectEvents(events, fieldProjection, savedBytes))
+		self.assertEqual(projectedEvents, [
+			{"eventTime": "2023-01-01T00:00:00Z", "eventName": "PutBucketPolicy", "userIdentity": {"arn": "arn:aws:iam::123456789012:user/test"}, "requestParameters": {"bucketName": "buck...[truncated]"}, "responseElements": '{"x-amz-id-2": "yyyy...[truncated]'},
+			events[1]
+		])
+
+		# Verify the bytes saved are reported, and the original event isn't changed
+		self.assertGreater(savedBytes[0], 200)
+		self.assertLess(savedBytes[0], len(json.dumps(events[0])) - len(json.dumps(projectedEvents[0])) + 50)
+		self.assertEqual(events[0], originalEvent)
+
+		# Verify invalid settings don't project anything
+		self.assertIsNone(self.lambda_module.retrieveFieldProjection('{"maxFieldBytes": {"requestParameters": "many"}}'))
+		self.assertIsNone(self.lambda_module.retrieveFieldProjection(""))
+
+
+	def test_retrieveObjectInfo_resumeFromEvent(self):
+
+		# Verify continuation messages carry the event to resume from
+		event = self.createTestEvent("testFile1.log")
+		body = json.loads(event['Records'][0]['body'])
+		body["resumeFromEvent"] = 500
+		event['Records'][0]['body'] = json.dumps(body)
+		self.assertEqual(self.lambda_module.retrieveObjectInfo(event['Records'][0]), {'bucket': self.bucket_name, 'key': 'testFile1.log', 'resumeFromEvent': 500})
+
+
+	def test_logRepeated(self):
+
+		# Verify repeated messages are counted and printed as one summary with a few examples
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			for index in range(5):
+				self.lambda_module.logRepeated("Repeated message", "example " + str(index))
+			mockPrint.assert_not_called()
+			self.lambda_module.flushLogSummaries()
+			mockPrint.assert_called_once_with("Repeated message (5 times). Examples: example 0 | example 1 | example 2")
+
+		# Verify messages below the log level aren't printed or counted
+		self.lambda_module.LAMBDA_LOG_LEVEL = "ERROR"
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.lambda_module.log("Info message")
+			self.lambda_module.logRepeated("Warning message", "example")
+			self.lambda_module.log("Error message", "ERROR")
+			self.lambda_module.flushLogSummaries()
+			self.assertEqual([call.args[0] for call in mockPrint.call_args_list], ["Error message"])
+
+
+	def test_logLineBudget(self):
+
+		# Verify lines over the budget are suppressed and counted at the end of the invocation
+		self.lambda_module.LAMBDA_LOG_LINE_BUDGET = "2"
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.lambda_module.startInvocationLog()
+			for index in range(5):
+				self.lambda_module.log("Message " + str(index))
+			self.lambda_module.finishInvocationLog()
+			self.assertEqual([call.args[0] for call in mockPrint.call_args_list], ["Message 0", "Message 1", "Suppressed 3 log lines over the budget of 2 lines for this invocation"])
+
+		# Verify the budget starts again for the next invocation
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.lambda_module.startInvocationLog()
+			self.lambda_module.log("Message")
+			self.lambda_module.finishInvocationLog()
+			mockPrint.assert_called_once_with("Message")
+
+
+	def test_importConfiguredModules(self):
+
+		# Importing the function without settings that need them doesn't import pandas or pyarrow
+		importCheck = "import importlib, sys; importlib.import_module('lambda'); print(','.join(moduleName for moduleName in ['pandas', 'pyarrow'] if moduleName in sys.modules))"
+		process = subprocess.run([sys.executable, "-c", importCheck], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+		self.assertEqual(process.returncode, 0, process.stderr)
+		self.assertEqual(process.stdout.strip(), "")
+
+		# Settings that need them import them during initialization
+		process = subprocess.run([sys.executable, "-c", importCheck], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), env=dict(os.environ, SPLUNK_SOURCETYPE="aws:billing:cur", SPLUNK_TIME_FORMAT="delineated-strftime", LAMBDA_VECTORIZED_TIMESTAMPS="true"))
+		self.assertEqual(process.returncode, 0, process.stderr)
+		self.assertEqual(process.stdout.strip(), "pandas,pyarrow")
+
+		self.lambda_module.SPLUNK_CSV_TO_JSON = "true"
+		self.lambda_module.LAMBDA_COLUMNAR_CSV = "true"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+		self.assertEqual(self.lambda_module.importConfiguredModules(), ["pyarrow", "pyarrow.csv", "pyarrow.compute", "dateutil.parser"])
+
+		self.lambda_module.SPLUNK_CSV_TO_JSON = "false"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "delineated-epoch"
+		self.assertEqual(self.lambda_module.importConfiguredModules(), [])
+
+	def test_routeObject(self):
+
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudwatchlogs:vpcflow"
+		self.lambda_module.LAMBDA_ROUTING_TABLE = json.dumps([{"bucket": "logs-*", "keyPrefix": "AWSLogs/*/CloudTrail/", "profile": {"SPLUNK_SOURCETYPE": "aws:cloudtrail", "SPLUNK_TIME_DELINEATED_FIELD": 10}}, {"keyPrefix": "AWSLogs/", "profile": {"SPLUNK_INDEX": "aws"}}])
+
+		# The first route that matches the bucket and the start of the key is used
+		self.assertEqual(self.lambda_module.routeObject({"bucket": "logs-123", "key": "AWSLogs/123456789012/CloudTrail/us-west-2/2023/01/01/file.json.gz"}), {"SPLUNK_SOURCETYPE": "aws:cloudtrail", "SPLUNK_TIME_DELINEATED_FIELD": "10"})
+		self.assertEqual(self.lambda_module.routeObject({"bucket": "other", "key": "AWSLogs/123456789012/CloudTrail/us-west-2/2023/01/01/file.json.gz"}), {"SPLUNK_INDEX": "aws"})
+		self.assertEqual(self.lambda_module.routeObject({"bucket": "logs-123", "key": "vpcflow/AWSLogs/file.log.gz"}), None)
+		self.assertEqual(self.lambda_module.routeObject("SQS message did not contain S3 file information."), None)
+
+		# Settings the profile leaves out come from the function's settings
+		self.lambda_module.objectState.profile = {"SPLUNK_INDEX": "aws"}
+		self.assertEqual(self.lambda_module.retrieveSetting("SPLUNK_INDEX"), "aws")
+		self.assertEqual(self.lambda_module.retrieveSetting("SPLUNK_SOURCETYPE"), "aws:cloudwatchlogs:vpcflow")
+		self.lambda_module.objectState.profile = None
+		self.assertEqual(self.lambda_module.retrieveSetting("SPLUNK_INDEX"), "main")
+
+		# Profiles can set event filter rules and field projections as JSON, the same as their environment variables
+		self.lambda_module.LAMBDA_ROUTING_TABLE = json.dumps([{"profile": {"LAMBDA_EVENT_FILTER_RULES": [{"name": "nodata", "match": {"13": {"equals": "NODATA"}}}], "LAMBDA_FIELD_PROJECTION": {"exclude": ["a"]}, "LAMBDA_CUR_FINGERPRINT_LOCATION": "s3://fingerprints"}}])
+		self.lambda_module.objectState.profile = self.lambda_module.routeObject({"bucket": "logs-123", "key": "file.json"})
+		self.assertEqual(self.lambda_module.retrieveEventFilter(self.lambda_module.retrieveSetting("LAMBDA_EVENT_FILTER_RULES"))[0][0], "nodata")
+		self.assertEqual(self.lambda_module.retrieveFieldProjection(self.lambda_module.retrieveSetting("LAMBDA_FIELD_PROJECTION"))["exclude"], {"a": True})
+		self.assertEqual(self.lambda_module.retrieveSetting("LAMBDA_CUR_FINGERPRINT_LOCATION"), "s3://fingerprints")
+		self.lambda_module.objectState.profile = None
+
+		# A routing table with a setting profiles can't set isn't used
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.assertEqual(self.lambda_module.retrieveRoutingTable(json.dumps([{"profile": {"LAMBDA_STREAMING_MODE": "true"}}])), [])
+		self.assertIn("Unable to load routing table", mockPrint.call_args[0][0])
+
+	def test_firehoseRateLimiter(self):
+
+		metrics = self.lambda_module.createObjectMetrics()
+
+		# Sends aren't limited until Firehose throttles them
+		with unittest.mock.patch("time.sleep") as sleep:
+			self.assertTrue(self.lambda_module.waitForFirehoseRate(4194304, metrics))
+			self.assertEqual(sleep.call_count, 0)
+
+		# Throttling starts limiting from the rate sends were made at, and throttling again halves the rate
+		self.lambda_module.updateFirehoseRate(True, metrics)
+		self.assertEqual(self.lambda_module.firehoseRateLimiter["bytesPerSecond"], 2097152)
+		self.lambda_module.updateFirehoseRate(True, metrics)
+		self.assertEqual(self.lambda_module.firehoseRateLimiter["bytesPerSecond"], 1048576)
+		self.assertEqual(metrics["FirehoseThrottles"], 2)
+
+		# Sends over the rate wait for the bucket to refill
+		with unittest.mock.patch("time.sleep") as sleep:
+			self.assertTrue(self.lambda_module.waitForFirehoseRate(2097152, metrics))
+			self.assertAlmostEqual(sleep.call_args[0][0], 2.0, places=2)
+		self.assertAlmostEqual(metrics["FirehoseThrottleWaitTime"], 2000, delta=10)
+
+		# Accepted sends add to the rate, up to the configured maximum
+		self.lambda_module.updateFirehoseRate(False, metrics)
+		self.assertEqual(self.lambda_module.firehoseRateLimiter["bytesPerSecond"], 1048576 + 262144)
+		self.lambda_module.firehoseRateLimiter["maxBytesPerSecond"] = 1048576
+		self.lambda_module.updateFirehoseRate(False, metrics)
+		self.assertEqual(self.lambda_module.firehoseRateLimiter["bytesPerSecond"], 1048576)
+
+		# Throttling is recognized from exceptions and from failed records
+		throttle = botocore.exceptions.ClientError({"Error": {"Code": "ServiceUnavailableException", "Message": "Slow down."}}, "PutRecordBatch")
+		self.assertTrue(self.lambda_module.isFirehoseThrottle(exception=throttle))
+		self.assertFalse(self.lambda_module.isFirehoseThrottle(exception=Exception("Connection reset")))
+		self.assertTrue(self.lambda_module.isFirehoseThrottle(response={"RequestResponses": [{"RecordId": "1"}, {"ErrorCode": "ServiceUnavailableException"}]}))
+		self.assertFalse(self.lambda_module.isFirehoseThrottle(response={"RequestResponses": [{"ErrorCode": "InternalFailure"}]}))
+
+		# The invocation's throttling is printed once, then reset
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.lambda_module.logFirehoseThrottles()
+			self.lambda_module.logFirehoseThrottles()
+		self.assertEqual(mockPrint.call_count, 1)
+		self.assertTrue(mockPrint.call_args[0][0].startswith("Firehose throttled 2 sends during this invocation"))
+
+
+	def test_putRecordsToFirehose_deadline(self):
+
+		# Fail every send with an error that isn't throttling
+		sendAttempts = []
+		def putRecordBatch(**kwargs):
+			sendAttempts.append(len(kwargs["Records"]))
+			raise Exception("Internal error")
+		firehoseClient = self.lambda_module.firehoseClient
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatch)
+
+		# Sleeps between attempts are capped, and don't go past the time the invocation has left
+		results = []
+		with unittest.mock.patch("time.sleep") as sleep:
+			results.append(self.lambda_module.putRecordsToFirehose([{"Data": b"event1"}], "object1.tgz", 0))
+			self.lambda_module.invocationEndTime = time.time() + self.lambda_module.firehoseRetryMarginSeconds + 1
+			results.append(self.lambda_module.putRecordsToFirehose([{"Data": b"event1"}], "object1.tgz", 0))
+
+			# Retries stop when the invocation is about to time out
+			self.lambda_module.invocationEndTime = time.time() + self.lambda_module.firehoseRetryMarginSeconds
+			results.append(self.lambda_module.putRecordsToFirehose([{"Data": b"event1"}], "object1.tgz", 0))
+
+		self.lambda_module.firehoseClient = firehoseClient
+
+		self.assertEqual(results, ["Max firehose retries reached"] * 3)
+		self.assertEqual(len(sendAttempts), self.lambda_module.maxRetriesToFirehose * 2 + 1)
+		self.assertEqual(sleep.call_count, (self.lambda_module.maxRetriesToFirehose - 1) * 2)
+		self.assertLessEqual(max(call[0][0] for call in sleep.call_args_list[:10]), self.lambda_module.maxFirehoseBackoffSeconds)
+		self.assertLessEqual(max(call[0][0] for call in sleep.call_args_list[10:]), 1)
+
+
 	def test_cgetTimestamp_prefix_ISO8601(self):
 		
 		# Test with prefix-ISO8601
@@ -300,14 +629,78 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 		self.assertEqual(round(self.lambda_module.getTimestamp('d2b1828e428fd0fc94f09e0df9e09766e034d88de30f075647bbf52fa79dd42d splunk-aws-gdi-toolkit-us-west-2-public-bucket [11/Nov/2022:03:07:19 +0000] 54.239.6.87 arn:aws:sts::841154226728:assumed-role/AWSServiceRoleForConfig/AWSConfig-Describe 0N7GD2KZAM46996V REST.GET.LOCATION - "GET /?location HTTP/1.1" 200 - 137 - 20 - "-" "AWSConfig cfg/retry-mode/standard" - uQ7Sh98K4JbFhiNMudvH3h/EqiUu0c05wBnDAwtBdKBMD9d9yOZ8uRe4X5O0V19EBXbszAP3H9k= SigV4 ECDHE-RSA-AES128-GCM-SHA256 AuthHeader splunk-aws-gdi-toolkit-us-west-2-public-bucket.s3.us-west-2.amazonaws.com TLSv1.2 - -', " "),0), round(time.time(),0))
 
 
+	def test_retrieveTimestampExtractor(self):
+
+		# Verify ISO8601 timestamps parse the same with and without the fromisoformat fast path
+		for iso8601Timestamp in ["2023-01-03T23:59:01Z", "2023-01-03T23:59:01.251617Z", "2023-01-03T23:59:01+02:00", "2023-01-03T23:59:01.251617", "2023-01-03T23:59:01.2516171Z", "2023-01-03 23:59:01", "2023-01-03T23:59:01Z\n"]:
+			self.assertEqual(self.lambda_module.parseISO8601(iso8601Timestamp), dateutil.parser.parse(iso8601Timestamp).timestamp())
+
+		# Verify extractors are only built once for the same settings
+		extractTimestamp = self.lambda_module.retrieveTimestampExtractor("delineated-epoch", "main", "10", "main")
+		self.assertIs(self.lambda_module.retrieveTimestampExtractor("delineated-epoch", "main", "10", "main"), extractTimestamp)
+		self.assertEqual(extractTimestamp("2 841154226728 eni-0b48139ba00b9b7bb 192.73.240.132 172.21.12.101 443 60816 6 158 71263 1672790555 1672790581 ACCEPT OK", " "), 1672790555)
+
+		# Verify fields counted from the end of the event still work
+		extractTimestamp = self.lambda_module.retrieveTimestampExtractor("delineated-epoch", "main", "-3", "main")
+		self.assertEqual(self.lambda_module.getTimestamp("2 841154226728 eni-0b48139ba00b9b7bb 192.73.240.132 172.21.12.101 443 60816 6 158 71263 1672790555 1672790581 ACCEPT OK", " ", extractTimestamp), 1672790581)
+
+		# Verify invalid settings fall back to the current time
+		extractTimestamp = self.lambda_module.retrieveTimestampExtractor("delineated-epoch", "main", "main", "main")
+		self.assertEqual(round(self.lambda_module.getTimestamp("2 841154226728 1672790555", " ", extractTimestamp), 0), round(time.time(), 0))
+		extractTimestamp = self.lambda_module.retrieveTimestampExtractor("main", "main", "main", "main")
+		self.assertEqual(round(self.lambda_module.getTimestamp("2 841154226728 1672790555", " ", extractTimestamp), 0), round(time.time(), 0))
+
+
+	def test_getTimestamps(self):
+
+		# Test with delineated-strftime, S3 server access logs, including rows with invalid and missing timestamps
+		self.lambda_module.SPLUNK_TIME_FORMAT = "delineated-strftime"
+		self.lambda_module.SPLUNK_TIME_DELINEATED_FIELD = "2"
+		self.lambda_module.SPLUNK_STRFTIME_FORMAT = "[%d/%b/%Y:%H:%M:%S"
+		events = ['d2b1828e428fd0fc94f09e0df9e09766e034d88de30f075647bbf52fa79dd42d splunk-aws-gdi-toolkit-us-west-2-public-bucket [0' + str(day) + '/Nov/2022:13:07:00 +0000] 72.21.217.31 - XMCYE060BFAZFRK3 REST.HEAD.BUCKET - "HEAD / HTTP/1.1" 400' for day in range(1, 10)]
+		events[3] = events[3].replace("Nov", "Novz")
+		events[5] = "d2b1828e428fd0fc94f09e0df9e09766e034d88de30f075647bbf52fa79dd42d"
+		extractTimestamp = self.lambda_module.retrieveTimestampExtractor("delineated-strftime", "main", "2", "[%d/%b/%Y:%H:%M:%S")
+
+		# Verify the whole-chunk conversion matches converting one row at a time, with the invalid rows set to the current time
+		for vectorizedTimestamps in ["false", "true"]:
+			self.lambda_module.LAMBDA_VECTORIZED_TIMESTAMPS = vectorizedTimestamps
+			timestamps = self.lambda_module.getTimestamps(events, " ", extractTimestamp)
+			self.assertEqual(timestamps[0], 1667912820 - 86400 * 7)
+			self.assertEqual(timestamps[8], 1667912820 + 86400)
+			self.assertEqual([timestamps[index] for index in [0, 1, 2, 4, 6, 7, 8]], [self.lambda_module.getTimestamp(events[index], " ", extractTimestamp) for index in [0, 1, 2, 4, 6, 7, 8]])
+			self.assertEqual([type(timestamp) for timestamp in timestamps], [int, int, int, float, int, float, int, int, int])
+			self.assertEqual(round(timestamps[3], 0), round(time.time(), 0))
+			self.assertEqual(round(timestamps[5], 0), round(time.time(), 0))
+
+		# Verify other time formats are still converted one row at a time
+		self.lambda_module.SPLUNK_TIME_FORMAT = "delineated-epoch"
+		self.lambda_module.SPLUNK_TIME_DELINEATED_FIELD = "10"
+		extractTimestamp = self.lambda_module.retrieveTimestampExtractor("delineated-epoch", "main", "10", "[%d/%b/%Y:%H:%M:%S")
+		self.assertEqual(self.lambda_module.getTimestamps(["2 841154226728 eni-0b48139ba00b9b7bb 192.73.240.132 172.21.12.101 443 60816 6 158 71263 1672790555 1672790581 ACCEPT OK"], " ", extractTimestamp), [1672790555.0])
+
+
+	def test_encodeEvent(self):
+
+		# Verify events match the concatenated HEC format, including settings with characters that need escaping
+		eventEnvelope = self.lambda_module.createEventEnvelope("host-100%", "s3://bucket/%s", "aws:cloudtrail", "main", "  ", " }")
+		self.assertEqual(self.lambda_module.encodeEvent(eventEnvelope, 1672790555.0, 'event "quoted" \u00e9'), '{ "time": 1672790555.0, "host": "host-100%", "source": "s3://bucket/%s", "sourcetype": "aws:cloudtrail", "index": "main", "event":  "event \\"quoted\\" \\u00e9" }'.encode("utf-8"))
+		self.assertEqual(self.lambda_module.encodeEvent(eventEnvelope, 1672790555, {"key": "value"}), b'{ "time": 1672790555, "host": "host-100%", "source": "s3://bucket/%s", "sourcetype": "aws:cloudtrail", "index": "main", "event":  {"key": "value"} }')
+
+
 	def test_downloadS3Object(self):
 
 		# Test with files that do exist
 		testFiles = ["testFile1.log", "testdir/123/testFile2.log"]
+		downloadResults = []
 
 		for testFile in testFiles:
-			# Validate return message
-			self.assertEqual(self.lambda_module.downloadS3Object("moto-resource-bucket", testFile), "/tmp/" + testFile.split("/")[-1])
+			# Validate return message, with the file in its own scratch directory
+			downloadResult = self.lambda_module.downloadS3Object("moto-resource-bucket", testFile)
+			downloadResults.append(downloadResult)
+			self.assertTrue(downloadResult.startswith("/tmp/"))
+			self.assertTrue(downloadResult.endswith("/" + testFile.split("/")[-1]))
+			self.assertTrue(os.path.exists(downloadResult))
 
 			# Validate that file was retrieved correctly and the contents match the test file
 			originalFile = ""
@@ -315,15 +708,54 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 				originalFile = file.read()
 
 			downloadedFile = ""
-			with open("/tmp/" + testFile.split("/")[-1], 'r') as file:
+			with open(downloadResult, 'r') as file:
 				downloadedFile = file.read()
 
 			self.assertEqual(originalFile, downloadedFile)
 
-		# Test with invalid files that do not exist
-		self.assertEqual(self.lambda_module.downloadS3Object("moto-resource-bucket-non-existent", "testFile1.log"), "Unable to download file s3://moto-resource-bucket-non-existent/testFile1.log")
-		self.assertEqual(self.lambda_module.downloadS3Object("moto-resource-bucket", "non-existent-file.txt"), "Unable to download file s3://moto-resource-bucket/non-existent-file.txt")
-		self.assertEqual(self.lambda_module.downloadS3Object("moto-resource-bucket-non-existent", "non-existent-file.txt"), "Unable to download file s3://moto-resource-bucket-non-existent/non-existent-file.txt")
+		# Validate that objects with the same file name don't overwrite each other
+		boto3.client('s3').upload_file("test-fixtures/testFile1.log.gz", self.bucket_name, "testdir/testFile1.log")
+		downloadResults += [self.lambda_module.downloadS3Object("moto-resource-bucket", "testdir/testFile1.log"), self.lambda_module.downloadS3Object("moto-resource-bucket", "testFile1.log")]
+		self.assertNotEqual(downloadResults[-2], downloadResults[-1])
+
+		# Validate that each scratch directory can be removed along with its file
+		for downloadResult in downloadResults:
+			shutil.rmtree(os.path.dirname(downloadResult))
+			self.assertFalse(os.path.exists(downloadResult))
+
+		# Test with invalid files that do not exist, noting the scratch directories created for them
+		scratchDirectories = []
+		mkdtemp = tempfile.mkdtemp
+
+		def recordScratchDirectory(*args, **kwargs):
+			scratchDirectories.append(mkdtemp(*args, **kwargs))
+			return scratchDirectories[-1]
+
+		with unittest.mock.patch("tempfile.mkdtemp", side_effect=recordScratchDirectory):
+			self.assertEqual(self.lambda_module.downloadS3Object("moto-resource-bucket-non-existent", "testFile1.log"), "Unable to download file s3://moto-resource-bucket-non-existent/testFile1.log")
+			self.assertEqual(self.lambda_module.downloadS3Object("moto-resource-bucket", "non-existent-file.txt"), "Unable to download file s3://moto-resource-bucket/non-existent-file.txt")
+			self.assertEqual(self.lambda_module.downloadS3Object("moto-resource-bucket-non-existent", "non-existent-file.txt"), "Unable to download file s3://moto-resource-bucket-non-existent/non-existent-file.txt")
+
+		# Validate that scratch directories are removed when the download fails
+		self.assertEqual(len(scratchDirectories), 3)
+		for scratchDirectory in scratchDirectories:
+			self.assertFalse(os.path.exists(scratchDirectory))
+
+
+	def test_loadS3Object(self):
+
+		# Validate that compressed and uncompressed files are read into memory and match the test file
+		boto3.client('s3').upload_file("test-fixtures/testFile1.log.gz", self.bucket_name, "testFile1.log.gz")
+		for testFile in ["testFile1.log", "testFile1.log.gz"]:
+			loadResult = self.lambda_module.loadS3Object("moto-resource-bucket", testFile)
+			self.assertEqual(loadResult["extension"], "log")
+			with open("test-fixtures/testFile1.log", 'rb') as file:
+				self.assertEqual(loadResult["file"].read(), file.read())
+
+		# Test with invalid files
+		self.assertEqual(self.lambda_module.loadS3Object("moto-resource-bucket", "non-existent-file.txt"), "Unable to download file s3://moto-resource-bucket/non-existent-file.txt")
+		boto3.client('s3').put_object(Bucket=self.bucket_name, Key="invalid.log.gz", Body=b"not gzip")
+		self.assertEqual(self.lambda_module.loadS3Object("moto-resource-bucket", "invalid.log.gz"), "Unable to uncompress file s3://moto-resource-bucket/invalid.log.gz")
 
 
 	def test_uncompressFile_gz(self):
@@ -365,8 +797,8 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 		# Verify that there are still 0 files in the bucket
 		self.assertEqual(dict(s3Client.list_objects_v2(Bucket=self.bucket_name_firehose))['KeyCount'], 0)
 
-		# Send another 448 files to the bucket
-		for i in range(448):
+		# Send another 498 files to the bucket
+		for i in range(498):
 			self.lambda_module.bufferAndSendEventsToFirehose('{ "time": ' +  timestamp + ', "host": "moto-test-host", "source": "moto-test-source", "sourcetype": "moto-test-sourcetype", "index": "moto-test-index", "event":  "moto-test-event"}', False, "object1.tgz", [0])
 
 		# Verify that there are still 0 files in the bucket
@@ -384,8 +816,8 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 		with open("/tmp/file1.json", 'r') as file:
 			file1 = file.read()
 
-		# Verify there are 450 events in the file
-		self.assertEqual(len(file1.split("}{")), 450)
+		# Verify there are 500 events in the file
+		self.assertEqual(len(file1.split("}{")), 500)
 
 		# Verify contents of one of the records
 		self.assertEqual((str("{" + file1.split("}{")[42] + "}")), '{ "time": ' +  timestamp + ', "host": "moto-test-host", "source": "moto-test-source", "sourcetype": "moto-test-sourcetype", "index": "moto-test-index", "event":  "moto-test-event"}')
@@ -417,6 +849,150 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 		self.assertEqual(dict(s3Client.list_objects_v2(Bucket=self.bucket_name_firehose))['KeyCount'], 0)
 
 
+	def test_bufferAndSendEventsToFirehose_limits(self):
+
+		s3Client = boto3.client('s3')
+		event = '{ "time": 1672790555.0, "host": "moto-test-host", "source": "moto-test-source", "sourcetype": "moto-test-sourcetype", "index": "moto-test-index", "event":  "' + ("x" * 320000) + '" }'
+
+		# Send 14 events of about 320KB, only 13 of which fit in a 4MiB batch
+		for i in range(14):
+			self.lambda_module.bufferAndSendEventsToFirehose(event, False, "object1.tgz", [0])
+		self.assertEqual(len(self.readFirehoseOutput()), 13)
+
+		# Send the last one
+		self.assertEqual(self.lambda_module.bufferAndSendEventsToFirehose("", True, "object1.tgz", [0]), "Sent to Firehose")
+		self.assertEqual(len(self.readFirehoseOutput()), 1)
+
+		# Send an event larger than a Firehose record, which should not be buffered
+		self.assertEqual(self.lambda_module.bufferAndSendEventsToFirehose("x" * 1024001, False, "object1.tgz", [0]), "Event too large to send to Firehose (1024001 bytes)")
+		self.assertEqual(self.lambda_module.bufferAndSendEventsToFirehose("", True, "object1.tgz", [0]), "Max firehose retries reached")
+
+		# Verify an object with an event that's too large is logged as an error and retried instead of being recorded as processed
+		self.lambda_module.LAMBDA_OBJECT_LEDGER = "/tmp/object-ledger"
+		self.lambda_module.LAMBDA_LOG_LEVEL = "ERROR"
+		boto3.client('s3').put_object(Bucket=self.bucket_name, Key="large.log", Body=("small\n" + "x" * 1024001 + "\nsmall\n").encode("utf-8"))
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.assertEqual(self.lambda_module.handler(self.createTestEvent("large.log"), "none"), {"batchItemFailures": [{"itemIdentifier": "messageId"}]})
+		self.assertTrue(any(str(call.args[0]).startswith("Event too large to send to Firehose") for call in mockPrint.call_args_list))
+		self.assertEqual(glob.glob("/tmp/object-ledger/*"), [])
+		self.readFirehoseOutput()
+
+
+	def test_bufferAndSendEventsToFirehose_packing(self):
+
+		self.lambda_module.LAMBDA_PACK_EVENTS = "true"
+		s3Client = boto3.client('s3')
+		event = '{ "time": 1672790555.0, "host": "moto-test-host", "source": "moto-test-source", "sourcetype": "moto-test-sourcetype", "index": "moto-test-index", "event":  "2 841154226728 eni-0b48139ba00b9b7bb 192.73.240.132 172.21.12.101 443 60816 6 158 71263 1672790555 1672790581 ACCEPT OK" }'
+
+		# Send 5000 small events, which should all be packed into a few records and sent in a single batch
+		eventBatch = [0]
+		for i in range(5000):
+			self.assertEqual(self.lambda_module.bufferAndSendEventsToFirehose(event, False, "object1.tgz", eventBatch), "Event buffered")
+		self.assertEqual(self.lambda_module.bufferAndSendEventsToFirehose("", True, "object1.tgz", eventBatch), "Sent to Firehose")
+		self.assertEqual(eventBatch[0], 1)
+
+		# Verify every event made it to S3
+		self.assertEqual(dict(s3Client.list_objects_v2(Bucket=self.bucket_name_firehose))['KeyCount'], 1)
+		events = self.readFirehoseOutput()
+		self.assertEqual(len(events), 5000)
+		self.assertEqual("{" + events[42] + "}", event)
+
+		# Send enough events to fill more than one record, and verify no record is larger than the Firehose limit
+		sentRecordSizes = []
+		firehoseClient = self.lambda_module.firehoseClient
+		def putRecordBatch(**kwargs):
+			sentRecordSizes.extend([len(record["Data"]) for record in kwargs["Records"]])
+			return firehoseClient.put_record_batch(**kwargs)
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatch)
+
+		event = '{ "event": "' + ("x" * 99985) + '" }'
+		for i in range(25):
+			self.lambda_module.bufferAndSendEventsToFirehose(event, False, "object1.tgz", [0])
+		self.lambda_module.bufferAndSendEventsToFirehose("", True, "object1.tgz", [0])
+		self.lambda_module.firehoseClient = firehoseClient
+		self.assertEqual(sentRecordSizes, [1000000, 1000000, 500000])
+		self.assertEqual(len(self.readFirehoseOutput()), 25)
+
+
+	def test_bufferAndSendEventsToFirehose_partialFailure(self):
+
+		# Fail the second and fourth records with different errors on the first attempt, then accept everything
+		sentBatches = []
+		def putRecordBatch(**kwargs):
+			sentBatches.append([record["Data"] for record in kwargs["Records"]])
+			if len(sentBatches) == 1:
+				return {"FailedPutCount": 2, "RequestResponses": [{"RecordId": "1"}, {"ErrorCode": "ServiceUnavailableException", "ErrorMessage": "Slow down."}, {"RecordId": "3"}, {"ErrorCode": "InternalFailure", "ErrorMessage": "Internal failure."}]}
+			return {"FailedPutCount": 0, "RequestResponses": [{"RecordId": str(i)} for i in range(len(kwargs["Records"]))]}
+
+		firehoseClient = self.lambda_module.firehoseClient
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatch)
+
+		with unittest.mock.patch("time.sleep") as sleep:
+			for event in ["event1", "event2", "event3"]:
+				self.lambda_module.bufferAndSendEventsToFirehose(event, False, "object1.tgz", [0])
+			self.assertEqual(self.lambda_module.bufferAndSendEventsToFirehose("event4", True, "object1.tgz", [0]), "Sent to Firehose")
+			# The failures include throttling, so the rate limiter slows sends down instead of a backoff sleep, and the resend is small enough not to wait
+			self.assertEqual(sleep.call_count, 0)
+
+		self.lambda_module.firehoseClient = firehoseClient
+
+		# Verify only the failed records were resent
+		self.assertEqual(sentBatches, [[b"event1", b"event2", b"event3", b"event4"], [b"event2", b"event4"]])
+		self.assertEqual(self.lambda_module.recordBatch["records"], [])
+		self.assertEqual(self.lambda_module.recordBatch["bytes"], 0)
+
+		# Verify the failures are summarized by error code
+		failedRecords, errorSummary = self.lambda_module.retrieveFailedRecords([{"Data": b"1"}, {"Data": b"2"}, {"Data": b"3"}], {"FailedPutCount": 2, "RequestResponses": [{"ErrorCode": "ServiceUnavailableException", "ErrorMessage": "Slow down."}, {"RecordId": "2"}, {"ErrorCode": "ServiceUnavailableException", "ErrorMessage": "Slow down."}]})
+		self.assertEqual(failedRecords, [{"Data": b"1"}, {"Data": b"3"}])
+		self.assertEqual(errorSummary, "ServiceUnavailableException (2 records): Slow down.")
+
+
+	def test_bufferAndSendEventsToFirehose_senderThreads(self):
+
+		self.lambda_module.LAMBDA_FIREHOSE_SENDER_THREADS = "4"
+
+		# Track how many batches are being sent at once
+		sentRecords = []
+		inFlight = [0, 0]
+		lock = threading.Lock()
+		def putRecordBatch(**kwargs):
+			with lock:
+				inFlight[0] += 1
+				inFlight[1] = max(inFlight[0], inFlight[1])
+			time.sleep(0.05)
+			with lock:
+				inFlight[0] -= 1
+				sentRecords.extend([record["Data"] for record in kwargs["Records"]])
+			return {"FailedPutCount": 0, "RequestResponses": [{"RecordId": str(i)} for i in range(len(kwargs["Records"]))]}
+
+		firehoseClient = self.lambda_module.firehoseClient
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatch)
+
+		# Send enough events for 10 batches, which should be queued rather than sent in the foreground
+		eventBatch = [0]
+		results = [self.lambda_module.bufferAndSendEventsToFirehose("event" + str(i), False, "object1.tgz", eventBatch) for i in range(4750)]
+		self.assertEqual(results.count("Queued for Firehose"), 9)
+		self.assertEqual(self.lambda_module.bufferAndSendEventsToFirehose("", True, "object1.tgz", eventBatch), "Sent to Firehose")
+		self.lambda_module.firehoseClient = firehoseClient
+
+		# Verify the final flush waited for every batch, and batches were sent at once but no more than there are threads
+		self.assertEqual(eventBatch[0], 10)
+		self.assertEqual(self.lambda_module.pendingSends, [])
+		self.assertEqual(sorted(sentRecords), sorted([("event" + str(i)).encode("utf-8") for i in range(4750)]))
+		self.assertGreater(inFlight[1], 1)
+		self.assertLessEqual(inFlight[1], 4)
+
+		# Verify a failure in a background send is reported by the final flush
+		def putRecordBatchFailure(**kwargs):
+			raise Exception("Firehose unavailable")
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatchFailure)
+		with unittest.mock.patch("time.sleep"):
+			for i in range(500):
+				self.lambda_module.bufferAndSendEventsToFirehose("event", False, "object1.tgz", [0])
+			self.assertEqual(self.lambda_module.bufferAndSendEventsToFirehose("event", True, "object1.tgz", [0]), "Max firehose retries reached")
+		self.lambda_module.firehoseClient = firehoseClient
+
+
 	def test_integration_cloudtrail(self):
 
 		# Set vars for CloudTrail
@@ -452,6 +1028,391 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 		self.assertEqual(file1, hecCloudTrailEvents)
 
 
+	def test_integration_eventFilter(self):
+
+		# Set vars for CloudTrail
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudtrail"
+		self.lambda_module.SPLUNK_JSON_FORMAT = "eventsInRecords"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "eventTime"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+
+		# Load the rules from a file in S3
+		boto3.client('s3').put_object(Bucket=self.bucket_name, Key="rules/eventFilter.json", Body=json.dumps([{"name": "describe", "match": {"eventName": {"regex": "^Describe"}, "readOnly": {"equals": True}}}]))
+		self.lambda_module.LAMBDA_EVENT_FILTER_RULES = "s3://" + self.bucket_name + "/rules/eventFilter.json"
+
+		# Verify read-only Describe calls aren't sent, in both modes
+		for streamingMode in ["false", "true"]:
+			self.lambda_module.LAMBDA_STREAMING_MODE = streamingMode
+			with unittest.mock.patch("builtins.print") as mockPrint:
+				self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+
+			events = self.readFirehoseOutput()
+			self.assertEqual(len(events), 12)
+			self.assertNotIn('"eventName": "Describe', "".join(events))
+			mockPrint.assert_any_call("Dropped 2 events matching event filter rule describe. File path: s3://" + self.bucket_name + "/sample-cloudtrail.json.gz")
+
+
+	def test_integration_fieldProjection(self):
+
+		# Set vars for CloudTrail
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudtrail"
+		self.lambda_module.SPLUNK_JSON_FORMAT = "eventsInRecords"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "eventTime"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+
+		# Send the file without projecting fields
+		self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+		originalEvents = self.readFirehoseOutput()
+
+		# Send the file without the request and response blobs, and verify the same events are sent with the same timestamps, but smaller
+		self.lambda_module.LAMBDA_FIELD_PROJECTION = '{"exclude": ["requestParameters", "responseElements"]}'
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+		projectedEvents = self.readFirehoseOutput()
+
+		self.assertEqual(len(projectedEvents), len(originalEvents))
+		self.assertEqual([event.split(",")[0] for event in projectedEvents], [event.split(",")[0] for event in originalEvents])
+		self.assertNotIn('"requestParameters"', "".join(projectedEvents))
+		self.assertLess(len("".join(projectedEvents)), len("".join(originalEvents)))
+		self.assertTrue(any(call.args[0].startswith("Saved about ") for call in mockPrint.call_args_list))
+
+		# Verify events keep the timestamps from their time field when the projection leaves it out or truncates it
+		for fieldProjection in ['{"exclude": ["eventTime"]}', '{"maxFieldBytes": {"eventTime": 4}}']:
+			self.lambda_module.LAMBDA_FIELD_PROJECTION = fieldProjection
+			self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+			projectedEvents = self.readFirehoseOutput()
+			self.assertEqual(sorted([event.split(",")[0] for event in projectedEvents]), sorted([event.split(",")[0] for event in originalEvents]))
+
+
+	def test_integration_objectLedger(self):
+
+		# Set vars for CloudTrail
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudtrail"
+		self.lambda_module.SPLUNK_JSON_FORMAT = "eventsInRecords"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "eventTime"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+
+		# Create a DynamoDB table for the ledger
+		boto3.client('dynamodb').create_table(TableName="object-ledger", AttributeDefinitions=[{"AttributeName": "objectId", "AttributeType": "S"}], KeySchema=[{"AttributeName": "objectId", "KeyType": "HASH"}], BillingMode="PAY_PER_REQUEST")
+		self.lambda_module.dynamodbClient = None
+
+		# Keep the ledger in a local directory and in DynamoDB
+		for objectLedger in ["/tmp/object-ledger", "dynamodb://object-ledger"]:
+			self.lambda_module.LAMBDA_OBJECT_LEDGER = objectLedger
+			boto3.client('s3').upload_file("test-fixtures/sample-cloudtrail.json.gz", self.bucket_name, "ledger/sample-cloudtrail.json.gz")
+
+			# Verify the object is sent the first time
+			self.lambda_module.handler(self.createTestEvent("ledger/sample-cloudtrail.json.gz"), "none")
+			self.assertEqual(len(self.readFirehoseOutput()), 14)
+
+			# Verify a redelivered message is skipped without downloading the object
+			with unittest.mock.patch.object(self.lambda_module, "downloadS3Object") as downloadS3Object:
+				self.assertEqual(self.lambda_module.handler(self.createTestEvent("ledger/sample-cloudtrail.json.gz"), "none"), {"batchItemFailures": []})
+				downloadS3Object.assert_not_called()
+			self.assertEqual(self.readFirehoseOutput(), [])
+
+			# Verify a new version of the object is sent, using the ETag from the S3 notification
+			with gzip.open("test-fixtures/sample-cloudtrail.json.gz", "rt") as f:
+				records = json.load(f)["Records"]
+			boto3.client('s3').put_object(Bucket=self.bucket_name, Key="ledger/sample-cloudtrail.json.gz", Body=gzip.compress(json.dumps({"Records": records[:3]}).encode("utf-8")))
+			event = self.createTestEvent("ledger/sample-cloudtrail.json.gz")
+			event['Records'][0]['body'] = json.dumps({"Records": [{"eventSource": "aws:s3", "s3": {"bucket": {"name": self.bucket_name}, "object": {"key": "ledger/sample-cloudtrail.json.gz", "eTag": "new-etag"}}}]})
+			self.lambda_module.handler(event, "none")
+			self.assertEqual(len(self.readFirehoseOutput()), 3)
+			self.assertTrue(self.lambda_module.isInLedger(self.bucket_name + "/ledger/sample-cloudtrail.json.gz/new-etag/"))
+
+			# Verify objects that couldn't be sent aren't recorded
+			self.lambda_module.handler(self.createTestEvent("non-existent-file.log"), "none")
+			self.assertIsNone(self.lambda_module.retrieveLedgerKey(self.createTestEvent("non-existent-file.log")['Records'][0], {"bucket": self.bucket_name, "key": "non-existent-file.log"}))
+
+
+	def test_integration_checkpoints(self):
+
+		# Set vars for CloudTrail
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudtrail"
+		self.lambda_module.SPLUNK_JSON_FORMAT = "eventsInRecords"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "eventTime"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+
+		# Create a queue for continuation messages
+		self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL = boto3.client('sqs').create_queue(QueueName="continuation-queue")['QueueUrl']
+		self.lambda_module.sqsClient = None
+
+		# Leave no time before the deadline, so every chunk of events ends at a checkpoint
+		context = unittest.mock.Mock()
+		context.get_remaining_time_in_millis.return_value = 0
+
+		with unittest.mock.patch.object(self.lambda_module, "timestampChunkSize", 5):
+
+			# Verify the first invocation stops at a checkpoint and queues a continuation message
+			self.assertEqual(self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), context), {"batchItemFailures": []})
+			self.assertEqual(len(self.readFirehoseOutput()), 5)
+			messages = boto3.client('sqs').receive_message(QueueUrl=self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL, MaxNumberOfMessages=10).get('Messages', [])
+			self.assertEqual(len(messages), 1)
+			self.assertEqual(json.loads(messages[0]['Body'])["resumeFromEvent"], 5)
+
+			# Verify the continuation messages send the rest of the events once each
+			events = []
+			while len(messages) > 0:
+				self.assertEqual(self.lambda_module.handler({'Records': [{'messageId': messages[0]['MessageId'], 'receiptHandle': messages[0]['ReceiptHandle'], 'body': messages[0]['Body'], 'eventSource': 'aws:sqs'}]}, context), {"batchItemFailures": []})
+				boto3.client('sqs').delete_message(QueueUrl=self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL, ReceiptHandle=messages[0]['ReceiptHandle'])
+				events += self.readFirehoseOutput()
+				messages = boto3.client('sqs').receive_message(QueueUrl=self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL, MaxNumberOfMessages=10).get('Messages', [])
+			self.assertEqual(len(events), 9)
+
+		# Verify objects finish without a checkpoint when there's time left
+		context.get_remaining_time_in_millis.return_value = 900000
+		self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), context)
+		self.assertEqual(len(self.readFirehoseOutput()), 14)
+		self.assertEqual(boto3.client('sqs').receive_message(QueueUrl=self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL).get('Messages', []), [])
+
+		# Set vars for an uncompressed log file with a header line
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudwatchlogs:vpcflow"
+		self.lambda_module.SPLUNK_EVENT_DELIMITER = "space"
+		self.lambda_module.SPLUNK_IGNORE_FIRST_LINE = "true"
+		self.lambda_module.SPLUNK_TIME_DELINEATED_FIELD = "1"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "delineated-epoch"
+		logLines = ["id start"] + [str(i) + " " + str(1672531200 + i) for i in range(12)]
+		boto3.client('s3').put_object(Bucket=self.bucket_name, Key="checkpoint.log", Body=("\n".join(logLines) + "\n").encode("utf-8"))
+		self.lambda_module.handler(self.createTestEvent("checkpoint.log"), context)
+		expectedEvents = self.readFirehoseOutput()
+
+		# Verify uncompressed objects are continued from the byte after the last line sent, with a ranged download. Objects that aren't streamed are streamed once they're continued.
+		context.get_remaining_time_in_millis.return_value = 0
+		for streamingMode, firstCheckpoint in [("false", {"resumeFromEvent": 5}), ("true", {"resumeFromByte": len("\n".join(logLines[:6]) + "\n")})]:
+			self.lambda_module.LAMBDA_STREAMING_MODE = streamingMode
+			with unittest.mock.patch.object(self.lambda_module, "timestampChunkSize", 5):
+				self.lambda_module.handler(self.createTestEvent("checkpoint.log"), context)
+				events = self.readFirehoseOutput()
+				checkpoints = []
+				messages = boto3.client('sqs').receive_message(QueueUrl=self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL, MaxNumberOfMessages=10).get('Messages', [])
+				while len(messages) > 0:
+					checkpoints.append({name: value for name, value in json.loads(messages[0]['Body']).items() if name.startswith("resumeFrom")})
+					with unittest.mock.patch.object(self.lambda_module.s3Client, "get_object", wraps=self.lambda_module.s3Client.get_object) as getObject:
+						self.lambda_module.handler({'Records': [{'messageId': messages[0]['MessageId'], 'receiptHandle': messages[0]['ReceiptHandle'], 'body': messages[0]['Body'], 'eventSource': 'aws:sqs'}]}, context)
+					if "resumeFromByte" in checkpoints[-1] and getObject.call_count > 0:
+						self.assertEqual(getObject.call_args.kwargs["Range"], "bytes=" + str(checkpoints[-1]["resumeFromByte"]) + "-")
+					boto3.client('sqs').delete_message(QueueUrl=self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL, ReceiptHandle=messages[0]['ReceiptHandle'])
+					events += self.readFirehoseOutput()
+					messages = boto3.client('sqs').receive_message(QueueUrl=self.lambda_module.LAMBDA_CONTINUATION_QUEUE_URL, MaxNumberOfMessages=10).get('Messages', [])
+
+			self.assertEqual(sorted([event.strip("{} ") for event in events]), sorted([event.strip("{} ") for event in expectedEvents]))
+			self.assertEqual(checkpoints[0], firstCheckpoint)
+			self.assertEqual(checkpoints[1], {"resumeFromByte": len("\n".join(logLines[:11]) + "\n")})
+
+
+	def test_integration_metrics(self):
+
+		# Set vars for CloudTrail
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudtrail"
+		self.lambda_module.SPLUNK_JSON_FORMAT = "eventsInRecords"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "eventTime"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+		self.lambda_module.LAMBDA_METRICS_NAMESPACE = "SplunkAWSGDIToolkit"
+
+		# Send test event to handler, sending in the foreground and from sender threads
+		for senderThreads in ["0", "2"]:
+			self.lambda_module.LAMBDA_FIREHOSE_SENDER_THREADS = senderThreads
+			with unittest.mock.patch("builtins.print") as mockPrint:
+				self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+			self.assertEqual(len(self.readFirehoseOutput()), 14)
+
+			# Verify one EMF line was printed for the object, with every metric declared
+			metricsLogs = [json.loads(call.args[0]) for call in mockPrint.call_args_list if call.args[0].startswith('{"_aws"')]
+			self.assertEqual(len(metricsLogs), 1)
+			metricsLog = metricsLogs[0]
+			self.assertEqual(metricsLog["_aws"]["CloudWatchMetrics"][0]["Namespace"], "SplunkAWSGDIToolkit")
+			self.assertEqual(metricsLog["_aws"]["CloudWatchMetrics"][0]["Dimensions"], [["sourcetype"]])
+			self.assertEqual([metric["Name"] for metric in metricsLog["_aws"]["CloudWatchMetrics"][0]["Metrics"]], list(self.lambda_module.metricUnits.keys()))
+			self.assertEqual(metricsLog["sourcetype"], "aws:cloudtrail")
+			self.assertEqual(metricsLog["filePath"], "s3://" + self.bucket_name + "/sample-cloudtrail.json.gz")
+
+			# Verify the counts match what was sent
+			self.assertEqual(metricsLog["Events"], 14)
+			self.assertEqual(metricsLog["FirehoseRecords"], 14)
+			self.assertEqual(metricsLog["FirehoseBatches"], 1)
+			self.assertEqual(metricsLog["FirehoseRetries"], 0)
+			self.assertEqual(metricsLog["TimestampFallbacks"], 0)
+			self.assertEqual(metricsLog["ObjectBytes"], os.path.getsize("test-fixtures/sample-cloudtrail.json.gz"))
+			self.assertGreater(metricsLog["FirehoseBytes"], 0)
+			self.assertGreaterEqual(metricsLog["ObjectTime"], metricsLog["DownloadTime"])
+
+		# Verify events whose timestamps can't be extracted are counted
+		self.lambda_module.SPLUNK_TIME_PREFIX = "notAField"
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+		metricsLogs = [json.loads(call.args[0]) for call in mockPrint.call_args_list if call.args[0].startswith('{"_aws"')]
+		self.assertEqual(metricsLogs[0]["TimestampFallbacks"], 14)
+
+		# Verify nothing is printed when metrics aren't enabled
+		self.lambda_module.LAMBDA_METRICS_NAMESPACE = ""
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+		self.assertEqual([call for call in mockPrint.call_args_list if call.args[0].startswith('{"_aws"')], [])
+
+
+	def test_integration_timestampFallbackLogging(self):
+
+		# Set vars for CloudTrail, with a time prefix that isn't in the events
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudtrail"
+		self.lambda_module.SPLUNK_JSON_FORMAT = "eventsInRecords"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "notAField"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+
+		# Verify every event is sent, and the fallback is logged once for the invocation instead of once for each event
+		with unittest.mock.patch("builtins.print") as mockPrint:
+			self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+		self.assertEqual(len(self.readFirehoseOutput()), 14)
+		fallbackLines = [call.args[0] for call in mockPrint.call_args_list if call.args[0].startswith("Unable to extract timestamp")]
+		self.assertEqual(len(fallbackLines), 1)
+		self.assertTrue(fallbackLines[0].startswith("Unable to extract timestamp.  Falling back to current time. (14 times). Examples: "))
+
+
+	def test_integration_routingTable(self):
+
+		cloudTrailProfile = {"SPLUNK_SOURCETYPE": "aws:cloudtrail", "SPLUNK_JSON_FORMAT": "eventsInRecords", "SPLUNK_TIME_PREFIX": "eventTime", "SPLUNK_TIME_FORMAT": "prefix-ISO8601", "SPLUNK_INDEX": "aws"}
+		vpcFlowProfile = {"SPLUNK_SOURCETYPE": "aws:cloudwatchlogs:vpcflow", "SPLUNK_EVENT_DELIMITER": "space", "SPLUNK_IGNORE_FIRST_LINE": "true", "SPLUNK_TIME_DELINEATED_FIELD": "10", "SPLUNK_TIME_FORMAT": "delineated-epoch"}
+
+		# Send each object with the function configured for it
+		for setting, value in cloudTrailProfile.items():
+			setattr(self.lambda_module, setting, value)
+		self.lambda_module.handler(self.createTestEvent("sample-cloudtrail.json.gz"), "none")
+		for setting in cloudTrailProfile.keys():
+			setattr(self.lambda_module, setting, "main")
+		for setting, value in vpcFlowProfile.items():
+			setattr(self.lambda_module, setting, value)
+		self.lambda_module.handler(self.createTestEvent("sample-vpcflow.log.gz"), "none")
+		expectedEvents = self.readFirehoseOutput()
+
+		# Send both objects in one invocation, with CloudTrail objects routed to their profile
+		self.lambda_module.LAMBDA_ROUTING_TABLE = json.dumps([{"bucket": self.bucket_name, "keyPrefix": "sample-cloudtrail", "profile": cloudTrailProfile}])
+		event = {"Records": self.createTestEvent("sample-cloudtrail.json.gz")["Records"] + self.createTestEvent("sample-vpcflow.log.gz")["Records"]}
+		for concurrentObjects in ["1", "2"]:
+			self.lambda_module.LAMBDA_CONCURRENT_OBJECTS = concurrentObjects
+			self.assertEqual(self.lambda_module.handler(event, "none"), {"batchItemFailures": []})
+			self.assertEqual(self.readFirehoseOutput(), expectedEvents)
+
+	def test_replaySpilledBatches_partial(self):
+
+		self.lambda_module.LAMBDA_SPILL_LOCATION = "s3://" + self.bucket_name + "/spill"
+		self.assertTrue(self.lambda_module.spillToS3([{"Data": b"event1"}, {"Data": b"event2"}, {"Data": b"event3"}, {"Data": b"event4"}], "object1.tgz", 1).startswith("Spilled 4 records"))
+
+		# Accept only the first record, and note the rate the replay sends at
+		sentBatches = []
+		replayRates = []
+		def putRecordBatch(**kwargs):
+			sentBatches.append([record["Data"] for record in kwargs["Records"]])
+			replayRates.append(self.lambda_module.firehoseRateLimiter["bytesPerSecond"])
+			return {"FailedPutCount": len(kwargs["Records"]) - (1 if len(sentBatches) == 1 else 0), "RequestResponses": [{"RecordId": "1"} if len(sentBatches) == 1 and index == 0 else {"ErrorCode": "InternalFailure", "ErrorMessage": "Internal failure."} for index in range(len(kwargs["Records"]))]}
+		firehoseClient = self.lambda_module.firehoseClient
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatch)
+		self.lambda_module.retrieveFirehoseRateLimiter()["bytesPerSecond"] = 0.0
+		with unittest.mock.patch("time.sleep"), unittest.mock.patch("builtins.print") as mockPrint:
+			result = self.lambda_module.handler({"replaySpill": {}}, "none")
+		self.lambda_module.firehoseClient = firehoseClient
+
+		self.assertEqual(result, {"replayedBatches": 0, "replayedRecords": 1, "remainingBatches": 1})
+		self.assertEqual(sentBatches[1], [b"event2", b"event3", b"event4"])
+		self.assertFalse(any("Dropping" in str(call[0][0]) for call in mockPrint.call_args_list))
+
+		# The replay is limited to its default rate, and the function's own rate comes back afterwards
+		self.assertEqual(max(replayRates), self.lambda_module.replayBytesPerSecond)
+		self.assertEqual(self.lambda_module.firehoseRateLimiter["bytesPerSecond"], 0.0)
+		self.assertEqual(self.lambda_module.firehoseRateLimiter["maxBytesPerSecond"], 0.0)
+
+		# Only the records that weren't sent are kept for the next replay
+		s3Client = boto3.client('s3')
+		spilledObjects = s3Client.list_objects_v2(Bucket=self.bucket_name, Prefix="spill/")['Contents']
+		self.assertEqual(len(spilledObjects), 1)
+		spill = json.loads(gzip.decompress(s3Client.get_object(Bucket=self.bucket_name, Key=spilledObjects[0]["Key"])["Body"].read()))
+		self.assertEqual(spill["records"], [base64.b64encode(data).decode("utf-8") for data in [b"event2", b"event3", b"event4"]])
+
+
+	def test_integration_spill(self):
+
+		# Set vars for VPC flow logs
+		self.lambda_module.SPLUNK_EVENT_DELIMITER = "space"
+		self.lambda_module.SPLUNK_IGNORE_FIRST_LINE = "true"
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudwatchlogs:vpcflow"
+		self.lambda_module.SPLUNK_TIME_DELINEATED_FIELD = "10"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "delineated-epoch"
+		self.lambda_module.handler(self.createTestEvent("sample-vpcflow.log.gz"), "none")
+		expectedEvents = self.readFirehoseOutput()
+
+		# Spill batches Firehose doesn't take after two attempts, and finish the object instead of retrying it
+		self.lambda_module.LAMBDA_SPILL_LOCATION = "s3://" + self.bucket_name + "/spill"
+		self.lambda_module.LAMBDA_SPILL_AFTER_ATTEMPTS = "2"
+		sendAttempts = []
+		def putRecordBatch(**kwargs):
+			sendAttempts.append(len(kwargs["Records"]))
+			raise Exception("Firehose unavailable")
+		firehoseClient = self.lambda_module.firehoseClient
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatch)
+		with unittest.mock.patch("time.sleep"):
+			result = self.lambda_module.handler(self.createTestEvent("sample-vpcflow.log.gz"), "none")
+		self.lambda_module.firehoseClient = firehoseClient
+
+		self.assertEqual(result, {"batchItemFailures": []})
+		self.assertEqual(sendAttempts, [500, 500, 306, 306])
+		s3Client = boto3.client('s3')
+		self.assertEqual(s3Client.list_objects_v2(Bucket=self.bucket_name, Prefix="spill/")['KeyCount'], 2)
+		self.assertEqual(self.readFirehoseOutput(), [])
+
+		# Replay the spilled batches once Firehose takes it, removing it from the spill location
+		self.assertEqual(self.lambda_module.handler({"replaySpill": {"maxBytesPerSecond": 10485760}}, "none"), {"replayedBatches": 2, "replayedRecords": len(expectedEvents), "remainingBatches": 0})
+		self.assertEqual(s3Client.list_objects_v2(Bucket=self.bucket_name, Prefix="spill/")['KeyCount'], 0)
+		self.assertEqual(self.readFirehoseOutput(), expectedEvents)
+
+		# Without a spill location, records are dropped and the object is retried
+		self.lambda_module.LAMBDA_SPILL_LOCATION = ""
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatch)
+		with unittest.mock.patch("time.sleep"):
+			result = self.lambda_module.handler(self.createTestEvent("sample-vpcflow.log.gz"), "none")
+		self.lambda_module.firehoseClient = firehoseClient
+		self.assertEqual(result, {"batchItemFailures": [{"itemIdentifier": "messageId"}]})
+
+	def test_integration_errorResetsRecordBatch(self):
+
+		# Set vars for CloudTrail
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudtrail"
+		self.lambda_module.SPLUNK_JSON_FORMAT = "eventsInRecords"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "eventTime"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+
+		# Upload a Parquet file with the same time field
+		table = pyarrow.table({"eventTime": ["2023-01-01T00:00:" + str(i).zfill(2) + "Z" for i in range(12)], "eventName": ["event" + str(i) for i in range(12)]})
+		pyarrow.parquet.write_table(table, "/tmp/test.parquet")
+		boto3.client('s3').upload_file("/tmp/test.parquet", self.bucket_name, "test.parquet")
+
+		# Fail part way through an object, after its first chunk of events is buffered
+		getTimestamps = self.lambda_module.getTimestamps
+		chunks = []
+		def failAfterFirstChunk(*args):
+			chunks.append(args[0])
+			if len(chunks) > 1:
+				raise Exception("Unexpected error")
+			return getTimestamps(*args)
+
+		# Streamed objects, Parquet objects, and everything else catch the error in different places
+		for key, streamingMode in [("sample-cloudtrail.json.gz", "false"), ("sample-cloudtrail.json.gz", "true"), ("test.parquet", "false")]:
+			self.lambda_module.LAMBDA_STREAMING_MODE = streamingMode
+			self.lambda_module.handler(self.createTestEvent(key), "none")
+			expectedEvents = self.readFirehoseOutput()
+
+			for senderThreads in ["0", "2"]:
+				self.lambda_module.LAMBDA_FIREHOSE_SENDER_THREADS = senderThreads
+				chunks.clear()
+
+				with unittest.mock.patch.object(self.lambda_module, "timestampChunkSize", 5), unittest.mock.patch.object(self.lambda_module, "getTimestamps", side_effect=failAfterFirstChunk):
+					with unittest.mock.patch("builtins.print"):
+						self.assertEqual(self.lambda_module.handler(self.createTestEvent(key), "none"), {"batchItemFailures": [{"itemIdentifier": "messageId"}]})
+
+				# Verify none of the failed object's buffered events are sent, on their own or with the next object's
+				self.assertEqual(self.readFirehoseOutput(), [])
+				self.lambda_module.LAMBDA_FIREHOSE_SENDER_THREADS = "0"
+				self.lambda_module.handler(self.createTestEvent(key), "none")
+				self.assertEqual(self.readFirehoseOutput(), expectedEvents)
+
 	def test_integration_vpcflow(self):
 
 		# Set vars for CloudTrail
@@ -561,15 +1522,430 @@ class S3_SQS_Lambda_Firehose_Tests(unittest.TestCase):
 
 		self.assertEqual(str(file1), hecS3AccessLog)
 
+	def test_streamUncompress(self):
+
+		# Read the compressed test file in small chunks, so the compressed stream is split across many reads
+		with open("test-fixtures/testFile1.log.gz", 'rb') as file:
+			compressedFile = file.read()
+		with open("test-fixtures/testFile1.log", 'rb') as file:
+			originalFile = file.read()
+		chunks = [compressedFile[i:i + 7] for i in range(0, len(compressedFile), 7)]
+
+		# Test with gz and gzip files
+		self.assertEqual(b"".join(self.lambda_module.streamUncompress(chunks, "gz")), originalFile)
+		self.assertEqual(b"".join(self.lambda_module.streamUncompress(chunks, "gzip")), originalFile)
+
+		# Test with multiple gzip members concatenated together
+		self.assertEqual(b"".join(self.lambda_module.streamUncompress([compressedFile + compressedFile], "gz")), originalFile + originalFile)
+
+		# Test with uncompressed files, should pass through
+		self.assertEqual(b"".join(self.lambda_module.streamUncompress([originalFile], "log")), originalFile)
+
+		# Test with a truncated file
+		with self.assertRaises(EOFError):
+			b"".join(self.lambda_module.streamUncompress([compressedFile[:-10]], "gz"))
+
+
+	def test_streamEventBreak(self):
+
+		events = "version account-id action\n2 841154226728 ACCEPT\r\n2 841154226728 REJECT\n\n2 841154226728 ACCEPT\n"
+		chunks = [events.encode()[i:i + 5] for i in range(0, len(events), 5)]
+
+		# Test with log files, removing and leaving first line, should match eventBreak
+		self.assertEqual(list(self.lambda_module.streamEventBreak(chunks, "log", "true")), self.lambda_module.eventBreak(events.replace("\r\n", "\n"), "log", "true"))
+		self.assertEqual(list(self.lambda_module.streamEventBreak(chunks, "csv", "false")), self.lambda_module.eventBreak(events.replace("\r\n", "\n"), "csv", "false"))
+
+		# Test with a file that doesn't end with a new line
+		self.assertEqual(list(self.lambda_module.streamEventBreak([b"line1\nli", b"ne2"], "log", "false")), ["line1", "line2"])
+
+		# Test with multi-byte characters split across chunks
+		self.assertEqual(list(self.lambda_module.streamEventBreak(["caf\u00e9\n\u00fcber\n".encode()[0:4], "caf\u00e9\n\u00fcber\n".encode()[4:]], "log", "false")), ["caf\u00e9", "\u00fcber"])
+
+		# Test counting the bytes read up to the end of each line, with the same lines as without counting
+		for events in ["version account-id action\n2 841154226728 ACCEPT\r\n2 841154226728 REJECT\rcaf\u00e9\n\n2 841154226728 ACCEPT\n", "line1\nline2\r"]:
+			chunks = [events.encode()[i:i + 5] for i in range(0, len(events.encode()), 5)]
+			bytesRead = [0]
+			lineEnds = [(line, bytesRead[0]) for line in self.lambda_module.chunksToTrackedLines(chunks, bytesRead)]
+			self.assertEqual([line for line, lineEnd in lineEnds], list(self.lambda_module.chunksToLines(chunks)))
+			self.assertEqual(bytesRead[0], len(events.encode()))
+		self.assertEqual(lineEnds, [("line1", 6), ("line2", 12)])
+
+		# Test that each line split out by "\r" counts only the bytes up to its own end, so a checkpoint between them doesn't skip events
+		bytesRead = [0]
+		self.assertEqual([(line, bytesRead[0]) for line in self.lambda_module.chunksToTrackedLines([b"a\rbc\r\rd\r\n", b"e"], bytesRead)], [("a", 2), ("bc", 5), ("", 6), ("d", 9), ("e", 10)])
+
+		# Test with json, eventInRecords format
+		self.lambda_module.SPLUNK_JSON_FORMAT = "eventsInRecords"
+		with open("test-fixtures/sample-cloudtrail.json.gz", 'rb') as file:
+			cloudTrailEvents = gzip.decompress(file.read())
+		chunks = [cloudTrailEvents[i:i + 100] for i in range(0, len(cloudTrailEvents), 100)]
+		self.assertEqual(list(self.lambda_module.streamEventBreak(chunks, "json", "false")), json.loads(cloudTrailEvents)["Records"])
+		self.assertEqual(list(self.lambda_module.streamEventBreak([b'{"Records": [ {"a": 1}, {"b": "\\u00e9]"} ], "other": 1}'], "json", "false")), [{"a": 1}, {"b": "\u00e9]"}])
+		self.assertEqual(list(self.lambda_module.streamEventBreak([b'{"other": 1, "Records": [{"a": 1}]}'], "json", "false")), [{"a": 1}])
+		self.assertEqual(list(self.lambda_module.streamEventBreak([b'{"Records": []}'], "json", "false")), [])
+
+		# Test with json, NDJSON format
+		self.lambda_module.SPLUNK_JSON_FORMAT = "NDJSON"
+		self.assertEqual(list(self.lambda_module.streamEventBreak([b'{"a": 1}\n{"b', b'": 2}\n'], "jsonl", "false")), ['{"a": 1}', '{"b": 2}'])
+
+		# Test with an invalid file type
+		self.assertEqual(self.lambda_module.streamEventBreak([b""], "md", "false"), "File type invalid")
+
+
+	def test_parquetEventBreak(self):
+
+		# Write a Parquet file with a few column types and null values, split across multiple row groups
+		table = pyarrow.table({"name": ["a/b", None, "c"], "count": [1, None, 3], "cost": [1.5, 2.25, None], "start": [datetime.datetime(2023, 1, 1, 1, 2, 3), None, datetime.datetime(2023, 1, 2)], "day": [datetime.date(2023, 1, 2), None, None], "amount": [decimal.Decimal("1.10"), None, None]})
+		pyarrow.parquet.write_table(table, "/tmp/test.parquet", row_group_size=2)
+
+		self.assertEqual(list(self.lambda_module.parquetEventBreak("/tmp/test.parquet")), [
+			'{"name":"a/b","count":1,"cost":1.5,"start":1672534923000,"day":1672617600000,"amount":"1.10"}',
+			'{"name":null,"count":null,"cost":2.25,"start":null,"day":null,"amount":null}',
+			'{"name":"c","count":3,"cost":null,"start":1672617600000,"day":null,"amount":null}'
+		])
+
+	def test_parquetEventBreak_nonFinite(self):
+
+		# Write a Parquet file with NaN and infinite floats, including inside a list, which JSON can't represent
+		table = pyarrow.table({"a": [float("nan"), float("inf"), -float("inf"), 1.5], "b": [[float("nan"), 2.0], None, [], [float("inf")]]})
+		pyarrow.parquet.write_table(table, "/tmp/test.parquet")
+
+		# They should be written as null, the same as pandas' to_json
+		self.assertEqual(list(self.lambda_module.parquetEventBreak("/tmp/test.parquet")), [
+			'{"a":null,"b":[null,2.0]}',
+			'{"a":null,"b":null}',
+			'{"a":null,"b":[]}',
+			'{"a":1.5,"b":[null]}'
+		])
+
+
+	def test_integration_parquet(self):
+
+		# Set vars for Parquet
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:billing:cur"
+		self.lambda_module.SPLUNK_JSON_FORMAT = "NDJSON"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "line_item_usage_start_date"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-epoch"
+
+		# Upload a Parquet file with more rows than a single record batch
+		rowCount = self.lambda_module.parquetBatchSize + 5
+		table = pyarrow.table({"identity_line_item_id": [str(i) for i in range(rowCount)], "line_item_usage_start_date": [datetime.datetime(2023, 1, 1)] * rowCount})
+		pyarrow.parquet.write_table(table, "/tmp/cur-00001.snappy.parquet")
+		boto3.client('s3').upload_file("/tmp/cur-00001.snappy.parquet", self.bucket_name, "cur/cur-00001.snappy.parquet")
+		os.remove("/tmp/cur-00001.snappy.parquet")
+
+		# Send test event to handler, in both modes
+		for streamingMode in ["false", "true"]:
+			self.lambda_module.LAMBDA_STREAMING_MODE = streamingMode
+			self.lambda_module.handler(self.createTestEvent("cur/cur-00001.snappy.parquet"), "none")
+
+			# Verify every row was sent, with the timestamp from the row
+			events = self.readFirehoseOutput()
+			self.assertEqual(len(events), rowCount)
+			self.assertIn(' "time": 1672531200.0, "host": "main", "source": "main", "sourcetype": "aws:billing:cur", "index": "main", "event":  "{\\"identity_line_item_id\\":\\"42\\",\\"line_item_usage_start_date\\":1672531200000}" ', "}{".join(events))
+
+			# Verify the file was removed from /tmp
+			self.assertEqual(glob.glob("/tmp/**/cur-00001*", recursive=True), [])
+
+
+	def test_integration_columnarCsv(self):
+
+		# Set vars for CUR CSV files
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:billing:cur"
+		self.lambda_module.SPLUNK_CSV_TO_JSON = "true"
+		self.lambda_module.SPLUNK_REMOVE_EMPTY_CSV_TO_JSON_FIELDS = "true"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "UsageStartDate"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+
+		# Upload a CSV file with more lines than a single block
+		self.lambda_module.csvBlockSize = 1000
+		csvLines = ["identity/LineItemId,lineItem/UsageStartDate,lineItem/ResourceId"] + [str(i) + ",2023-01-01T00:00:00Z," + ("i-" + str(i) if i % 3 == 0 else "") for i in range(500)]
+		with gzip.open("/tmp/cur-00001.csv.gz", "wt") as f:
+			f.write("\n".join(csvLines) + "\n")
+		boto3.client('s3').upload_file("/tmp/cur-00001.csv.gz", self.bucket_name, "cur/cur-00001.csv.gz")
+		os.remove("/tmp/cur-00001.csv.gz")
+
+		# Process the file one line at a time
+		self.lambda_module.handler(self.createTestEvent("cur/cur-00001.csv.gz"), "none")
+		expectedEvents = self.readFirehoseOutput()
+		self.assertEqual(len(expectedEvents), 500)
+
+		# Process the file a block at a time, in both modes, and verify the events sent to Firehose are the same
+		self.lambda_module.LAMBDA_COLUMNAR_CSV = "true"
+		for streamingMode in ["false", "true"]:
+			self.lambda_module.LAMBDA_STREAMING_MODE = streamingMode
+			self.lambda_module.handler(self.createTestEvent("cur/cur-00001.csv.gz"), "none")
+			self.assertEqual(self.readFirehoseOutput(), expectedEvents)
+
+			# Verify the file was removed from /tmp
+			self.assertEqual(glob.glob("/tmp/**/cur-00001*", recursive=True), [])
+
+		self.lambda_module.csvBlockSize = 4194304
+
+
+	def test_integration_incrementalCur(self):
+
+		# Set vars for CUR CSV files
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:billing:cur"
+		self.lambda_module.SPLUNK_CSV_TO_JSON = "true"
+		self.lambda_module.SPLUNK_IGNORE_FIRST_LINE = "false"
+		self.lambda_module.SPLUNK_TIME_PREFIX = "UsageStartDate"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "prefix-ISO8601"
+
+		header = "identity/LineItemId,identity/TimeInterval,lineItem/UsageStartDate,lineItem/UnblendedCost"
+		firstVersion = [header] + [str(i) + ",2023-01-01T00:00:00Z/2023-01-01T01:00:00Z,2023-01-01T00:00:00Z," + str(i) for i in range(100)]
+		secondVersion = firstVersion[:50] + ["50,2023-01-01T00:00:00Z/2023-01-01T01:00:00Z,2023-01-01T00:00:00Z,0.5"] + firstVersion[52:] + ["100,2023-01-01T00:00:00Z/2023-01-01T01:00:00Z,2023-01-01T00:00:00Z,100"]
+
+		# Keep the fingerprint index in a local directory and in S3
+		for fingerprintLocation in ["/tmp/cur-fingerprints", "s3://" + self.bucket_name + "/cur-fingerprints"]:
+			self.lambda_module.LAMBDA_CUR_FINGERPRINT_LOCATION = fingerprintLocation
+
+			# Each version of the report is written under a new version folder
+			sentEvents = []
+			for version, csvLines in [("20230105T000000Z", firstVersion), ("20230106T000000Z", secondVersion), ("20230107T000000Z", secondVersion)]:
+				key = "cur/report/20230101-20230201/" + version + "/report-00001.csv.gz"
+				boto3.client('s3').put_object(Bucket=self.bucket_name, Key=key, Body=gzip.compress(("\n".join(csvLines) + "\n").encode("utf-8")))
+				self.lambda_module.handler(self.createTestEvent(key), "none")
+				sentEvents.append(self.readFirehoseOutput())
+
+			# Verify every line item is sent from the first version, then only the changed and new ones, then none
+			self.assertEqual(len(sentEvents[0]), 100)
+			self.assertEqual(len(sentEvents[1]), 2)
+			self.assertIn('"LineItemId": "50"', sentEvents[1][0] + sentEvents[1][1])
+			self.assertEqual(sentEvents[2], [])
+
+			# Verify a line item that moves to another part of the report isn't sent again, whichever part is processed first
+			for version, parts in [("20230108T000000Z", [("report-00002.csv.gz", [header, secondVersion[-1]]), ("report-00001.csv.gz", secondVersion[:-1])]), ("20230109T000000Z", [("report-00001.csv.gz", secondVersion), ("report-00002.csv.gz", [header])])]:
+				for partName, csvLines in parts:
+					key = "cur/report/20230101-20230201/" + version + "/" + partName
+					boto3.client('s3').put_object(Bucket=self.bucket_name, Key=key, Body=gzip.compress(("\n".join(csvLines) + "\n").encode("utf-8")))
+					self.lambda_module.handler(self.createTestEvent(key), "none")
+					self.assertEqual(self.readFirehoseOutput(), [])
+
+		shutil.rmtree("/tmp/cur-fingerprints")
+
+
+	def test_integration_streaming(self):
+
+		# Each test file and the settings needed to process it
+		testCases = [
+			("sample-cloudtrail.json.gz", {"SPLUNK_SOURCETYPE": "aws:cloudtrail", "SPLUNK_JSON_FORMAT": "eventsInRecords", "SPLUNK_TIME_PREFIX": "eventTime", "SPLUNK_TIME_FORMAT": "prefix-ISO8601"}),
+			("sample-vpcflow.log.gz", {"SPLUNK_EVENT_DELIMITER": "space", "SPLUNK_IGNORE_FIRST_LINE": "true", "SPLUNK_SOURCETYPE": "aws:cloudwatchlogs:vpcflow", "SPLUNK_TIME_DELINEATED_FIELD": "10", "SPLUNK_TIME_FORMAT": "delineated-epoch"}),
+			("sample-route53Resolver.log.gz", {"SPLUNK_SOURCETYPE": "aws:route53", "SPLUNK_TIME_PREFIX": "query_timestamp", "SPLUNK_TIME_FORMAT": "prefix-ISO8601", "SPLUNK_IGNORE_FIRST_LINE": "false"}),
+			("sample-s3ServerAccess", {"SPLUNK_SOURCETYPE": "aws:s3:accesslogs", "SPLUNK_TIME_FORMAT": "delineated-strftime", "SPLUNK_STRFTIME_FORMAT": "[%d/%b/%Y:%H:%M:%S", "SPLUNK_TIME_DELINEATED_FIELD": "2", "SPLUNK_EVENT_DELIMITER": "space", "SPLUNK_IGNORE_FIRST_LINE": "false"})
+		]
+
+		for testFile, settings in testCases:
+			for setting in settings.keys():
+				setattr(self.lambda_module, setting, settings[setting])
+
+			# Process the file by downloading it to /tmp
+			self.lambda_module.LAMBDA_STREAMING_MODE = "false"
+			self.lambda_module.handler(self.createTestEvent(testFile), "none")
+			downloadedEvents = self.readFirehoseOutput()
+
+			# Process the file by streaming it, and verify the events sent to Firehose are the same
+			self.lambda_module.LAMBDA_STREAMING_MODE = "true"
+			self.lambda_module.handler(self.createTestEvent(testFile), "none")
+			streamedEvents = self.readFirehoseOutput()
+
+			self.assertGreater(len(streamedEvents), 0)
+			self.assertEqual(streamedEvents, downloadedEvents)
+
+			# Verify nothing was left in /tmp
+			self.assertEqual(glob.glob("/tmp/**/" + testFile + "*", recursive=True), [])
+
+		# Test with a file that does not exist
+		self.lambda_module.handler(self.createTestEvent("non-existent-file.log"), "none")
+		self.assertEqual(self.readFirehoseOutput(), [])
+
+
+	def test_integration_rangedDownloads(self):
+
+		# Download the test files in small byte ranges, so lines and gzip members are cut across them
+		self.lambda_module.LAMBDA_STREAMING_MODE = "true"
+		self.lambda_module.rangedDownloadSize = 1000
+
+		testCases = [
+			("sample-vpcflow.log.gz", {"SPLUNK_EVENT_DELIMITER": "space", "SPLUNK_IGNORE_FIRST_LINE": "true", "SPLUNK_SOURCETYPE": "aws:cloudwatchlogs:vpcflow", "SPLUNK_TIME_DELINEATED_FIELD": "10", "SPLUNK_TIME_FORMAT": "delineated-epoch"}),
+			("sample-s3ServerAccess", {"SPLUNK_SOURCETYPE": "aws:s3:accesslogs", "SPLUNK_TIME_FORMAT": "delineated-strftime", "SPLUNK_STRFTIME_FORMAT": "[%d/%b/%Y:%H:%M:%S", "SPLUNK_TIME_DELINEATED_FIELD": "2", "SPLUNK_EVENT_DELIMITER": "space"})
+		]
+
+		for testFile, settings in testCases:
+			for setting in settings.keys():
+				setattr(self.lambda_module, setting, settings[setting])
+
+			# Verify the object is put back together in order
+			objectHead = self.lambda_module.retrieveS3ObjectHead(self.bucket_name, testFile)
+			self.assertEqual(b"".join(self.lambda_module.readRangedChunks(self.bucket_name, testFile, objectHead, 4)), boto3.client('s3').get_object(Bucket=self.bucket_name, Key=testFile)['Body'].read())
+
+			# Process the file as a single stream
+			self.lambda_module.LAMBDA_RANGED_DOWNLOAD_THREADS = "0"
+			self.lambda_module.handler(self.createTestEvent(testFile), "none")
+			streamedEvents = self.readFirehoseOutput()
+
+			# Process the file in byte ranges, and verify the events sent to Firehose are the same
+			self.lambda_module.LAMBDA_RANGED_DOWNLOAD_THREADS = "4"
+			self.lambda_module.handler(self.createTestEvent(testFile), "none")
+			self.assertGreater(len(streamedEvents), 0)
+			self.assertEqual(self.readFirehoseOutput(), streamedEvents)
+
+		# Verify the number of ranges at once follows the memory size
+		self.lambda_module.LAMBDA_RANGED_DOWNLOAD_THREADS = "auto"
+		with unittest.mock.patch.dict(os.environ, {"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "3008"}):
+			self.assertEqual(self.lambda_module.retrieveRangedDownloadThreads(), 5)
+
+		# Test with a file that does not exist
+		self.lambda_module.handler(self.createTestEvent("non-existent-file.log"), "none")
+		self.assertEqual(self.readFirehoseOutput(), [])
+
+		self.lambda_module.rangedDownloadSize = 8388608
+
+
+	def test_integration_inMemoryObjects(self):
+
+		# Each test file and the settings needed to process it
+		testCases = [
+			("sample-cloudtrail.json.gz", {"SPLUNK_SOURCETYPE": "aws:cloudtrail", "SPLUNK_JSON_FORMAT": "eventsInRecords", "SPLUNK_TIME_PREFIX": "eventTime", "SPLUNK_TIME_FORMAT": "prefix-ISO8601"}),
+			("sample-s3ServerAccess", {"SPLUNK_SOURCETYPE": "aws:s3:accesslogs", "SPLUNK_TIME_FORMAT": "delineated-strftime", "SPLUNK_STRFTIME_FORMAT": "[%d/%b/%Y:%H:%M:%S", "SPLUNK_TIME_DELINEATED_FIELD": "2", "SPLUNK_EVENT_DELIMITER": "space"})
+		]
+
+		for testFile, settings in testCases:
+			for setting in settings.keys():
+				setattr(self.lambda_module, setting, settings[setting])
+
+			# Process the file by downloading it to /tmp
+			self.lambda_module.LAMBDA_IN_MEMORY_OBJECT_BYTES = "0"
+			self.lambda_module.handler(self.createTestEvent(testFile), "none")
+			downloadedEvents = self.readFirehoseOutput()
+
+			# Process the file in memory, and verify the events sent to Firehose are the same and nothing was written to /tmp
+			self.lambda_module.LAMBDA_IN_MEMORY_OBJECT_BYTES = "1048576"
+			with unittest.mock.patch.object(self.lambda_module, "downloadS3Object") as downloadS3Object:
+				self.lambda_module.handler(self.createTestEvent(testFile), "none")
+				downloadS3Object.assert_not_called()
+
+			self.assertGreater(len(downloadedEvents), 0)
+			self.assertEqual(self.readFirehoseOutput(), downloadedEvents)
+
+		# Verify objects larger than the threshold are still downloaded to /tmp, using the size from the S3 notification
+		event = self.createTestEvent("sample-s3ServerAccess")
+		event['Records'][0]['body'] = json.dumps({"Records": [{"eventSource": "aws:s3", "s3": {"bucket": {"name": self.bucket_name}, "object": {"key": "sample-s3ServerAccess", "size": 2000000}}}]})
+		with unittest.mock.patch.object(self.lambda_module, "loadS3Object") as loadS3Object:
+			self.lambda_module.handler(event, "none")
+			loadS3Object.assert_not_called()
+		self.assertEqual(self.readFirehoseOutput(), downloadedEvents)
+		self.assertEqual(glob.glob("/tmp/**/sample-s3ServerAccess", recursive=True), [])
+
+
+	def test_integration_concurrentObjects(self):
+
+		# Set vars for VPC Flow Logs
+		self.lambda_module.SPLUNK_EVENT_DELIMITER = "space"
+		self.lambda_module.SPLUNK_IGNORE_FIRST_LINE = "true"
+		self.lambda_module.SPLUNK_SOURCETYPE = "aws:cloudwatchlogs:vpcflow"
+		self.lambda_module.SPLUNK_TIME_DELINEATED_FIELD = "10"
+		self.lambda_module.SPLUNK_TIME_FORMAT = "delineated-epoch"
+
+		# Copy the same file to several keys, two of which have the same file name
+		s3Client = boto3.client('s3')
+		testFiles = ["sample-vpcflow.log.gz", "a/sample-vpcflow.log.gz", "b/sample-vpcflow.log.gz", "c/sample-vpcflow-2.log.gz", "d/sample-vpcflow-3.log.gz"]
+		for testFile in testFiles:
+			s3Client.upload_file("test-fixtures/sample-vpcflow.log.gz", self.bucket_name, testFile)
+		event = {'Records': [self.createTestEvent(testFile)['Records'][0] for testFile in testFiles]}
+
+		# Process the objects one after another
+		self.lambda_module.handler(event, "none")
+		sequentialEvents = self.readFirehoseOutput()
+
+		# Process the objects at once, and verify the same events were sent to Firehose
+		self.lambda_module.LAMBDA_CONCURRENT_OBJECTS = "3"
+		self.lambda_module.LAMBDA_FIREHOSE_SENDER_THREADS = "2"
+		self.lambda_module.handler(event, "none")
+		concurrentEvents = self.readFirehoseOutput()
+
+		self.assertGreater(len(concurrentEvents), 0)
+		self.assertEqual(concurrentEvents, sequentialEvents)
+		self.assertEqual(self.lambda_module.recordBatch["records"], [])
+		self.assertEqual(glob.glob("/tmp/**/sample-vpcflow*", recursive=True), [])
+
+		# Verify objects bigger than the budget are still processed, one at a time
+		self.lambda_module.LAMBDA_CONCURRENT_OBJECT_BYTES = "1"
+		self.lambda_module.handler(event, "none")
+		self.assertEqual(self.readFirehoseOutput(), sequentialEvents)
+
+		# Verify compressed objects are estimated at their uncompressed size
+		body = {"Records": [{"s3": {"bucket": {"name": self.bucket_name}, "object": {"key": "object.log.gz", "size": 1000}}}]}
+		self.assertEqual(self.lambda_module.estimateObjectBytes({'body': json.dumps(body)}), 10000)
+		body["Records"][0]["s3"]["object"]["key"] = "object.log"
+		self.assertEqual(self.lambda_module.estimateObjectBytes({'body': json.dumps(body)}), 1000)
+		self.assertEqual(self.lambda_module.estimateObjectBytes({'body': "not json"}), 0)
+
+
+	def test_handler_batchItemFailures(self):
+
+		# One message for each outcome, with its own message ID
+		event = {'Records': []}
+		for testFile in ["testFile1.log", "non-existent-file.log", "unsupported-file.exe", "testdir/123/testFile2.log"]:
+			message = self.createTestEvent(testFile)['Records'][0]
+			message['messageId'] = testFile
+			event['Records'].append(message)
+		event['Records'].append({'messageId': 'no-s3-info', 'receiptHandle': 'receipt', 'body': '{}', 'eventSource': 'aws:sqs'})
+
+		# Only the object that couldn't be downloaded should be retried
+		sentEvents = []
+		for concurrentObjects in ["1", "3"]:
+			self.lambda_module.LAMBDA_CONCURRENT_OBJECTS = concurrentObjects
+			self.assertEqual(self.lambda_module.handler(event, "none"), {"batchItemFailures": [{"itemIdentifier": "non-existent-file.log"}]})
+			sentEvents.append(len(self.readFirehoseOutput()))
+		self.assertGreater(sentEvents[0], 0)
+		self.assertEqual(sentEvents[0], sentEvents[1])
+
+		# Objects whose events couldn't be sent to Firehose should be retried
+		def putRecordBatch(**kwargs):
+			raise Exception("Firehose unavailable")
+		firehoseClient = self.lambda_module.firehoseClient
+		self.lambda_module.firehoseClient = unittest.mock.Mock(put_record_batch=putRecordBatch)
+		with unittest.mock.patch("time.sleep"):
+			self.assertEqual(self.lambda_module.handler(event, "none"), {"batchItemFailures": [{"itemIdentifier": "testFile1.log"}, {"itemIdentifier": "non-existent-file.log"}, {"itemIdentifier": "testdir/123/testFile2.log"}]})
+		self.lambda_module.firehoseClient = firehoseClient
+
+		# An unexpected error should only fail its own message
+		self.lambda_module.LAMBDA_CONCURRENT_OBJECTS = "1"
+		with unittest.mock.patch.object(self.lambda_module, "sendEvents", side_effect=[Exception("Unexpected error"), None]):
+			self.assertEqual(self.lambda_module.handler(event, "none"), {"batchItemFailures": [{"itemIdentifier": "testFile1.log"}, {"itemIdentifier": "non-existent-file.log"}]})
+
+
+	# Create an SQS event for an object in the test bucket
+	def createTestEvent(self, key):
+
+		body = {"Records": [{"eventSource": "aws:s3", "s3": {"bucket": {"name": self.bucket_name}, "object": {"key": key}}}]}
+		return {'Records': [{'messageId': 'messageId', 'receiptHandle': 'receipt', 'body': json.dumps(body), 'eventSource': 'aws:sqs'}]}
+
+
+	# Return the sorted events Firehose delivered to S3, then delete the delivered objects
+	def readFirehoseOutput(self):
+
+		s3Client = boto3.client('s3')
+		events = []
+		for firehoseObject in s3Client.list_objects_v2(Bucket=self.bucket_name_firehose).get('Contents', []):
+			events += s3Client.get_object(Bucket=self.bucket_name_firehose, Key=firehoseObject['Key'])['Body'].read().decode().split("}{")
+			s3Client.delete_object(Bucket=self.bucket_name_firehose, Key=firehoseObject['Key'])
+
+		return sorted(events)
+
+
 	def tearDown(self):
 
 		# Stop moto
 		self.mock.stop()
 
-		# Delete all files in tmp
-		files = glob.glob('/tmp/*')
-		for file in files:
-			os.remove(file)
+		# Delete the function's scratch directories and the files the tests create in tmp, leaving anything else there alone
+		for path in glob.glob("/tmp/s3-*") + glob.glob("/tmp/vpcflow*.log") + ["/tmp/" + name for name in testTmpFiles]:
+			if os.path.isdir(path):
+				shutil.rmtree(path)
+			elif os.path.exists(path):
+				os.remove(path)
 
 
 if __name__ == '__main__':